@@ -0,0 +1,235 @@
+# app/admission.py
+"""
+Kiểm soát tải cho các endpoint nặng về CPU (decode/detect/encode).
+
+Mỗi request phải lấy một "slot" trước khi chạy pipeline. Có tối đa `max_in_flight`
+slot; request đến sau xếp hàng theo độ ưu tiên (đăng ký trước, nhận dạng sau, nhận
+dạng theo lô cuối cùng). Khi hàng đợi của một mức ưu tiên đã đầy, hoặc request chờ
+quá `max_wait` giây, request bị từ chối ngay với `Overloaded` (API trả 503 +
+Retry-After) thay vì nằm chờ trong uvicorn tới khi client timeout.
+
+Request nhận dạng theo lô được nhận bằng `admit_batch` trước khi đọc ảnh: tối đa
+`max_batches` lô cùng lúc, lô vượt giới hạn bị từ chối với `Overloaded`. Từng ảnh của
+một lô đã được nhận thì xếp hàng BATCH không giới hạn (`slot(BATCH, bounded=False)`).
+
+`run_while_connected` huỷ công việc (kể cả khi đang xếp hàng) của client đã ngắt kết nối.
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from . import config
+from . import metrics
+from . import workers
+
+# Độ ưu tiên: số nhỏ hơn được phục vụ trước
+REGISTER = 0
+RECOGNIZE = 1
+BATCH = 2
+PRIORITY_NAMES = {REGISTER: "register", RECOGNIZE: "recognize", BATCH: "batch"}
+
+REJECTED = metrics.registry.register(metrics.Counter(
+    "face_admission_rejected_total", "Số request bị từ chối (503) vì quá tải, theo độ ưu tiên và lý do.",
+    ("priority", "reason")))
+CANCELLED = metrics.registry.register(metrics.Counter(
+    "face_admission_cancelled_total", "Số request bị huỷ vì client đã ngắt kết nối, theo độ ưu tiên.",
+    ("priority",)))
+WAIT_DURATION = metrics.registry.register(metrics.Histogram(
+    "face_admission_wait_seconds", "Thời gian chờ slot xử lý, theo độ ưu tiên.", ("priority",)))
+
+T = TypeVar("T")
+
+
+class Overloaded(Exception):
+    """Không nhận thêm việc; thử lại sau `retry_after` giây."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class BatchTicket:
+    """Một lô ảnh đã được nhận; giữ chỗ của lô tới khi `release` (gọi nhiều lần cũng được)."""
+
+    def __init__(self, controller: "AdmissionController"):
+        self._controller = controller
+        self.waiting_images = 0 # Ảnh chưa vào hàng đợi slot (đang chờ giới hạn song song của lô)
+        self.released = False
+
+    def add_images(self, count: int) -> None:
+        self.waiting_images += count
+        self._controller.batch_backlog += count
+
+    def image_started(self) -> None:
+        if self.waiting_images:
+            self.waiting_images -= 1
+            self._controller.batch_backlog -= 1
+
+    def release(self) -> None:
+        if self.released:
+            return
+        self.released = True
+        self._controller.batch_backlog -= self.waiting_images
+        self.waiting_images = 0
+        self._controller.active_batches -= 1
+
+
+class AdmissionController:
+    """Semaphore có độ ưu tiên và hàng đợi giới hạn, dùng trong một event loop."""
+
+    def __init__(self, max_in_flight: int = 0, max_queue: int = config.ADMISSION_MAX_QUEUE,
+                 max_wait: float = config.ADMISSION_MAX_WAIT_SECONDS,
+                 max_batches: int = config.ADMISSION_MAX_BATCHES):
+        self._max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.max_batches = max_batches
+        self.in_flight = 0
+        self.active_batches = 0
+        self.batch_backlog = 0 # Ảnh của các lô đã nhận nhưng chưa vào hàng đợi slot
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = [] # heap (priority, seq, future)
+        self._queued: Dict[int, int] = {priority: 0 for priority in PRIORITY_NAMES}
+        self._seq = itertools.count()
+        self._avg_service_seconds = 0.5 # EWMA, dùng để ước lượng Retry-After
+
+    @property
+    def max_in_flight(self) -> int:
+        return self._max_in_flight or config.ADMISSION_MAX_IN_FLIGHT or 2 * workers.pool_size()
+
+    @property
+    def queued(self) -> int:
+        """Số request đang chờ slot, kể cả các ảnh của lô chưa vào hàng đợi."""
+        return sum(self._queued.values()) + self.batch_backlog
+
+    def queued_for(self, priority: int) -> int:
+        return self._queued[priority]
+
+    def retry_after(self) -> int:
+        """Ước lượng số giây đến khi hàng đợi hiện tại được xử lý hết."""
+        seconds = (self.queued + 1) * self._avg_service_seconds / self.max_in_flight
+        return max(1, min(60, int(math.ceil(seconds))))
+
+    def admit_batch(self) -> BatchTicket:
+        """Nhận một request theo lô, hoặc `Overloaded` nếu đã có `max_batches` lô đang chạy."""
+        if self.active_batches >= self.max_batches:
+            REJECTED.inc(PRIORITY_NAMES[BATCH], "batch_limit")
+            raise Overloaded(f"Server đang xử lý {self.active_batches} lô ảnh, vui lòng thử lại sau.",
+                             self.retry_after())
+        self.active_batches += 1
+        return BatchTicket(self)
+
+    @asynccontextmanager
+    async def slot(self, priority: int, bounded: bool = True) -> AsyncIterator[None]:
+        """
+        Giữ một slot trong suốt khối `async with`.
+        `bounded=False`: không giới hạn độ dài hàng đợi và thời gian chờ (dùng cho từng ảnh
+        của một request theo lô đã được nhận).
+        """
+        await self._acquire(priority, bounded)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._avg_service_seconds = 0.9 * self._avg_service_seconds + 0.1 * elapsed
+            self._release()
+
+    async def _acquire(self, priority: int, bounded: bool) -> None:
+        name = PRIORITY_NAMES[priority]
+        if self.in_flight < self.max_in_flight and not self._has_waiter_before(priority):
+            self.in_flight += 1
+            WAIT_DURATION.observe(0.0, name)
+            return
+        if bounded and self._queued[priority] >= self.max_queue:
+            REJECTED.inc(name, "queue_full")
+            raise Overloaded(f"Server đang quá tải ({self.queued} request đang chờ), vui lòng thử lại sau.",
+                             self.retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._queued[priority] += 1
+        start = time.perf_counter()
+        try:
+            if bounded and self.max_wait > 0:
+                await asyncio.wait_for(future, self.max_wait)
+            else:
+                await future
+        except asyncio.TimeoutError:
+            REJECTED.inc(name, "wait_timeout")
+            raise Overloaded(f"Request chờ quá {self.max_wait:g} giây trong hàng đợi, vui lòng thử lại sau.",
+                             self.retry_after())
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release() # Đã được cấp slot đúng lúc bị huỷ: trả lại cho request khác
+            raise
+        finally:
+            if not future.done() or future.cancelled():
+                self._queued[priority] -= 1 # Rời hàng đợi mà không được cấp slot
+            WAIT_DURATION.observe(time.perf_counter() - start, name)
+
+    def _release(self) -> None:
+        # Chuyển slot cho request chờ có độ ưu tiên cao nhất (bỏ qua các request đã huỷ/timeout)
+        while self._waiters:
+            priority, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self._queued[priority] -= 1
+            future.set_result(None)
+            return
+        self.in_flight -= 1
+
+    def _has_waiter_before(self, priority: int) -> bool:
+        return any(self._queued[p] for p in PRIORITY_NAMES if p <= priority)
+
+
+# Mã trạng thái (theo nginx) ghi nhận request mà client đã đóng trước khi có response
+CLIENT_CLOSED_REQUEST = 499
+
+
+async def run_admitted(request, priority: int, make_awaitable: Callable[[], Awaitable[T]]) -> Optional[T]:
+    """
+    Lấy slot với độ ưu tiên `priority` rồi chạy `make_awaitable()`, huỷ nếu client ngắt kết nối.
+    Overloaded nếu bị từ chối; None nếu client đã ngắt kết nối.
+    """
+    async def admitted() -> T:
+        async with controller.slot(priority):
+            return await make_awaitable()
+    return await run_while_connected(request, admitted(), priority)
+
+
+async def run_while_connected(request, awaitable: Awaitable[T], priority: int,
+                              poll_interval: float = 0.25) -> Optional[T]:
+    """
+    Chạy `awaitable`, huỷ nó nếu client của `request` ngắt kết nối trong lúc chờ hoặc xử lý.
+    Trả về None khi đã huỷ (không còn ai nhận response). Phần việc đã gửi sang worker pool
+    vẫn chạy nốt, nhưng các bước tiếp theo (và việc còn đang xếp hàng) bị bỏ.
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                CANCELLED.inc(PRIORITY_NAMES[priority])
+                return None
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+# Một instance dùng chung cho cả process
+controller = AdmissionController()
+metrics.register_callback("face_admission_in_flight", "Số request đang giữ slot xử lý.",
+                          lambda: controller.in_flight)
+metrics.register_callback("face_admission_queue_depth", "Số request (kể cả ảnh của các lô) đang chờ slot xử lý.",
+                          lambda: controller.queued)
+metrics.register_callback("face_admission_active_batches", "Số request nhận dạng theo lô đang được xử lý.",
+                          lambda: controller.active_batches)
+metrics.register_callback("face_admission_max_in_flight", "Số slot xử lý tối đa.",
+                          lambda: controller.max_in_flight)
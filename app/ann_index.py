@@ -0,0 +1,613 @@
+# app/ann_index.py
+"""
+Nearest-neighbour indexes over face encodings (pure NumPy).
+
+Every index exposes the same small interface so the gallery can switch
+between them:
+
+    build(vectors, ids, labels=None)  -- replace the content
+    add(vectors, ids, labels=None)    -- incremental insert
+    remove(ids)           -- incremental delete
+    search(queries, k)    -- (distances, ids), both (num_queries, k),
+                             padded with inf / -1 when fewer than k results
+
+`labels` gives the owner (user id) of each vector; only CentroidIndex uses it.
+Vectors are stored as float32, like the gallery snapshot, and only the blocks
+a search reads are widened to float64.
+QuantizedIndex returns approximate distances (computed on float16/int8 codes).
+
+Each index keeps its arrays in one immutable state object that `add` and
+`remove` replace as a whole; `search` reads it once, so a search running in
+another thread always sees one consistent version of the index.
+"""
+import threading
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from .matching import face_distance_matrix
+
+# Cùng kiểu với gallery.SNAPSHOT_DTYPE: index không giữ bản float64 của cả gallery
+INDEX_DTYPE = np.float32
+
+
+def _top_k(distances: np.ndarray, ids: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-k (smallest) of a 1D distance vector, padded to length k."""
+    out_d = np.full(k, np.inf)
+    out_i = np.full(k, -1, dtype=np.int64)
+    n = distances.shape[0]
+    if n == 0:
+        return out_d, out_i
+    kk = min(k, n)
+    idx = np.argpartition(distances, kk - 1)[:kk] if kk < n else np.arange(n)
+    idx = idx[np.argsort(distances[idx], kind="stable")]
+    out_d[:kk] = distances[idx]
+    out_i[:kk] = ids[idx]
+    return out_d, out_i
+
+
+def _sq_norms(vectors: np.ndarray) -> np.ndarray:
+    """Float64 squared norms of the rows of `vectors` (over the last axis)."""
+    widened = vectors.astype(np.float64)
+    return np.einsum("...d,...d->...", widened, widened)
+
+
+class _BruteForceState(NamedTuple):
+    vectors: np.ndarray # (N, dim) INDEX_DTYPE
+    sq_norms: np.ndarray # (N,) float64
+    ids: np.ndarray # (N,)
+
+
+class BruteForceIndex:
+    """
+    Exact linear scan; the reference every approximate index is measured against.
+    Blocks of `block_rows` vectors are widened to float64 during a search.
+    """
+
+    kind = "brute"
+
+    def __init__(self, dim: int = 128, block_rows: int = 4096):
+        self.dim = dim
+        self.block_rows = max(1, block_rows)
+        self._lock = threading.Lock()
+        self._state = _BruteForceState(
+            vectors=np.empty((0, dim), dtype=INDEX_DTYPE),
+            sq_norms=np.empty((0,), dtype=np.float64),
+            ids=np.empty((0,), dtype=np.int64),
+        )
+
+    def __len__(self) -> int:
+        return self._state.ids.shape[0]
+
+    def build(self, vectors: np.ndarray, ids: np.ndarray, labels: Optional[np.ndarray] = None) -> None:
+        vectors = np.ascontiguousarray(vectors, dtype=INDEX_DTYPE).reshape(-1, self.dim)
+        with self._lock:
+            self._state = _BruteForceState(vectors, _sq_norms(vectors), np.asarray(ids, dtype=np.int64))
+
+    def add(self, vectors: np.ndarray, ids: np.ndarray, labels: Optional[np.ndarray] = None) -> None:
+        vectors = np.asarray(vectors, dtype=INDEX_DTYPE).reshape(-1, self.dim)
+        with self._lock:
+            state = self._state
+            self._state = _BruteForceState(
+                vectors=np.ascontiguousarray(np.vstack([state.vectors, vectors])),
+                sq_norms=np.concatenate([state.sq_norms, _sq_norms(vectors)]),
+                ids=np.concatenate([state.ids, np.asarray(ids, dtype=np.int64)]),
+            )
+
+    def remove(self, ids: np.ndarray) -> None:
+        with self._lock:
+            state = self._state
+            keep = ~np.isin(state.ids, np.asarray(ids, dtype=np.int64))
+            if keep.all():
+                return
+            self._state = _BruteForceState(np.ascontiguousarray(state.vectors[keep]), state.sq_norms[keep], state.ids[keep])
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        queries = np.asarray(queries, dtype=np.float64).reshape(-1, self.dim)
+        state = self._state
+        out_d = np.full((queries.shape[0], k), np.inf)
+        out_i = np.full((queries.shape[0], k), -1, dtype=np.int64)
+        if state.ids.shape[0] == 0:
+            return out_d, out_i
+        distances = np.empty((queries.shape[0], state.ids.shape[0]))
+        for start in range(0, state.ids.shape[0], self.block_rows):
+            end = start + self.block_rows
+            distances[:, start:end] = face_distance_matrix(
+                queries, state.vectors[start:end].astype(np.float64), state.sq_norms[start:end])
+        for q in range(queries.shape[0]):
+            out_d[q], out_i[q] = _top_k(distances[q], state.ids, k)
+        return out_d, out_i
+
+
+class _IVFState(NamedTuple):
+    # Các list là tuple: add/remove tạo state mới thay vì sửa từng phần tử
+    centroids: np.ndarray # (nlist, dim) float64
+    centroid_sq_norms: np.ndarray # (nlist,)
+    list_vectors: Tuple[np.ndarray, ...] # mỗi list (n, dim) INDEX_DTYPE
+    list_sq_norms: Tuple[np.ndarray, ...] # mỗi list (n,) float64
+    list_ids: Tuple[np.ndarray, ...] # mỗi list (n,)
+
+
+def _empty_ivf_state(centroids: np.ndarray) -> _IVFState:
+    nlist, dim = centroids.shape
+    return _IVFState(
+        centroids=centroids,
+        centroid_sq_norms=np.einsum("ij,ij->i", centroids, centroids),
+        list_vectors=tuple(np.empty((0, dim), dtype=INDEX_DTYPE) for _ in range(nlist)),
+        list_sq_norms=tuple(np.empty((0,)) for _ in range(nlist)),
+        list_ids=tuple(np.empty((0,), dtype=np.int64) for _ in range(nlist)),
+    )
+
+
+class IVFIndex:
+    """
+    Inverted-file index: k-means coarse clustering of the gallery, then an
+    exact scan of only the `nprobe` clusters closest to each query.
+
+    Incremental adds go to the nearest existing centroid; call `build` again
+    (the gallery does this on reload) once the data has drifted a lot from
+    what the centroids were trained on.
+    """
+
+    kind = "ivf"
+
+    def __init__(self, dim: int = 128, nlist: int = 0, nprobe: int = 8,
+                 kmeans_iters: int = 15, max_train_points: int = 128, seed: int = 0):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.kmeans_iters = kmeans_iters
+        self.max_train_points = max_train_points # mỗi cụm
+        self.seed = seed
+        self._lock = threading.Lock()
+        self._state = _empty_ivf_state(np.empty((0, dim), dtype=np.float64))
+        self._list_of_id: Dict[int, int] = {} # chỉ dùng khi giữ self._lock
+
+    def __len__(self) -> int:
+        return len(self._list_of_id)
+
+    @property
+    def num_lists(self) -> int:
+        return self._state.centroids.shape[0]
+
+    @property
+    def is_trained(self) -> bool:
+        return self.num_lists > 0
+
+    def build(self, vectors: np.ndarray, ids: np.ndarray, labels: Optional[np.ndarray] = None) -> None:
+        vectors = np.asarray(vectors, dtype=INDEX_DTYPE).reshape(-1, self.dim)
+        ids = np.asarray(ids, dtype=np.int64)
+        nlist = self.nlist or max(1, int(round(np.sqrt(vectors.shape[0]))))
+        nlist = min(nlist, max(1, vectors.shape[0]))
+        centroids = self._train_kmeans(vectors, nlist) if vectors.shape[0] else np.empty((0, self.dim))
+        with self._lock:
+            self._state = _empty_ivf_state(centroids)
+            self._list_of_id = {}
+        if vectors.shape[0]:
+            self.add(vectors, ids)
+
+    def add(self, vectors: np.ndarray, ids: np.ndarray, labels: Optional[np.ndarray] = None) -> None:
+        vectors = np.asarray(vectors, dtype=INDEX_DTYPE).reshape(-1, self.dim)
+        ids = np.asarray(ids, dtype=np.int64)
+        if vectors.shape[0] == 0:
+            return
+        if not self.is_trained:
+            self.build(vectors, ids)
+            return
+        with self._lock:
+            state = self._state
+            assignment = self._assign(vectors, state)
+            list_vectors, list_sq_norms, list_ids = (list(lists) for lists in state[2:])
+            for list_no in np.unique(assignment):
+                rows = assignment == list_no
+                added = vectors[rows]
+                list_vectors[list_no] = np.ascontiguousarray(np.vstack([list_vectors[list_no], added]))
+                list_sq_norms[list_no] = np.concatenate([list_sq_norms[list_no], _sq_norms(added)])
+                list_ids[list_no] = np.concatenate([list_ids[list_no], ids[rows]])
+                for encoding_id in ids[rows].tolist():
+                    self._list_of_id[encoding_id] = int(list_no)
+            self._state = state._replace(list_vectors=tuple(list_vectors), list_sq_norms=tuple(list_sq_norms),
+                                         list_ids=tuple(list_ids))
+
+    def remove(self, ids: np.ndarray) -> None:
+        with self._lock:
+            touched: Dict[int, List[int]] = {}
+            for encoding_id in np.asarray(ids, dtype=np.int64).tolist():
+                list_no = self._list_of_id.pop(encoding_id, None)
+                if list_no is not None:
+                    touched.setdefault(list_no, []).append(encoding_id)
+            if not touched:
+                return
+            state = self._state
+            list_vectors, list_sq_norms, list_ids = (list(lists) for lists in state[2:])
+            for list_no, removed in touched.items():
+                keep = ~np.isin(list_ids[list_no], removed)
+                list_vectors[list_no] = np.ascontiguousarray(list_vectors[list_no][keep])
+                list_sq_norms[list_no] = list_sq_norms[list_no][keep]
+                list_ids[list_no] = list_ids[list_no][keep]
+            self._state = state._replace(list_vectors=tuple(list_vectors), list_sq_norms=tuple(list_sq_norms),
+                                         list_ids=tuple(list_ids))
+
+    def search(self, queries: np.ndarray, k: int, nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        queries = np.asarray(queries, dtype=np.float64).reshape(-1, self.dim)
+        num_queries = queries.shape[0]
+        out_d = np.full((num_queries, k), np.inf)
+        out_i = np.full((num_queries, k), -1, dtype=np.int64)
+        state = self._state # Đọc một lần: mọi list bên dưới thuộc cùng một phiên bản
+        centroids = state.centroids
+        if centroids.shape[0] == 0 or num_queries == 0:
+            return out_d, out_i
+
+        nprobe = min(nprobe or self.nprobe, centroids.shape[0])
+        centroid_distances = face_distance_matrix(queries, centroids, state.centroid_sq_norms)
+        if nprobe < centroids.shape[0]:
+            probes = np.argpartition(centroid_distances, nprobe - 1, axis=1)[:, :nprobe]
+        else:
+            probes = np.broadcast_to(np.arange(nprobe), (num_queries, nprobe))
+
+        for q in range(num_queries):
+            distance_parts = []
+            id_parts = []
+            for list_no in probes[q]:
+                ids = state.list_ids[list_no]
+                if ids.shape[0] == 0:
+                    continue
+                distance_parts.append(face_distance_matrix(queries[q], state.list_vectors[list_no].astype(np.float64),
+                                                           state.list_sq_norms[list_no])[0])
+                id_parts.append(ids)
+            if distance_parts:
+                out_d[q], out_i[q] = _top_k(np.concatenate(distance_parts), np.concatenate(id_parts), k)
+        return out_d, out_i
+
+    @staticmethod
+    def _assign(vectors: np.ndarray, state: _IVFState, chunk_size: int = 16384) -> np.ndarray:
+        assignment = np.empty(vectors.shape[0], dtype=np.int64)
+        for start in range(0, vectors.shape[0], chunk_size):
+            chunk = vectors[start:start + chunk_size]
+            assignment[start:start + chunk_size] = np.argmin(
+                face_distance_matrix(chunk.astype(np.float64), state.centroids, state.centroid_sq_norms), axis=1
+            )
+        return assignment
+
+    def _train_kmeans(self, vectors: np.ndarray, nlist: int) -> np.ndarray:
+        rng = np.random.default_rng(self.seed)
+        num_train = min(vectors.shape[0], nlist * self.max_train_points)
+        train = vectors[rng.choice(vectors.shape[0], num_train, replace=False)] if num_train < vectors.shape[0] else vectors
+        train = train.astype(np.float64) # Chỉ mẫu huấn luyện được mở rộng, không phải cả gallery
+        centroids = train[rng.choice(train.shape[0], nlist, replace=False)].copy()
+        for _ in range(self.kmeans_iters):
+            distances = face_distance_matrix(train, centroids)
+            assignment = np.argmin(distances, axis=1)
+            counts = np.bincount(assignment, minlength=nlist)
+            empty = counts == 0
+            order = np.argsort(assignment, kind="stable")
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[~empty]
+            centroids[~empty] = np.add.reduceat(train[order], starts, axis=0) / counts[~empty, np.newaxis]
+            if empty.any(): # Khởi tạo lại cụm rỗng bằng các điểm ngẫu nhiên
+                centroids[empty] = train[rng.choice(train.shape[0], int(empty.sum()), replace=False)]
+        return np.ascontiguousarray(centroids)
+
+
+class _CentroidState(NamedTuple):
+    # Hàng r = một user; các mã hóa của user nằm trong ô [r, :counts[r]], phần còn lại là padding
+    labels: np.ndarray # (U,) user id
+    vectors: np.ndarray # (U, W, dim) INDEX_DTYPE
+    sq_norms: np.ndarray # (U, W) float64, inf ở ô padding
+    ids: np.ndarray # (U, W), -1 ở ô padding
+    counts: np.ndarray # (U,)
+    centroids: np.ndarray # (U, dim) trung bình các mã hóa đã chuẩn hóa
+    centroid_sq_norms: np.ndarray # (U,)
+
+
+def _empty_centroid_state(dim: int) -> _CentroidState:
+    return _CentroidState(
+        labels=np.empty((0,), dtype=np.int64),
+        vectors=np.empty((0, 0, dim), dtype=INDEX_DTYPE),
+        sq_norms=np.empty((0, 0)),
+        ids=np.empty((0, 0), dtype=np.int64),
+        counts=np.empty((0,), dtype=np.int64),
+        centroids=np.empty((0, dim)),
+        centroid_sq_norms=np.empty((0,)),
+    )
+
+
+class CentroidIndex:
+    """
+    Two-stage search over per-user prototypes.
+
+    Each user (label) is summarized by the mean of its L2-normalized encodings.
+    A query is first compared with every centroid, the `shortlist` closest users
+    are kept, and only their individual encodings are then scanned exactly. With
+    ~10 encodings per user this touches about a tenth of the gallery; results are
+    exact whenever the true nearest encodings belong to a shortlisted user.
+
+    Encodings of one user are stored as a padded (users, width, dim) block so the
+    refinement stage is a single gather + einsum for all queries. Adds and removes
+    only rewrite the rows (and centroids) of the users they touch.
+    """
+
+    kind = "centroid"
+
+    def __init__(self, dim: int = 128, shortlist: int = 16):
+        self.dim = dim
+        self.shortlist = max(1, shortlist)
+        self._lock = threading.Lock()
+        self._state = _empty_centroid_state(dim)
+        self._row_of_label: Dict[int, int] = {}
+        self._label_of_id: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._label_of_id)
+
+    @property
+    def num_users(self) -> int:
+        return self._state.labels.shape[0]
+
+    def build(self, vectors: np.ndarray, ids: np.ndarray, labels: Optional[np.ndarray] = None) -> None:
+        with self._lock:
+            self._state = _empty_centroid_state(self.dim)
+            self._row_of_label = {}
+            self._label_of_id = {}
+            self._insert(vectors, ids, labels)
+
+    def add(self, vectors: np.ndarray, ids: np.ndarray, labels: Optional[np.ndarray] = None) -> None:
+        with self._lock:
+            self._insert(vectors, ids, labels)
+
+    def remove(self, ids: np.ndarray) -> None:
+        with self._lock:
+            touched: Dict[int, List[int]] = {}
+            for encoding_id in np.asarray(ids, dtype=np.int64).tolist():
+                label = self._label_of_id.pop(encoding_id, None)
+                if label is not None:
+                    touched.setdefault(label, []).append(encoding_id)
+            if not touched:
+                return
+            state = self._state
+            members = {}
+            for label, removed in touched.items():
+                row = self._row_of_label[label]
+                n = int(state.counts[row])
+                keep = ~np.isin(state.ids[row, :n], removed)
+                members[label] = (state.vectors[row, :n][keep], state.ids[row, :n][keep])
+            self._write_rows(members)
+
+    def search(self, queries: np.ndarray, k: int, shortlist: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        queries = np.asarray(queries, dtype=np.float64).reshape(-1, self.dim)
+        num_queries = queries.shape[0]
+        out_d = np.full((num_queries, k), np.inf)
+        out_i = np.full((num_queries, k), -1, dtype=np.int64)
+        state = self._state
+        num_users = state.labels.shape[0]
+        if num_users == 0 or num_queries == 0:
+            return out_d, out_i
+
+        # Bước 1: chọn các user có tâm gần truy vấn nhất (truy vấn cũng được chuẩn hóa như tâm)
+        shortlist = min(shortlist or self.shortlist, num_users)
+        normalized = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        centroid_distances = face_distance_matrix(normalized, state.centroids, state.centroid_sq_norms)
+        if shortlist < num_users:
+            picked = np.argpartition(centroid_distances, shortlist - 1, axis=1)[:, :shortlist]
+        else:
+            picked = np.broadcast_to(np.arange(num_users), (num_queries, num_users))
+
+        # Bước 2: khoảng cách chính xác tới từng mã hóa của các user đã chọn
+        # Chỉ các mã hóa được gom về (shortlist user cho mỗi truy vấn) được mở rộng sang float64
+        sq_distances = (np.einsum("qd,qd->q", queries, queries)[:, np.newaxis, np.newaxis]
+                        + state.sq_norms[picked]
+                        - 2.0 * np.einsum("qd,qswd->qsw", queries, state.vectors[picked].astype(np.float64)))
+        np.maximum(sq_distances, 0.0, out=sq_distances)
+        distances = np.sqrt(sq_distances).reshape(num_queries, -1)
+        candidate_ids = state.ids[picked].reshape(num_queries, -1)
+        for q in range(num_queries):
+            out_d[q], out_i[q] = _top_k(distances[q], candidate_ids[q], k)
+        return out_d, out_i
+
+    def _insert(self, vectors: np.ndarray, ids: np.ndarray, labels: Optional[np.ndarray]) -> None:
+        # Phải được gọi khi đang giữ self._lock
+        vectors = np.asarray(vectors, dtype=INDEX_DTYPE).reshape(-1, self.dim)
+        ids = np.asarray(ids, dtype=np.int64)
+        if vectors.shape[0] == 0:
+            return
+        if labels is None:
+            raise ValueError("CentroidIndex needs the owner label of every vector.")
+        labels = np.asarray(labels, dtype=np.int64)
+        state = self._state
+        order = np.argsort(labels, kind="stable")
+        unique_labels, starts = np.unique(labels[order], return_index=True)
+        ends = np.append(starts[1:], order.shape[0])
+        members = {}
+        for label, start, end in zip(unique_labels.tolist(), starts.tolist(), ends.tolist()):
+            rows = order[start:end]
+            added_vectors, added_ids = vectors[rows], ids[rows]
+            row = self._row_of_label.get(label)
+            if row is not None:
+                n = int(state.counts[row])
+                added_vectors = np.vstack([state.vectors[row, :n], added_vectors])
+                added_ids = np.concatenate([state.ids[row, :n], added_ids])
+            members[label] = (added_vectors, added_ids)
+            for encoding_id in ids[rows].tolist():
+                self._label_of_id[encoding_id] = label
+        self._write_rows(members)
+
+    def _write_rows(self, members: Dict[int, Tuple[np.ndarray, np.ndarray]]) -> None:
+        # Ghi lại toàn bộ hàng của các user trong `members` vào một state mới (user không còn mã hóa bị bỏ).
+        # Phải được gọi khi đang giữ self._lock
+        state = self._state
+        new_labels = [label for label in members if label not in self._row_of_label]
+        num_users = state.labels.shape[0] + len(new_labels)
+        width = max([state.ids.shape[1]] + [member_ids.shape[0] for _, member_ids in members.values()])
+
+        labels = np.concatenate([state.labels, np.asarray(new_labels, dtype=np.int64)])
+        vectors = np.zeros((num_users, width, self.dim), dtype=INDEX_DTYPE)
+        vectors[:state.labels.shape[0], :state.ids.shape[1]] = state.vectors
+        sq_norms = np.full((num_users, width), np.inf)
+        sq_norms[:state.labels.shape[0], :state.ids.shape[1]] = state.sq_norms
+        ids = np.full((num_users, width), -1, dtype=np.int64)
+        ids[:state.labels.shape[0], :state.ids.shape[1]] = state.ids
+        counts = np.concatenate([state.counts, np.zeros(len(new_labels), dtype=np.int64)])
+        centroids = np.vstack([state.centroids, np.zeros((len(new_labels), self.dim))])
+
+        row_of_label = dict(self._row_of_label)
+        for offset, label in enumerate(new_labels):
+            row_of_label[label] = state.labels.shape[0] + offset
+        for label, (member_vectors, member_ids) in members.items():
+            row = row_of_label[label]
+            n = member_ids.shape[0]
+            vectors[row] = 0.0
+            sq_norms[row] = np.inf
+            ids[row] = -1
+            counts[row] = n
+            if n == 0:
+                continue
+            vectors[row, :n] = member_vectors
+            sq_norms[row, :n] = _sq_norms(member_vectors)
+            ids[row, :n] = member_ids
+            centroids[row] = (member_vectors.astype(np.float64) / np.maximum(np.sqrt(sq_norms[row, :n]), 1e-12)[:, np.newaxis]).mean(axis=0)
+
+        keep = counts > 0
+        if not keep.all():
+            labels, vectors, sq_norms, ids, counts, centroids = (
+                array[keep] for array in (labels, vectors, sq_norms, ids, counts, centroids))
+            row_of_label = {label: row for row, label in enumerate(labels.tolist())}
+        self._row_of_label = row_of_label
+        self._state = _CentroidState(labels, vectors, sq_norms, ids, counts, centroids,
+                                     np.einsum("ij,ij->i", centroids, centroids))
+
+
+class _QuantizedState(NamedTuple):
+    codes: np.ndarray # (N, dim) int8 hoặc float16
+    scales: np.ndarray # (N,) float32: vector = codes * scale (float16: 1)
+    sq_norms: np.ndarray # (N,) float32, chuẩn của vector đã giải nén
+    ids: np.ndarray # (N,)
+
+
+class QuantizedIndex:
+    """
+    Exact scan over a compact copy of the gallery.
+
+    `precision="float16"` halves a float32 vector (256 bytes for 128 dims);
+    `precision="int8"` stores codes in [-127, 127] plus one float32 scale, with
+    `scale="vector"` (per-vector max abs, the most accurate) or `scale="global"`
+    (one scale fixed at `build`; values added later beyond it are clipped): 136
+    bytes per vector with its scale and norm, against 516 for float32.
+
+    Distances are computed on the codes: blocks of `block_rows` codes are widened
+    to float32 into a reused buffer and multiplied with the queries, so no
+    full-size float copy is ever made. The widening costs time, so a scan is not
+    faster than a float32 brute-force scan; the gain is resident memory only. The
+    distances are approximate; re-rank the top candidates with the original
+    vectors when exact values matter (see `matching.match_faces_with_index`).
+    """
+
+    kind = "quantized"
+    PRECISIONS = ("int8", "float16")
+    SCALES = ("vector", "global")
+
+    def __init__(self, dim: int = 128, precision: str = "int8", scale: str = "vector", block_rows: int = 4096):
+        if precision not in self.PRECISIONS:
+            raise ValueError(f"Unsupported precision: {precision}")
+        if scale not in self.SCALES:
+            raise ValueError(f"Unsupported scale: {scale}")
+        self.dim = dim
+        self.precision = precision
+        self.scale = scale
+        self.block_rows = max(1, block_rows)
+        self._lock = threading.Lock()
+        self._global_scale: Optional[float] = None
+        self._state = self._encode(np.empty((0, dim)), np.empty((0,), dtype=np.int64))
+
+    def __len__(self) -> int:
+        return self._state.ids.shape[0]
+
+    @property
+    def bytes_per_vector(self) -> int:
+        """Memory of one stored vector: codes, scale and squared norm (ids not counted)."""
+        state = self._state
+        return state.codes.dtype.itemsize * self.dim + state.scales.dtype.itemsize + state.sq_norms.dtype.itemsize
+
+    def build(self, vectors: np.ndarray, ids: np.ndarray, labels: Optional[np.ndarray] = None) -> None:
+        vectors = np.asarray(vectors, dtype=INDEX_DTYPE).reshape(-1, self.dim)
+        with self._lock:
+            if self.precision == "int8" and self.scale == "global":
+                max_abs = float(np.abs(vectors).max()) if vectors.size else 0.0
+                self._global_scale = (max_abs or 1.0) / 127.0
+            self._state = self._encode(vectors, ids)
+
+    def add(self, vectors: np.ndarray, ids: np.ndarray, labels: Optional[np.ndarray] = None) -> None:
+        vectors = np.asarray(vectors, dtype=INDEX_DTYPE).reshape(-1, self.dim)
+        if vectors.shape[0] == 0:
+            return
+        if self.precision == "int8" and self.scale == "global" and self._global_scale is None:
+            self.build(vectors, ids)
+            return
+        with self._lock:
+            added = self._encode(vectors, ids)
+            state = self._state
+            self._state = _QuantizedState(*(np.concatenate([old, new]) for old, new in zip(state, added)))
+
+    def remove(self, ids: np.ndarray) -> None:
+        with self._lock:
+            state = self._state
+            keep = ~np.isin(state.ids, np.asarray(ids, dtype=np.int64))
+            if keep.all():
+                return
+            self._state = _QuantizedState(*(np.ascontiguousarray(field[keep]) for field in state))
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        state = self._state
+        num_queries, size = queries.shape[0], state.ids.shape[0]
+        out_d = np.full((num_queries, k), np.inf)
+        out_i = np.full((num_queries, k), -1, dtype=np.int64)
+        if size == 0 or num_queries == 0:
+            return out_d, out_i
+
+        dots = np.empty((num_queries, size), dtype=np.float32)
+        buffer = np.empty((min(self.block_rows, size), self.dim), dtype=np.float32)
+        for start in range(0, size, self.block_rows):
+            block = state.codes[start:start + self.block_rows]
+            widened = buffer[:block.shape[0]]
+            widened[...] = block
+            np.matmul(queries, widened.T, out=dots[:, start:start + block.shape[0]])
+        if self.precision == "int8":
+            dots *= state.scales
+        sq_distances = np.einsum("ij,ij->i", queries, queries)[:, np.newaxis] + state.sq_norms - 2.0 * dots
+        np.maximum(sq_distances, 0.0, out=sq_distances)
+        distances = np.sqrt(sq_distances, out=sq_distances)
+        for q in range(num_queries):
+            out_d[q], out_i[q] = _top_k(distances[q], state.ids, k)
+        return out_d, out_i
+
+    def _encode(self, vectors: np.ndarray, ids: np.ndarray) -> _QuantizedState:
+        if self.precision == "float16":
+            codes = vectors.astype(np.float16)
+            scales = np.ones(vectors.shape[0], dtype=np.float32)
+            decoded = codes.astype(np.float32)
+        else:
+            if self.scale == "global":
+                scales = np.full(vectors.shape[0], self._global_scale or 1.0 / 127.0, dtype=np.float32)
+            else:
+                max_abs = np.abs(vectors).max(axis=1) if vectors.size else np.empty((0,))
+                scales = (np.where(max_abs > 0, max_abs, 1.0) / 127.0).astype(np.float32)
+            codes = np.clip(np.rint(vectors / scales[:, np.newaxis]), -127, 127).astype(np.int8)
+            decoded = codes.astype(np.float32) * scales[:, np.newaxis]
+        return _QuantizedState(
+            codes=np.ascontiguousarray(codes),
+            scales=scales,
+            sq_norms=np.einsum("ij,ij->i", decoded, decoded).astype(np.float32),
+            ids=np.asarray(ids, dtype=np.int64),
+        )
+
+
+def make_index(kind: str, dim: int = 128, **kwargs):
+    """Factory used by the gallery; `kind` is "brute", "ivf", "centroid" or "quantized"."""
+    if kind == BruteForceIndex.kind:
+        return BruteForceIndex(dim=dim)
+    if kind == IVFIndex.kind:
+        return IVFIndex(dim=dim, **kwargs)
+    if kind == CentroidIndex.kind:
+        return CentroidIndex(dim=dim, **kwargs)
+    if kind == QuantizedIndex.kind:
+        return QuantizedIndex(dim=dim, **kwargs)
+    raise ValueError(f"Unknown match index kind: {kind}")
@@ -0,0 +1,119 @@
+# app/bulk_enroll.py
+"""
+Đăng ký hàng loạt từ một thư mục ảnh có cấu trúc:
+
+    photos/
+        Nguyen Van A/
+            1.jpg
+            2.jpg
+        Tran Thi B/
+            a.png
+
+Mỗi thư mục con là một người dùng (tên thư mục = tên người dùng). Ảnh được
+detect/encode song song trên tất cả các nhân CPU, sau đó người dùng và mã hóa
+được ghi vào DB theo từng lô lớn trong một transaction.
+
+    python -m app.bulk_enroll photos/ [--workers 8] [--batch-size 500] [--on-existing merge]
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from . import config
+from . import crud
+from . import gallery
+from . import migrations
+from . import models
+from .database import SessionLocal, engine
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+
+def find_images(root: Path) -> List[Tuple[str, Path]]:
+    """Danh sách (tên người dùng, đường dẫn ảnh), sắp xếp theo người dùng."""
+    items = []
+    for person_dir in sorted(p for p in root.iterdir() if p.is_dir()):
+        for image_path in sorted(person_dir.iterdir()):
+            if image_path.is_file() and image_path.suffix.lower() in IMAGE_SUFFIXES:
+                items.append((person_dir.name, image_path))
+    return items
+
+
+def encode_image_file(path: Path) -> Tuple[Optional[np.ndarray], Optional[str]]:
+    """Chạy trong process con: trả về (encoding của khuôn mặt đầu tiên, lỗi)."""
+    from . import face_utils # Import trong process con để dlib được nạp ở đó
+
+    try:
+        _, encodings = face_utils.detect_and_encode(path.read_bytes())
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+    if not encodings:
+        return None, "không tìm thấy khuôn mặt"
+    return np.asarray(encodings[0], dtype=np.float32), None
+
+
+def flush(users_encodings: Dict[str, List[np.ndarray]], on_existing: str) -> Tuple[int, int]:
+    if not users_encodings:
+        return 0, 0
+    with SessionLocal() as db:
+        return crud.bulk_add_users_with_encodings(db, users_encodings, on_existing=on_existing)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đăng ký hàng loạt người dùng từ thư mục ảnh person_name/*.jpg.")
+    parser.add_argument("root", type=Path, help="Thư mục gốc chứa các thư mục con theo tên người dùng.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Số process encode song song.")
+    parser.add_argument("--batch-size", type=int, default=500, help="Số người dùng ghi trong một transaction.")
+    parser.add_argument("--on-existing", choices=list(crud.IMPORT_MODES), default="merge",
+                        help="Xử lý người dùng đã tồn tại: bỏ qua, thêm mã hóa (đến giới hạn) hoặc thay thế.")
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine)
+    migrations.migrate_encodings_to_binary(engine)
+    items = find_images(args.root)
+    if not items:
+        parser.error(f"Không tìm thấy ảnh nào trong {args.root}")
+    print(f"Tìm thấy {len(items)} ảnh của {len({name for name, _ in items})} người dùng. Đang xử lý với {args.workers} process...")
+
+    start = time.perf_counter()
+    pending: Dict[str, List[np.ndarray]] = {}
+    current_name: Optional[str] = None
+    totals = [0, 0] # users_created, encodings_added
+    failures = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        results = executor.map(encode_image_file, [path for _, path in items], chunksize=8)
+        for (name, path), (encoding, error) in zip(items, results):
+            if name != current_name:
+                # Ảnh được sắp xếp theo người dùng: người trước đã đủ ảnh, ghi theo lô khi đủ batch
+                current_name = name
+                if len(pending) >= args.batch_size:
+                    created, added = flush(pending, args.on_existing)
+                    totals[0] += created
+                    totals[1] += added
+                    pending = {}
+                    print(f"... đã ghi {totals[0]} người dùng mới, {totals[1]} mã hóa ({time.perf_counter() - start:.1f}s)")
+            if error is not None:
+                failures += 1
+                print(f"Bỏ qua {path}: {error}")
+                continue
+            # Giữ mọi mã hóa; crud chọn tối đa MAX_ENCODINGS_PER_USER mã hóa đa dạng nhất khi ghi
+            pending.setdefault(name, []).append(encoding)
+
+    created, added = flush(pending, args.on_existing)
+    totals[0] += created
+    totals[1] += added
+    print(f"Hoàn tất trong {time.perf_counter() - start:.1f}s: {totals[0]} người dùng mới, "
+          f"{totals[1]} mã hóa, {failures} ảnh lỗi/không có khuôn mặt.")
+    if config.GALLERY_SNAPSHOT_DIR:
+        # Ghi lại gallery snapshot dùng chung để các worker đang chạy thấy người dùng mới
+        gallery.gallery_cache.get_snapshot()
+        print(f"Đã cập nhật gallery snapshot {gallery.gallery_cache.store_stamp}.")
+
+
+if __name__ == "__main__":
+    main()
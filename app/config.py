@@ -0,0 +1,141 @@
+# app/config.py
+"""
+Các tham số cấu hình runtime, đọc từ biến môi trường (có giá trị mặc định).
+"""
+import os
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        print(f"Giá trị không hợp lệ cho {name}, dùng mặc định {default}.")
+        return default
+
+
+# --- Matching / ANN index ---
+# "brute": so khớp chính xác trên toàn bộ gallery, "ivf": chỉ mục IVF xấp xỉ,
+# "centroid": lọc user theo tâm (trung bình mã hóa) rồi so khớp chính xác trong nhóm đó,
+# "quantized": quét bản nén float16/int8 của gallery (app/ann_index.py)
+MATCH_INDEX = os.getenv("FACE_MATCH_INDEX", "brute").lower()
+# Số cụm thô của IVF, 0 = tự chọn ~ sqrt(N)
+IVF_NLIST = _env_int("FACE_IVF_NLIST", 0)
+# Số cụm được duyệt khi tìm kiếm; cao hơn = recall tốt hơn nhưng chậm hơn
+IVF_NPROBE = _env_int("FACE_IVF_NPROBE", 8)
+# Dưới ngưỡng này gallery vẫn dùng brute force vì IVF không có lợi
+IVF_MIN_GALLERY_SIZE = _env_int("FACE_IVF_MIN_GALLERY_SIZE", 5000)
+# Số user (gần tâm nhất) được giữ lại ở bước 1 của "centroid"; cao hơn = chính xác hơn nhưng chậm hơn
+CENTROID_SHORTLIST = _env_int("FACE_CENTROID_SHORTLIST", 16)
+# Dưới ngưỡng này (số mã hóa) "centroid" vẫn dùng brute force
+CENTROID_MIN_GALLERY_SIZE = _env_int("FACE_CENTROID_MIN_GALLERY_SIZE", 1000)
+# "quantized": quét toàn bộ gallery trên bản nén, khoảng cách xấp xỉ. Chỉ giảm bộ nhớ thường trú
+# (hàng float để re-rank được đọc từ memmap của snapshot, nên cần FACE_GALLERY_SNAPSHOT_DIR),
+# không nhanh hơn: NumPy không có phép nhân ma trận int8/float16, brute force float32 vẫn nhanh hơn.
+# Độ chính xác lưu: "int8" (~136 byte/mã hóa) hoặc "float16" (~264 byte/mã hóa), so với 516 của float32
+QUANTIZED_PRECISION = os.getenv("FACE_QUANTIZED_PRECISION", "int8").lower()
+# Hệ số int8: "vector" (mỗi mã hóa một hệ số, chính xác hơn) hoặc "global" (một hệ số cho cả gallery)
+QUANTIZED_SCALE = os.getenv("FACE_QUANTIZED_SCALE", "vector").lower()
+# Lấy top_k x N ứng viên trên bản nén rồi tính lại khoảng cách float chính xác; 0 = dùng khoảng cách xấp xỉ
+QUANTIZED_RERANK = _env_int("FACE_QUANTIZED_RERANK", 4)
+# Dưới ngưỡng này (số mã hóa) "quantized" vẫn dùng brute force
+QUANTIZED_MIN_GALLERY_SIZE = _env_int("FACE_QUANTIZED_MIN_GALLERY_SIZE", 10000)
+
+# --- Gộp so khớp của các request đồng thời (app/match_batcher.py) ---
+# Thời gian tối đa (ms) một request chờ để được so khớp chung với các request khác;
+# cũng là độ trễ thêm tối đa. 0 = tắt, mỗi request tự so khớp (nên bật 2-5 ms khi có nhiều camera)
+MATCH_BATCH_WINDOW_MS = float(os.getenv("FACE_MATCH_BATCH_WINDOW_MS", "0"))
+# So khớp ngay khi số khuôn mặt đang chờ đạt giá trị này
+MATCH_BATCH_MAX_FACES = _env_int("FACE_MATCH_BATCH_MAX_FACES", 64)
+
+# --- Worker pool cho các tác vụ CPU (decode/detect/encode) ---
+# "thread": dlib nhả GIL nên thread pool đã chạy song song được; "process": cô lập hoàn toàn
+WORKER_POOL_KIND = os.getenv("FACE_WORKER_POOL", "thread").lower()
+# Số worker tối đa, 0 = số CPU
+WORKER_POOL_SIZE = _env_int("FACE_WORKER_POOL_SIZE", 0)
+
+# --- Kiểm soát tải (app/admission.py) ---
+# Số request được chạy pipeline cùng lúc, 0 = 2 x số worker
+ADMISSION_MAX_IN_FLIGHT = _env_int("FACE_ADMISSION_MAX_IN_FLIGHT", 0)
+# Số request tối đa được xếp hàng cho mỗi mức ưu tiên; quá giới hạn trả 503 + Retry-After
+ADMISSION_MAX_QUEUE = _env_int("FACE_ADMISSION_MAX_QUEUE", 32)
+# Thời gian chờ tối đa trong hàng đợi (giây) trước khi trả 503, 0 = không giới hạn
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("FACE_ADMISSION_MAX_WAIT_SECONDS", "5"))
+# Số request nhận dạng theo lô được nhận cùng lúc (trước khi đọc ảnh upload); quá giới hạn trả 503 + Retry-After
+ADMISSION_MAX_BATCHES = _env_int("FACE_ADMISSION_MAX_BATCHES", 2)
+
+# --- Decode ---
+# JPEG lớn hơn giá trị này được giải mã trực tiếp ở kích thước nhỏ hơn (DCT scaling 1/2, 1/4, 1/8,
+# cạnh dài vẫn >= giá trị này); encoding tính trên ảnh đã giảm, box trả về theo toạ độ gốc.
+# 0 = luôn giải mã đầy đủ.
+DECODE_MAX_SIDE = _env_int("FACE_DECODE_MAX_SIDE", 1600)
+
+# --- Detection ---
+# HOG chạy trên bản thu nhỏ có cạnh dài nhất tối đa bằng giá trị này (box được quy đổi lại
+# về toạ độ ảnh gốc, encoding vẫn tính trên ảnh gốc). 0 = detect trên ảnh gốc.
+DETECTION_MAX_SIDE = _env_int("FACE_DETECTION_MAX_SIDE", 640)
+# Số lần upsample của HOG (face_recognition mặc định 1); tăng để bắt mặt nhỏ, tốn CPU hơn
+DETECTION_UPSAMPLE = _env_int("FACE_DETECTION_UPSAMPLE", 1)
+
+# --- Đăng ký (chọn mã hóa đa dạng, xem matching.select_diverse_encodings) ---
+# Mã hóa mới cách mã hóa đã giữ của cùng người dùng ít hơn giá trị này bị coi là trùng (frame gần
+# như giống hệt) và không được lưu. 0 = chỉ chọn đa dạng, không loại bỏ.
+ENROLL_MIN_ENCODING_DISTANCE = float(os.getenv("FACE_ENROLL_MIN_ENCODING_DISTANCE", "0.1"))
+
+# --- Thông số chụp ảnh gợi ý cho client (GET /api/capture-profile/) ---
+# Trang nhận dạng: frame được thu nhỏ vừa khung này trước khi upload (HOG chỉ chạy ở
+# FACE_DETECTION_MAX_SIDE nên ảnh lớn hơn chỉ tốn băng thông và thời gian decode)
+CAPTURE_MAX_WIDTH = _env_int("FACE_CAPTURE_MAX_WIDTH", 640)
+CAPTURE_MAX_HEIGHT = _env_int("FACE_CAPTURE_MAX_HEIGHT", 480)
+CAPTURE_JPEG_QUALITY = float(os.getenv("FACE_CAPTURE_JPEG_QUALITY", "0.8"))
+# Số frame tối đa mỗi giây mà một client gửi (client còn tự giảm theo thời gian phản hồi)
+CAPTURE_TARGET_FPS = float(os.getenv("FACE_CAPTURE_TARGET_FPS", "10"))
+# Chế độ hybrid: khoảng cách giữa hai lần nhận dạng đầy đủ (các frame còn lại chỉ lấy box)
+CAPTURE_FULL_RECOGNITION_INTERVAL_MS = _env_int("FACE_CAPTURE_FULL_RECOGNITION_INTERVAL_MS", 400)
+# Trang đăng ký: ảnh chất lượng cao hơn vì mã hóa được lưu lâu dài
+CAPTURE_REGISTER_MAX_WIDTH = _env_int("FACE_CAPTURE_REGISTER_MAX_WIDTH", 1280)
+CAPTURE_REGISTER_MAX_HEIGHT = _env_int("FACE_CAPTURE_REGISTER_MAX_HEIGHT", 960)
+CAPTURE_REGISTER_JPEG_QUALITY = float(os.getenv("FACE_CAPTURE_REGISTER_JPEG_QUALITY", "0.9"))
+
+# --- Tracking theo phiên (app/tracking.py) ---
+# IoU tối thiểu để ghép box mới với một track đang có
+TRACK_IOU_THRESHOLD = float(os.getenv("FACE_TRACK_IOU_THRESHOLD", "0.3"))
+# Encode lại mỗi N frame kể cả khi khuôn mặt đứng yên
+TRACK_REENCODE_INTERVAL = _env_int("FACE_TRACK_REENCODE_INTERVAL", 15)
+# Encode lại nếu IoU giữa box hiện tại và box lúc encode thấp hơn ngưỡng này (đã di chuyển)
+TRACK_MOVE_IOU_THRESHOLD = float(os.getenv("FACE_TRACK_MOVE_IOU_THRESHOLD", "0.6"))
+# Encode lại nếu diện tích box thay đổi quá tỉ lệ này
+TRACK_SIZE_CHANGE_RATIO = float(os.getenv("FACE_TRACK_SIZE_CHANGE_RATIO", "1.3"))
+# Bỏ track sau N frame liên tiếp không thấy
+TRACK_MAX_MISSED_FRAMES = _env_int("FACE_TRACK_MAX_MISSED_FRAMES", 5)
+# Giới hạn số phiên HTTP (session_id) được giữ tracker
+TRACK_MAX_SESSIONS = _env_int("FACE_TRACK_MAX_SESSIONS", 256)
+TRACK_SESSION_TTL_SECONDS = float(os.getenv("FACE_TRACK_SESSION_TTL_SECONDS", "60"))
+
+# --- Nhận dạng theo lô (/api/recognize/batch/) ---
+# Số ảnh tối đa trong một request (kể cả ảnh trong file zip/tar)
+BATCH_MAX_IMAGES = _env_int("FACE_BATCH_MAX_IMAGES", 1000)
+# Số ảnh được xử lý đồng thời cho một request, 0 = 2 x số worker
+BATCH_MAX_IN_FLIGHT = _env_int("FACE_BATCH_MAX_IN_FLIGHT", 0)
+# Giới hạn khi giải nén file zip/tar: tổng số byte sau giải nén và số byte của mỗi ảnh
+# (chặn "zip bomb": file nén nhỏ nhưng giải nén ra rất lớn)
+BATCH_MAX_ARCHIVE_BYTES = _env_int("FACE_BATCH_MAX_ARCHIVE_BYTES", 512 * 1024 * 1024)
+BATCH_MAX_IMAGE_BYTES = _env_int("FACE_BATCH_MAX_IMAGE_BYTES", 20 * 1024 * 1024)
+
+# --- Cache kết quả nhận dạng (app/result_cache.py) ---
+# Số kết quả được giữ (LRU), 0 = tắt cache
+RESULT_CACHE_SIZE = _env_int("FACE_RESULT_CACHE_SIZE", 256)
+# Khớp cả frame gần giống nhau: số bit dHash 64-bit được phép khác nhau.
+# -1 = chỉ khớp ảnh giống hệt từng byte; 0 = thumbnail giống hệt; càng cao càng dễ trả về box cũ
+RESULT_CACHE_PHASH_MAX_DISTANCE = _env_int("FACE_RESULT_CACHE_PHASH_MAX_DISTANCE", -1)
+
+# --- Gallery dùng chung giữa các worker (app/gallery_store.py) ---
+# Thư mục chứa snapshot gallery (memmap .npy); để trống = mỗi process tự nạp gallery từ DB.
+# Bật khi chạy nhiều worker uvicorn: các worker dùng chung một bản trong page cache.
+GALLERY_SNAPSHOT_DIR = os.getenv("FACE_GALLERY_SNAPSHOT_DIR", "")
+# Chu kỳ (giây) kiểm tra snapshot mới do worker khác ghi
+GALLERY_SNAPSHOT_CHECK_INTERVAL = float(os.getenv("FACE_GALLERY_SNAPSHOT_CHECK_INTERVAL", "1.0"))
+
+# --- Khởi động (app/warmup.py) ---
+# 1 = nạp model dlib (trong mọi worker của pool) và gallery ở nền khi app khởi động;
+# /health/ready trả 503 cho tới khi xong. 0 = nạp ở request đầu tiên, sẵn sàng ngay.
+WARMUP_ENABLED = _env_int("FACE_WARMUP", 1) != 0
@@ -1,11 +1,16 @@
 # app/crud.py
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 import numpy as np
-from typing import List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional
 from sqlalchemy.orm import selectinload
 
 from . import models
+from . import config
+from . import gallery
+from . import matching
+from . import metrics
 from . import schemas # Mặc dù không trực tiếp dùng schemas trong CRUD, nhưng nó liên quan
 
 # --- User CRUD Operations ---
@@ -23,25 +28,46 @@ def get_user_by_name(db: Session, name: str) -> Optional[models.User]:
     """
     return db.query(models.User).filter(models.User.name == name).first()
 
-def get_users(db: Session, skip: int = 0, limit: int = 100) -> List[models.User]:
+def get_users(db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None) -> List[models.User]:
     """
-    Lấy danh sách người dùng với phân trang.
+    Lấy danh sách người dùng với phân trang, sắp xếp theo ID.
+    Nếu có `after_id` (keyset/cursor): lấy các người dùng có ID > after_id và bỏ qua `skip`,
+    nên chi phí không tăng theo độ sâu trang như OFFSET.
+    Các mã hóa được tải trước bằng một query IN duy nhất (tránh N+1 query khi serialize).
     """
-    return db.query(models.User).offset(skip).limit(limit).all()
+    query = db.query(models.User).options(selectinload(models.User.encodings)).order_by(models.User.id)
+    if after_id is not None:
+        query = query.filter(models.User.id > after_id)
+    elif skip:
+        query = query.offset(skip)
+    return query.limit(limit).all()
+
+def get_user_summaries(db: Session, limit: int = 100, after_id: Optional[int] = None) -> List[Tuple[int, str, int]]:
+    """
+    Danh sách rút gọn (id, tên, số mã hóa) theo keyset trên User.id, bằng MỘT query gộp
+    (LEFT JOIN + COUNT), không tải dữ liệu mã hóa.
+    """
+    query = db.query(models.User.id, models.User.name, func.count(models.FaceEncoding.id)) \
+        .outerjoin(models.FaceEncoding, models.FaceEncoding.user_id == models.User.id) \
+        .group_by(models.User.id, models.User.name) \
+        .order_by(models.User.id)
+    if after_id is not None:
+        query = query.filter(models.User.id > after_id)
+    return [(user_id, name, count) for user_id, name, count in query.limit(limit).all()]
 
 def create_user_with_encodings(db: Session, name: str, encodings_np: List[np.ndarray]) -> Optional[models.User]:
     """
     Tạo một người dùng mới với danh sách các mã hóa khuôn mặt ban đầu.
     Các mã hóa được chuyển đổi thành đối tượng FaceEncoding.
+    Nếu có nhiều ứng viên, chỉ giữ tối đa MAX_ENCODINGS_PER_USER mã hóa đa dạng nhất
+    và bỏ các mã hóa gần như trùng nhau (xem `select_encodings_to_store`).
     """
     if not name:
         raise ValueError("Tên người dùng không được để trống.")
     if get_user_by_name(db, name):
         raise ValueError(f"Người dùng với tên '{name}' đã tồn tại.")
-    
-    if len(encodings_np) > models.MAX_ENCODINGS_PER_USER:
-        # Hoặc bạn có thể chỉ lấy MAX_ENCODINGS_PER_USER phần tử đầu tiên
-        raise ValueError(f"Số lượng mã hóa vượt quá giới hạn {models.MAX_ENCODINGS_PER_USER}.")
+
+    encodings_np = select_encodings_to_store(encodings_np, name=name)
 
     db_user = models.User(name=name)
     
@@ -68,9 +94,9 @@ def create_user_with_encodings(db: Session, name: str, encodings_np: List[np.nda
 
     try:
         db.add(db_user)
-        db.commit()
+        with metrics.timer("db_commit"):
+            db.commit()
         db.refresh(db_user)
-        return db_user
     except IntegrityError as e: # Bắt lỗi nếu tên user bị trùng do race condition (ít khả năng với check get_user_by_name)
         db.rollback()
         # Log the error e
@@ -79,8 +105,32 @@ def create_user_with_encodings(db: Session, name: str, encodings_np: List[np.nda
         db.rollback()
         # Log the error e
         raise RuntimeError(f"Lỗi không xác định khi tạo user '{name}': {e}") from e
+    gallery.gallery_cache.add_user_encodings(db_user)
+    return db_user
 
 
+def select_encodings_to_store(
+    encodings_np: List[np.ndarray],
+    existing_np: Optional[List[np.ndarray]] = None,
+    max_total: int = models.MAX_ENCODINGS_PER_USER,
+    name: str = ""
+) -> List[np.ndarray]:
+    """
+    Chọn các mã hóa ứng viên sẽ được lưu: đa dạng nhất so với nhau và với mã hóa đã có
+    (farthest-point), bỏ các mã hóa cách mã hóa đã giữ dưới config.ENROLL_MIN_ENCODING_DISTANCE,
+    tổng số không vượt quá `max_total`.
+    """
+    if not encodings_np:
+        return []
+    valid_np = [enc for enc in encodings_np if np.asarray(enc).shape == (128,)]
+    if len(valid_np) != len(encodings_np):
+        print(f"Bỏ qua {len(encodings_np) - len(valid_np)} mã hóa sai kích thước của user {name}.")
+    picked = matching.select_diverse_encodings(
+        valid_np, existing_np, max_total=max_total, min_distance=config.ENROLL_MIN_ENCODING_DISTANCE)
+    if len(picked) < len(valid_np):
+        print(f"Giữ {len(picked)}/{len(valid_np)} mã hóa mới của user {name} (bỏ mã hóa trùng lặp hoặc vượt giới hạn).")
+    return [valid_np[i] for i in picked]
+
 def add_encodings_to_user(db: Session, user_id: int, encodings_np: List[np.ndarray]) -> Optional[models.User]:
     """
     Thêm các mã hóa khuôn mặt mới cho một người dùng hiện tại.
@@ -98,7 +148,15 @@ def add_encodings_to_user(db: Session, user_id: int, encodings_np: List[np.ndarr
         # Có thể raise lỗi hoặc trả về user hiện tại mà không thay đổi
         raise ValueError(f"Người dùng {db_user.name} đã đạt giới hạn mã hóa.")
 
-    encodings_to_add_np = encodings_np[:allowed_new_encodings] # Chỉ lấy số lượng được phép
+    existing_np = []
+    for enc in db_user.encodings:
+        try:
+            existing_np.append(enc.get_encoding_array())
+        except ValueError:
+            pass # Mã hóa lỗi không tham gia so sánh, vẫn được tính vào giới hạn ở trên
+    # Chỉ lấy số lượng được phép, ưu tiên các mã hóa khác xa những mã hóa đã lưu
+    encodings_to_add_np = select_encodings_to_store(
+        encodings_np, existing_np, max_total=len(existing_np) + allowed_new_encodings, name=db_user.name)
 
     if not encodings_to_add_np: # Nếu không có encoding nào được cung cấp hoặc đã cắt hết
         return db_user # Trả về user hiện tại không thay đổi
@@ -115,13 +173,227 @@ def add_encodings_to_user(db: Session, user_id: int, encodings_np: List[np.ndarr
             pass
 
     try:
-        db.commit()
+        with metrics.timer("db_commit"):
+            db.commit()
         db.refresh(db_user)
-        return db_user
     except Exception as e:
         db.rollback()
         # Log the error e
         raise RuntimeError(f"Lỗi khi thêm encoding cho user ID {user_id}: {e}") from e
+    gallery.gallery_cache.add_user_encodings(db_user)
+    return db_user
+
+IMPORT_MODES = ("skip", "merge", "replace")
+_SQL_IN_CHUNK = 500 # Giới hạn số tham số của mệnh đề IN (SQLite)
+
+
+def _load_stored_encodings(db: Session, user_ids: List[int]) -> Dict[int, List[np.ndarray]]:
+    """Các mã hóa đã lưu của nhiều người dùng (theo user_id), đọc theo lô."""
+    stored: Dict[int, List[np.ndarray]] = {}
+    for start in range(0, len(user_ids), _SQL_IN_CHUNK):
+        rows = db.query(
+            models.FaceEncoding.user_id,
+            models.FaceEncoding.encoding_blob,
+            models.FaceEncoding.encoding_dtype,
+            models.FaceEncoding.encoding_data,
+        ).filter(models.FaceEncoding.user_id.in_(user_ids[start:start + _SQL_IN_CHUNK]))
+        for user_id, encoding_blob, encoding_dtype, encoding_data in rows:
+            try:
+                vector = models.FaceEncoding.decode_encoding(encoding_blob, encoding_dtype, encoding_data)
+            except ValueError:
+                continue
+            stored.setdefault(user_id, []).append(vector)
+    return stored
+
+
+def _bulk_write_gallery(
+    db: Session,
+    users_encodings: List[Tuple[str, np.ndarray]],
+    mode: str
+) -> Tuple[int, int, int]:
+    """
+    Ghi nhiều người dùng + mã hóa bằng các câu INSERT/DELETE hàng loạt (SQLAlchemy Core),
+    trong MỘT transaction, nhanh hơn nhiều so với tạo từng đối tượng ORM.
+
+    users_encodings: danh sách (tên, ma trận (k, 128)), mỗi tên xuất hiện một lần.
+    mode: cách xử lý tên đã tồn tại
+        "skip"    - bỏ qua người dùng đó
+        "merge"   - thêm mã hóa mới cho đến khi đạt MAX_ENCODINGS_PER_USER
+        "replace" - xóa các mã hóa cũ của người dùng đó rồi ghi mã hóa mới
+    Như khi đăng ký từng người, các mã hóa được giữ là các mã hóa đa dạng nhất
+    (matching.select_diverse_encodings, với mã hóa đã có làm điểm xuất phát ở chế độ "merge").
+    Trả về (số người dùng được tạo mới, số người dùng đã có được cập nhật, số mã hóa được thêm).
+    """
+    if mode not in IMPORT_MODES:
+        raise ValueError(f"Chế độ nhập không hợp lệ: {mode} (chỉ hỗ trợ {', '.join(IMPORT_MODES)})")
+    users_table = models.User.__table__
+    encodings_table = models.FaceEncoding.__table__
+    names = [name for name, _ in users_encodings]
+
+    # Người dùng đã tồn tại và số mã hóa hiện có, bằng một truy vấn gộp cho mỗi lô tên
+    existing: Dict[str, Tuple[int, int]] = {}
+    for start in range(0, len(names), _SQL_IN_CHUNK):
+        chunk = names[start:start + _SQL_IN_CHUNK]
+        rows = db.query(models.User.id, models.User.name, func.count(models.FaceEncoding.id)) \
+            .outerjoin(models.FaceEncoding, models.FaceEncoding.user_id == models.User.id) \
+            .filter(models.User.name.in_(chunk)).group_by(models.User.id).all()
+        for user_id, name, count in rows:
+            existing[name] = (user_id, count)
+
+    try:
+        if mode == "replace":
+            replaced_ids = [user_id for user_id, _ in existing.values()]
+            for start in range(0, len(replaced_ids), _SQL_IN_CHUNK):
+                db.execute(encodings_table.delete().where(
+                    encodings_table.c.user_id.in_(replaced_ids[start:start + _SQL_IN_CHUNK])))
+            existing = {name: (user_id, 0) for name, (user_id, _) in existing.items()}
+
+        new_names = [name for name in names if name not in existing]
+        if new_names:
+            db.execute(users_table.insert(), [{"name": name} for name in new_names])
+            for start in range(0, len(new_names), _SQL_IN_CHUNK):
+                chunk = new_names[start:start + _SQL_IN_CHUNK]
+                for user_id, name in db.query(models.User.id, models.User.name).filter(models.User.name.in_(chunk)):
+                    existing[name] = (user_id, 0)
+
+        new_name_set = set(new_names)
+        stored = _load_stored_encodings(db, [
+            user_id for name, (user_id, count) in existing.items()
+            if name not in new_name_set and 0 < count < models.MAX_ENCODINGS_PER_USER
+        ]) if mode == "merge" else {}
+        users_updated = 0
+        encoding_rows = []
+        for name, vectors in users_encodings:
+            if mode == "skip" and name not in new_name_set:
+                continue
+            user_id, count = existing[name]
+            if count >= models.MAX_ENCODINGS_PER_USER:
+                continue
+            vectors = np.asarray(vectors, dtype=models.ENCODING_STORAGE_DTYPE).reshape(-1, 128)
+            picked = matching.select_diverse_encodings(
+                vectors, stored.get(user_id), max_total=models.MAX_ENCODINGS_PER_USER,
+                min_distance=config.ENROLL_MIN_ENCODING_DISTANCE)
+            vectors = vectors[picked]
+            if name not in new_name_set and len(vectors):
+                users_updated += 1
+            for vector in vectors:
+                encoding_rows.append({
+                    "user_id": user_id,
+                    "encoding_blob": vector.tobytes(),
+                    "encoding_dtype": models.ENCODING_STORAGE_DTYPE,
+                    "encoding_data": None,
+                })
+        if encoding_rows:
+            db.execute(encodings_table.insert(), encoding_rows)
+        with metrics.timer("db_commit"):
+            db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        raise ValueError(f"Lỗi Integrity khi nhập hàng loạt người dùng: {e.orig}") from e
+    except Exception as e:
+        db.rollback()
+        raise RuntimeError(f"Lỗi không xác định khi nhập hàng loạt người dùng: {e}") from e
+    gallery.gallery_cache.invalidate()
+    try:
+        # Snapshot dùng chung: nạp lại và publish ngay để các worker khác thấy dữ liệu vừa nhập
+        gallery.gallery_cache.republish(db)
+    except Exception as e: # Dữ liệu đã commit; gallery sẽ được nạp lại ở lần dùng tiếp theo
+        print(f"Lỗi khi publish gallery sau khi nhập hàng loạt: {type(e).__name__} - {e}")
+    return len(new_names), users_updated, len(encoding_rows)
+
+
+def bulk_add_users_with_encodings(
+    db: Session,
+    users_encodings: Dict[str, List[np.ndarray]],
+    on_existing: str = "merge"
+) -> Tuple[int, int]:
+    """
+    Ghi nhiều người dùng và mã hóa của họ trong MỘT transaction (dùng cho nhập hàng loạt).
+
+    on_existing: cách xử lý tên đã tồn tại ("skip", "merge" hoặc "replace", xem `_bulk_write_gallery`).
+    Trả về (số người dùng được tạo mới, số mã hóa được thêm).
+    Gallery cache được làm mới toàn bộ ở lần nhận dạng tiếp theo.
+    """
+    items = [(name, np.asarray(encs).reshape(-1, 128)) for name, encs in users_encodings.items() if name and len(encs)]
+    users_created, _, encodings_added = _bulk_write_gallery(db, items, on_existing)
+    return users_created, encodings_added
+
+
+# --- Xuất / nhập gallery dạng nhị phân (.npz) ---
+# names:      (U,) chuỗi unicode, tên người dùng
+# user_index: (N,) int32, chỉ số trong `names` của từng mã hóa
+# encodings:  (N, 128) float32
+GALLERY_ARCHIVE_VERSION = 1
+
+
+def export_gallery(db: Session) -> Dict[str, np.ndarray]:
+    """Toàn bộ người dùng có mã hóa, dưới dạng các mảng để ghi bằng np.savez."""
+    rows = db.query(
+        models.User.name,
+        models.FaceEncoding.id,
+        models.FaceEncoding.encoding_blob,
+        models.FaceEncoding.encoding_dtype,
+        models.FaceEncoding.encoding_data,
+    ).join(models.User, models.FaceEncoding.user_id == models.User.id) \
+        .order_by(models.User.id, models.FaceEncoding.id).all()
+
+    names: List[str] = []
+    name_index: Dict[str, int] = {}
+    user_index: List[int] = []
+    vectors: List[np.ndarray] = []
+    for name, encoding_id, encoding_blob, encoding_dtype, encoding_data in rows:
+        try:
+            vector = models.FaceEncoding.decode_encoding(encoding_blob, encoding_dtype, encoding_data)
+        except ValueError as e:
+            print(f"Bỏ qua encoding ID {encoding_id} của user {name} khi xuất: {e}")
+            continue
+        if name not in name_index:
+            name_index[name] = len(names)
+            names.append(name)
+        user_index.append(name_index[name])
+        vectors.append(vector)
+
+    return {
+        "format_version": np.array(GALLERY_ARCHIVE_VERSION, dtype=np.int32),
+        "names": np.array(names, dtype=np.str_),
+        "user_index": np.asarray(user_index, dtype=np.int32),
+        "encodings": np.asarray(vectors, dtype=models.ENCODING_STORAGE_DTYPE).reshape(len(vectors), 128),
+    }
+
+
+def import_gallery(db: Session, archive: Dict[str, np.ndarray], mode: str = "merge") -> Tuple[int, int, int]:
+    """
+    Nhập một gallery đã xuất bằng `export_gallery` (trong một transaction).
+    ValueError nếu dữ liệu không hợp lệ. Trả về như `_bulk_write_gallery`.
+    """
+    try:
+        version = int(archive["format_version"])
+        names = np.asarray(archive["names"])
+        user_index = np.asarray(archive["user_index"])
+        encodings = np.asarray(archive["encodings"])
+    except KeyError as e:
+        raise ValueError(f"File gallery thiếu mảng {e}")
+    if version != GALLERY_ARCHIVE_VERSION:
+        raise ValueError(f"Phiên bản định dạng gallery không được hỗ trợ: {version}")
+    if names.ndim != 1 or names.dtype.kind != "U":
+        raise ValueError("Mảng names phải là mảng chuỗi một chiều.")
+    if encodings.ndim != 2 or encodings.shape[1] != 128 or encodings.dtype.kind != "f":
+        raise ValueError("Mảng encodings phải có kích thước (N, 128) kiểu số thực.")
+    if user_index.shape != (encodings.shape[0],) or user_index.dtype.kind not in "iu":
+        raise ValueError("Mảng user_index phải có một chỉ số nguyên cho mỗi mã hóa.")
+    if user_index.size and (user_index.min() < 0 or user_index.max() >= names.shape[0]):
+        raise ValueError("user_index chứa chỉ số ngoài phạm vi của names.")
+    if not np.isfinite(encodings).all():
+        raise ValueError("encodings chứa giá trị NaN hoặc vô cực.")
+    if len(set(names.tolist())) != names.shape[0] or any(not name.strip() for name in names.tolist()):
+        raise ValueError("names phải là các tên khác rỗng và không trùng nhau.")
+
+    # Gom mã hóa theo người dùng, giữ thứ tự trong file
+    order = np.argsort(user_index, kind="stable")
+    counts = np.bincount(user_index, minlength=names.shape[0])
+    groups = np.split(encodings[order], np.cumsum(counts)[:-1])
+    items = [(str(name), vectors) for name, vectors in zip(names.tolist(), groups) if len(vectors)]
+    return _bulk_write_gallery(db, items, mode)
 
 def delete_user(db: Session, user_id: int) -> bool:
     """
@@ -132,13 +404,15 @@ def delete_user(db: Session, user_id: int) -> bool:
     if db_user:
         try:
             db.delete(db_user)
-            db.commit()
-            return True
+            with metrics.timer("db_commit"):
+                db.commit()
         except Exception as e:
             db.rollback()
             # Log the error e
             print(f"Lỗi khi xóa user ID {user_id}: {e}") # Ghi log lỗi
             return False # Hoặc raise lại lỗi để API layer xử lý
+        gallery.gallery_cache.remove_user(user_id)
+        return True
     return False
 
 # --- FaceEncoding CRUD Operations (thường được quản lý thông qua User) ---
@@ -159,13 +433,15 @@ def delete_face_encoding(db: Session, encoding_id: int) -> bool:
     if db_encoding:
         try:
             db.delete(db_encoding)
-            db.commit()
-            return True
+            with metrics.timer("db_commit"):
+                db.commit()
         except Exception as e:
             db.rollback()
             # Log the error e
             print(f"Lỗi khi xóa encoding ID {encoding_id}: {e}")
             return False
+        gallery.gallery_cache.remove_encoding(encoding_id)
+        return True
     return False
 
 
@@ -1,46 +1,277 @@
 # app/face_utils.py
-import face_recognition # The actual library
 import numpy as np
 from PIL import Image
 import io
-from typing import List, Tuple, Optional
+import os
+import threading
+import time
+from typing import Dict, List, Tuple, Optional, Union
 
-# Default tolerance, can be adjusted
-RECOGNITION_TOLERANCE = 0.5 # CLI uses 0.6, 0.5 is a bit stricter
+from . import config
+from .matching import RECOGNITION_TOLERANCE, match_faces_batch
+
+# face_recognition nạp các model dlib ngay khi import (tốn thời gian và bộ nhớ),
+# nên chỉ import ở lần dùng đầu tiên: trong lúc warm-up hoặc trong worker process
+_face_recognition = None
+_face_recognition_lock = threading.Lock()
+
+
+def get_face_recognition():
+    """Returns the face_recognition module, importing it (and loading the dlib models) on first use."""
+    global _face_recognition
+    if _face_recognition is None:
+        with _face_recognition_lock:
+            if _face_recognition is None:
+                import face_recognition # The actual library
+                _face_recognition = face_recognition
+    return _face_recognition
 
 def load_image_into_numpy_array(data: bytes) -> np.ndarray:
-    """Loads an image file into a numpy array."""
+    """Loads an image file into a numpy array (full resolution)."""
+    image_np, _ = decode_image(data, max_side=0)
+    return image_np
+
+
+def decode_image(data: bytes, max_side: int = config.DECODE_MAX_SIDE) -> Tuple[np.ndarray, Tuple[int, int]]:
+    """
+    Decodes an uploaded image into an RGB uint8 array, at reduced size when possible.
+
+    For JPEGs larger than `max_side` (0 disables this), the decoder's DCT scaling
+    (Pillow draft mode) decodes directly at 1/2, 1/4 or 1/8 of the size, keeping the
+    longest side >= `max_side`; other formats are decoded at full size. The mode
+    conversion is skipped when the image is already RGB, so the only full-size
+    copy is the final (writable, as dlib requires) array.
+
+    Returns:
+        (image_np, (original_height, original_width)); boxes found on `image_np`
+        can be mapped back with `boxes_to_original`.
+        Raises ValueError if the image cannot be decoded.
+    """
     try:
         image = Image.open(io.BytesIO(data))
+        original_width, original_height = image.size
+        if max_side and image.format == "JPEG" and max(original_width, original_height) > max_side:
+            ratio = max_side / float(max(original_width, original_height))
+            # draft() only picks a scale that keeps the image at least this large
+            image.draft("RGB", (int(original_width * ratio), int(original_height * ratio)))
         # Convert to RGB if not already (e.g., PNGs with alpha, grayscale)
         if image.mode != 'RGB':
             image = image.convert('RGB')
-        # Optional: Resize like in the CLI script if images are very large
-        # if max(image.size) > 1600:
-        #     image.thumbnail((1600, 1600), Image.Resampling.LANCZOS) # Note: PIL.Image.LANCZOS for newer Pillow
-        return np.array(image)
+        return np.array(image), (original_height, original_width)
     except Exception as e:
         # Log the error e
         raise ValueError(f"Could not load image: {e}")
 
 
+def boxes_to_original(
+    face_locations: List[Tuple[int, int, int, int]],
+    decoded_shape: Tuple[int, ...],
+    original_shape: Tuple[int, int]
+) -> List[Tuple[int, int, int, int]]:
+    """Maps boxes found on a reduced decode (see `decode_image`) back to original-image coordinates."""
+    height, width = original_shape
+    if decoded_shape[0] == height and decoded_shape[1] == width:
+        return list(face_locations)
+    factor = width / float(decoded_shape[1])
+    return [scale_box(box, factor, height, width) for box in face_locations]
+
+
+def perceptual_hash(data: bytes, hash_size: int = 8) -> int:
+    """
+    Difference hash (dHash) of an encoded image: a `hash_size`**2-bit integer that
+    changes little between near-identical frames (compare with Hamming distance).
+    Decodes at reduced size (JPEG draft mode), so it is much cheaper than a full decode.
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.draft("L", (hash_size * 4, hash_size * 4))
+        small = image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    except Exception as e:
+        raise ValueError(f"Could not load image: {e}")
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
 def get_face_encodings_from_image(image_np: np.ndarray) -> List[np.ndarray]:
     """
     Returns a list of 128-dimension face encodings from an image.
     Returns an empty list if no faces are found.
     """
-    # model="cnn" is more accurate but slower. Default "hog" is faster.
-    face_locations = face_recognition.face_locations(image_np) # You can specify model="cnn"
+    # HOG on a downscaled copy; boxes come back in original-image coordinates
+    face_locations = detect_faces(image_np)
     if not face_locations:
         return []
-    face_encodings = face_recognition.face_encodings(image_np, known_face_locations=face_locations)
+    face_encodings = get_face_recognition().face_encodings(image_np, known_face_locations=face_locations)
     return face_encodings
 
 
+def detect_faces(
+    image_np: np.ndarray,
+    detection_max_side: int = config.DETECTION_MAX_SIDE,
+    upsample: int = config.DETECTION_UPSAMPLE
+) -> List[Tuple[int, int, int, int]]:
+    """
+    HOG face detection on a downscaled copy of the image.
+
+    HOG cost grows with pixel count, so the image is shrunk until its longest side
+    is at most `detection_max_side` (0 disables this) and the detected boxes are
+    mapped back to original-image (top, right, bottom, left) coordinates.
+    """
+    height, width = image_np.shape[:2]
+    scale = 1.0
+    if detection_max_side and max(height, width) > detection_max_side:
+        scale = detection_max_side / float(max(height, width))
+        small_size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+        detect_image = np.asarray(Image.fromarray(image_np).resize(small_size, Image.BILINEAR))
+    else:
+        detect_image = image_np
+
+    face_locations = get_face_recognition().face_locations(detect_image, number_of_times_to_upsample=upsample, model="hog")
+    if scale == 1.0:
+        return face_locations
+    return [scale_box(box, 1.0 / scale, height, width) for box in face_locations]
+
+
+def scale_box(box: Tuple[int, int, int, int], factor: float, height: int, width: int) -> Tuple[int, int, int, int]:
+    """Scales a (top, right, bottom, left) box by `factor` and clips it to a height x width image."""
+    top, right, bottom, left = box
+    return (
+        max(0, int(round(top * factor))),
+        min(width, int(round(right * factor))),
+        min(height, int(round(bottom * factor))),
+        max(0, int(round(left * factor))),
+    )
+
+
+def decode_and_detect(
+    data: bytes,
+    timings: Optional[Dict[str, float]] = None
+) -> Tuple[np.ndarray, List[Tuple[int, int, int, int]], Tuple[int, int]]:
+    """
+    First half of the pipeline: decode and detect, without encoding.
+    Lets callers (e.g. the per-session tracker) choose which faces to encode.
+
+    Boxes are in `image_np` coordinates (which may be a reduced decode, see
+    `decode_image`); use `boxes_to_original` with the returned original shape
+    before showing them to a client.
+    If `timings` is given, the "decode" and "detect" durations (seconds) are stored in it.
+    """
+    start = time.perf_counter()
+    image_np, original_shape = decode_image(data)
+    decoded = time.perf_counter()
+    face_locations = detect_faces(image_np)
+    if timings is not None:
+        timings["decode"] = decoded - start
+        timings["detect"] = time.perf_counter() - decoded
+    return image_np, face_locations, original_shape
+
+
+def encode_faces(
+    image_np: np.ndarray,
+    face_locations: List[Tuple[int, int, int, int]],
+    timings: Optional[Dict[str, float]] = None
+) -> List[np.ndarray]:
+    """Second half of the pipeline: 128-d encodings for the given boxes, at decode resolution."""
+    if not face_locations:
+        return []
+    start = time.perf_counter()
+    # Landmarks and the 150x150 chip only depend on the face region, not the image size
+    encodings = get_face_recognition().face_encodings(image_np, known_face_locations=face_locations)
+    if timings is not None:
+        timings["encode"] = time.perf_counter() - start
+    return encodings
+
+
+def detect_and_encode(
+    data: bytes,
+    timings: Optional[Dict[str, float]] = None
+) -> Tuple[List[Tuple[int, int, int, int]], List[np.ndarray]]:
+    """
+    Full CPU-bound pipeline for one uploaded image: decode (reduced size for large
+    JPEGs, see `decode_image`), HOG detection (on a downscaled copy, see `detect_faces`)
+    and encoding at decode resolution.
+    Meant to be run in the worker pool (app/workers.py), so it must stay a top-level function.
+
+    Returns:
+        (face_locations, face_encodings), both empty if no face is found.
+        Boxes are in original-image coordinates.
+        Raises ValueError if the image cannot be decoded.
+        Stage durations go into `timings` when given (see `decode_and_detect`).
+    """
+    image_np, face_locations, original_shape = decode_and_detect(data, timings)
+    if not face_locations:
+        return [], []
+    encodings = encode_faces(image_np, face_locations, timings)
+    return boxes_to_original(face_locations, image_np.shape, original_shape), encodings
+
+
+def detect_only(
+    data: bytes,
+    upsample: int = config.DETECTION_UPSAMPLE,
+    timings: Optional[Dict[str, float]] = None
+) -> Tuple[List[Tuple[int, int, int, int]], Tuple[int, int]]:
+    """
+    Decode + HOG detection only (no landmarks, encoding or matching), for clients
+    that just need boxes to draw every frame. Worker-pool safe like `detect_and_encode`.
+
+    Returns:
+        (face_locations in original-image coordinates, (original_height, original_width)).
+    """
+    start = time.perf_counter()
+    image_np, original_shape = decode_image(data)
+    decoded = time.perf_counter()
+    face_locations = detect_faces(image_np, upsample=upsample)
+    if timings is not None:
+        timings["decode"] = decoded - start
+        timings["detect"] = time.perf_counter() - decoded
+    return boxes_to_original(face_locations, image_np.shape, original_shape), original_shape
+
+
+def warm_up(timings: Optional[Dict[str, float]] = None) -> int:
+    """
+    Loads the dlib models and runs detection and encoding once on a synthetic image,
+    so the first real request does not pay for model loading or first-call setup.
+    Worker-pool safe; run it once per worker process. Returns the process id.
+    """
+    start = time.perf_counter()
+    get_face_recognition()
+    loaded = time.perf_counter()
+    # Ảnh nhiễu cố định: không có khuôn mặt, nhưng chạy qua đủ decode, HOG và mạng encode
+    rng = np.random.default_rng(0)
+    image_np = rng.integers(0, 256, size=(480, 640, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(image_np).save(buffer, format="JPEG")
+    decode_and_detect(buffer.getvalue())
+    detected = time.perf_counter()
+    encode_faces(image_np, [(40, 120, 120, 40)])
+    if timings is not None:
+        timings["warmup_load"] = loaded - start
+        timings["warmup_detect"] = detected - loaded
+        timings["warmup_encode"] = time.perf_counter() - detected
+    return os.getpid()
+
+
+def find_best_matches(
+    unknown_encodings: Union[List[np.ndarray], np.ndarray],
+    known_encodings: np.ndarray,
+    known_names: Union[List[str], np.ndarray],
+    tolerance: float = RECOGNITION_TOLERANCE
+) -> List[Tuple[Optional[str], Optional[float]]]:
+    """
+    Batched equivalent of `find_best_match`: one (name, distance) pair per
+    unknown face, (None, None) where nothing is within tolerance.
+    """
+    return [
+        candidates[0] if candidates else (None, None)
+        for candidates in match_faces_batch(unknown_encodings, known_encodings, known_names, tolerance)
+    ]
+
+
 def find_best_match(
     unknown_encoding: np.ndarray,
-    known_encodings: List[np.ndarray],
-    known_names: List[str],
+    known_encodings: Union[List[np.ndarray], np.ndarray],
+    known_names: Union[List[str], np.ndarray],
     tolerance: float = RECOGNITION_TOLERANCE
 ) -> Tuple[Optional[str], Optional[float]]:
     """
@@ -50,20 +281,6 @@ def find_best_match(
         A tuple (name, distance). (None, None) if no match found within tolerance.
         If multiple matches are within tolerance, returns the one with the smallest distance.
     """
-    if not known_encodings:
+    if len(known_encodings) == 0:
         return None, None
-
-    # Calculate distances from the unknown encoding to all known encodings
-    distances = face_recognition.face_distance(known_encodings, unknown_encoding)
-
-    best_match_name: Optional[str] = None
-    min_distance: float = float('inf')
-
-    for i, distance in enumerate(distances):
-        if distance <= tolerance and distance < min_distance:
-            min_distance = distance
-            best_match_name = known_names[i]
-
-    if best_match_name:
-        return best_match_name, min_distance
-    return None, None # No match found within tolerance
\ No newline at end of file
+    return find_best_matches([unknown_encoding], np.asarray(known_encodings, dtype=np.float64), known_names, tolerance)[0]
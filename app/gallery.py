@@ -0,0 +1,428 @@
+# app/gallery.py
+import threading
+import time
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from . import ann_index
+from . import config
+from . import gallery_store
+from . import matching
+from . import models
+from .database import SessionLocal
+
+ENCODING_DIM = 128
+# Mã hóa được lưu dạng float32 trong DB và snapshot trên đĩa, nên giữ float32 trong bộ nhớ
+# cũng không mất độ chính xác (một nửa so với float64)
+SNAPSHOT_DTYPE = np.float32
+
+
+class GallerySnapshot(NamedTuple):
+    """
+    Immutable view of the gallery at one point in time.
+
+    `encodings` is a contiguous (N, 128) float matrix; row i belongs to
+    `names[i]` / `user_ids[i]` and was stored as FaceEncoding `encoding_ids[i]`.
+    Rows are kept sorted by encoding id so ids can be mapped back with a binary search.
+    """
+    encodings: np.ndarray
+    names: np.ndarray
+    user_ids: np.ndarray
+    encoding_ids: np.ndarray
+    version: int
+
+    @property
+    def size(self) -> int:
+        return self.encodings.shape[0]
+
+
+def _empty_snapshot(version: int = 0) -> GallerySnapshot:
+    return GallerySnapshot(
+        encodings=np.empty((0, ENCODING_DIM), dtype=SNAPSHOT_DTYPE),
+        names=np.empty((0,), dtype=object),
+        user_ids=np.empty((0,), dtype=np.int64),
+        encoding_ids=np.empty((0,), dtype=np.int64),
+        version=version,
+    )
+
+
+class GalleryCache:
+    """
+    In-process cache of every known face encoding.
+
+    The matrix is built from the database once (lazily, on first use) and is then
+    kept in sync by the CRUD layer after each successful commit, so the
+    recognition hot path never has to query or JSON-decode the whole table.
+
+    Updates are copy-on-write: readers keep whatever snapshot they already hold,
+    writers swap in a new one under a lock.
+
+    When `index_kind` is "ivf", "centroid" or "quantized" and the gallery is large
+    enough, an approximate index (app/ann_index.py) is maintained alongside the
+    matrix and used by `match`; otherwise matching is an exact brute-force scan of
+    the snapshot. Candidates from the quantized index are re-ranked with the exact
+    rows of the snapshot (`config.QUANTIZED_RERANK`).
+
+    The quantized index needs a `store`: once it is built and the gallery is
+    published, the snapshot's float rows are the read-only memmap of the on-disk
+    snapshot, so the process only keeps the compact codes resident and re-ranking
+    reads a few pages of the file.
+
+    With a `store` (app/gallery_store.py), the gallery is shared between worker
+    processes: it is memory-mapped from the newest on-disk snapshot instead of
+    being read from the database, every change made by this process is written
+    back as a new snapshot, and snapshots written by other processes are picked
+    up within `config.GALLERY_SNAPSHOT_CHECK_INTERVAL` seconds.
+    """
+
+    def __init__(self, index_kind: str = config.MATCH_INDEX, store: Optional[gallery_store.GalleryStore] = None):
+        self._lock = threading.Lock()
+        self._snapshot: GallerySnapshot = _empty_snapshot()
+        self._loaded = False
+        self._label_groups = None # (version, groups) cho matching.group_labels
+        self.index_kind = index_kind
+        self._index = None
+        self._store = store
+        self._store_stamp: Optional[str] = None # Snapshot trên đĩa mà bộ nhớ đang khớp với
+        self._store_dirty = False # True: snapshot trên đĩa đã cũ, phải nạp lại từ DB
+        self._store_checked_at = 0.0
+        self._publish_lock = threading.Lock()
+        if index_kind == ann_index.QuantizedIndex.kind and store is None:
+            print("FACE_MATCH_INDEX=quantized cần FACE_GALLERY_SNAPSHOT_DIR (re-rank đọc từ snapshot trên đĩa), "
+                  "gallery dùng brute force.")
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._loaded
+
+    @property
+    def size(self) -> int:
+        """Number of cached encodings (0 until the gallery is loaded)."""
+        return self._snapshot.size
+
+    @property
+    def version(self) -> int:
+        return self._snapshot.version
+
+    @property
+    def store_stamp(self) -> Optional[str]:
+        """Stamp of the shared on-disk snapshot the cache currently matches, if any."""
+        return self._store_stamp
+
+    def load(self, db: Session) -> GallerySnapshot:
+        """(Re)builds the whole gallery from the database (and publishes it to the store)."""
+        with self._publish_lock:
+            snapshot = self._load_from_db(db)
+            self._publish()
+        return snapshot
+
+    def _load_from_db(self, db: Session) -> GallerySnapshot:
+        rows = db.query(
+            models.FaceEncoding.id,
+            models.FaceEncoding.user_id,
+            models.User.name,
+            models.FaceEncoding.encoding_blob,
+            models.FaceEncoding.encoding_dtype,
+            models.FaceEncoding.encoding_data,
+        ).join(models.User, models.FaceEncoding.user_id == models.User.id).order_by(models.FaceEncoding.id).all()
+
+        vectors: List[np.ndarray] = []
+        names: List[str] = []
+        user_ids: List[int] = []
+        encoding_ids: List[int] = []
+        for encoding_id, user_id, name, encoding_blob, encoding_dtype, encoding_data in rows:
+            try:
+                vector = models.FaceEncoding.decode_encoding(encoding_blob, encoding_dtype, encoding_data)
+            except ValueError as e:
+                print(f"Lỗi khi đọc encoding ID {encoding_id} cho user {name}: {e}")
+                continue
+            vectors.append(vector)
+            names.append(name)
+            user_ids.append(user_id)
+            encoding_ids.append(encoding_id)
+
+        with self._lock:
+            snapshot = self._build(vectors, names, user_ids, encoding_ids, self._snapshot.version + 1)
+            self._snapshot = snapshot
+            self._loaded = True
+            self._index = None
+            self._maybe_build_index()
+        return snapshot
+
+    def get_snapshot(self, db: Optional[Session] = None) -> GallerySnapshot:
+        """
+        Returns the current snapshot, loading it on first use from the shared
+        store when there is one, else from the database (through `db`, or a
+        short-lived session when none is given).
+        """
+        if self._store is not None:
+            if db is None and not self._loaded:
+                with SessionLocal() as session:
+                    self._refresh_from_store(session)
+            else:
+                self._refresh_from_store(db)
+        if not self._loaded:
+            if db is not None:
+                return self.load(db)
+            with SessionLocal() as session:
+                return self.load(session)
+        return self._snapshot
+
+    def _refresh_from_store(self, db: Optional[Session]) -> None:
+        """Switches to a newer on-disk snapshot (written by any process), if there is one."""
+        now = time.monotonic()
+        if self._loaded and now - self._store_checked_at < config.GALLERY_SNAPSHOT_CHECK_INTERVAL:
+            return
+        self._store_checked_at = now
+        if self._store_dirty:
+            return # Snapshot trên đĩa thiếu các thay đổi đã commit, get_snapshot sẽ nạp từ DB
+        stamp = self._store.current_stamp()
+        if stamp is None or stamp == self._store_stamp:
+            return
+        if not self._publish_lock.acquire(blocking=False):
+            return # Thread khác đang thay đổi/publish gallery, kiểm tra lại ở lần sau
+        try:
+            self._switch_to_stored(stamp, db)
+        finally:
+            self._publish_lock.release()
+
+    def _switch_to_stored(self, stamp: str, db: Optional[Session]) -> None:
+        # Phải được gọi khi đang giữ self._publish_lock
+        stored = self._store.read(stamp)
+        if stored is None:
+            return
+        if not self._loaded and db is not None and not self._store_matches_db(stored, db):
+            print(f"Gallery snapshot {stamp} không khớp với database, nạp lại từ database.")
+            self._store_dirty = True
+            return
+        with self._lock:
+            self._snapshot = GallerySnapshot(
+                encodings=stored.encodings,
+                names=stored.names,
+                user_ids=stored.user_ids,
+                encoding_ids=stored.encoding_ids,
+                version=self._snapshot.version + 1,
+            )
+            self._store_stamp = stamp
+            self._loaded = True
+            self._index = None
+            self._maybe_build_index()
+
+    @staticmethod
+    def _store_matches_db(stored: gallery_store.StoredGallery, db: Session) -> bool:
+        # Kiểm tra rẻ lúc khởi động, phát hiện DB bị sửa khi không có app chạy (ví dụ script khác)
+        count, max_id = db.query(func.count(models.FaceEncoding.id), func.max(models.FaceEncoding.id)).one()
+        return count == stored.encoding_ids.shape[0] and (max_id or 0) == stored.max_encoding_id
+
+    def _publish(self) -> None:
+        """
+        Writes the in-memory gallery as the newest shared snapshot (no-op without a store).
+        Must be called while holding `self._publish_lock`.
+        """
+        if self._store is None or not self._loaded:
+            return
+        with self._store.lock():
+            current_stamp = self._store.current_stamp()
+            if current_stamp is not None and current_stamp != self._store_stamp and not self._store_dirty:
+                # Process khác đã ghi snapshot trong lúc này: bộ nhớ thiếu thay đổi của họ, DB mới là chuẩn
+                with SessionLocal() as session:
+                    self._load_from_db(session)
+            snapshot = self._snapshot
+            stamp = self._store.write(snapshot.encodings, snapshot.names, snapshot.user_ids, snapshot.encoding_ids)
+            self._store_stamp = stamp
+            self._store_dirty = False
+            if isinstance(self._index, ann_index.QuantizedIndex) and not isinstance(snapshot.encodings, np.memmap):
+                self._use_stored_encodings(stamp, snapshot)
+
+    def _use_stored_encodings(self, stamp: str, snapshot: GallerySnapshot) -> None:
+        """
+        Replaces the in-memory float rows of `snapshot` with the memmap of the snapshot
+        just written as `stamp` (same rows, same order), so that with a quantized index
+        the dense matrix is not kept resident next to the codes.
+        """
+        stored = self._store.read(stamp)
+        if stored is None or stored.encodings.shape != snapshot.encodings.shape:
+            return
+        with self._lock:
+            if self._snapshot is snapshot: # Cùng nội dung và version: index vẫn dùng được
+                self._snapshot = snapshot._replace(encodings=stored.encodings)
+
+    def get_label_groups(self, snapshot: GallerySnapshot) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Per-user column grouping of `snapshot`, memoized until the gallery changes."""
+        cached = self._label_groups
+        if cached is not None and cached[0] == snapshot.version:
+            return cached[1]
+        groups = matching.group_labels(snapshot.names)
+        self._label_groups = (snapshot.version, groups)
+        return groups
+
+    def add_user_encodings(self, user: models.User) -> None:
+        """
+        Appends the encodings of `user` that are not in the cache yet.
+        Called after create/add commits; a no-op until the gallery is loaded.
+        """
+        if not self._loaded:
+            return
+        with self._publish_lock: # Không cho _refresh_from_store chen vào giữa thay đổi và publish
+            with self._lock:
+                current = self._snapshot
+                known_ids = set(current.encoding_ids.tolist())
+                new_rows = [enc for enc in user.encodings if enc.id not in known_ids]
+                if not new_rows:
+                    return
+                vectors: List[np.ndarray] = []
+                encoding_ids: List[int] = []
+                for enc in new_rows:
+                    try:
+                        vectors.append(enc.get_encoding_array())
+                        encoding_ids.append(enc.id)
+                    except ValueError as e:
+                        print(f"Lỗi khi đọc encoding ID {enc.id} cho user {user.name}: {e}")
+                if not vectors:
+                    return
+                added = np.asarray(vectors, dtype=SNAPSHOT_DTYPE).reshape(len(vectors), -1)
+                added_ids = np.asarray(encoding_ids, dtype=np.int64)
+                snapshot = GallerySnapshot(
+                    encodings=np.vstack([current.encodings, added]),
+                    names=np.concatenate([current.names, np.array([user.name] * len(vectors), dtype=object)]),
+                    user_ids=np.concatenate([current.user_ids, np.full(len(vectors), user.id, dtype=np.int64)]),
+                    encoding_ids=np.concatenate([current.encoding_ids, added_ids]),
+                    version=current.version + 1,
+                )
+                if current.size and added_ids.min() <= current.encoding_ids[-1]:
+                    order = np.argsort(snapshot.encoding_ids, kind="stable")
+                    snapshot = GallerySnapshot(*(field[order] for field in snapshot[:4]), version=snapshot.version)
+                self._snapshot = snapshot._replace(encodings=np.ascontiguousarray(snapshot.encodings))
+                if self._index is not None:
+                    self._index.add(added, added_ids, labels=np.full(len(vectors), user.id, dtype=np.int64))
+                else:
+                    self._maybe_build_index()
+            self._publish()
+
+    def remove_user(self, user_id: int) -> None:
+        """Drops every encoding that belongs to `user_id`."""
+        if not self._loaded:
+            return
+        with self._publish_lock: # Không cho _refresh_from_store chen vào giữa thay đổi và publish
+            with self._lock:
+                removed = self._remove_where(self._snapshot.user_ids == user_id)
+            if removed:
+                self._publish()
+
+    def remove_encoding(self, encoding_id: int) -> None:
+        """Drops a single encoding row."""
+        if not self._loaded:
+            return
+        with self._publish_lock: # Không cho _refresh_from_store chen vào giữa thay đổi và publish
+            with self._lock:
+                removed = self._remove_where(self._snapshot.encoding_ids == encoding_id)
+            if removed:
+                self._publish()
+
+    def invalidate(self) -> None:
+        """
+        Forgets the cached matrix; the next `get_snapshot(db)` reloads from the
+        database (not from the shared store, which is now stale too) and republishes it.
+        """
+        with self._lock:
+            self._snapshot = _empty_snapshot(self._snapshot.version + 1)
+            self._loaded = False
+            self._index = None
+            self._store_dirty = self._store is not None
+
+    def republish(self, db: Session) -> None:
+        """
+        Reloads an invalidated gallery from the database and publishes it to the
+        store right away, so other processes stop matching against the old
+        snapshot without waiting for this one to serve a request.
+        No-op without a store (the reload stays lazy).
+        """
+        if self._store is not None:
+            self.get_snapshot(db)
+
+    def match(
+        self,
+        unknown_encodings,
+        tolerance: float = matching.RECOGNITION_TOLERANCE,
+        top_k: int = 1,
+        aggregate: Optional[str] = None,
+        snapshot: Optional[GallerySnapshot] = None
+    ) -> List[List[Tuple[str, float]]]:
+        """
+        Matches the faces of one image against the gallery, using the ANN index
+        when one is active and an exact scan otherwise. See `matching.match_faces_batch`.
+        """
+        snapshot = snapshot if snapshot is not None else self._snapshot
+        index = self._index
+        if index is not None and snapshot.version == self._snapshot.version:
+            rerank = config.QUANTIZED_RERANK if index.kind == ann_index.QuantizedIndex.kind else 0
+            return matching.match_faces_with_index(
+                unknown_encodings, index, snapshot.encoding_ids, snapshot.names,
+                tolerance=tolerance, top_k=top_k, aggregate=aggregate,
+                candidates_per_user=models.MAX_ENCODINGS_PER_USER,
+                known_encodings=snapshot.encodings, rerank=rerank,
+            )
+        return matching.match_faces_batch(
+            unknown_encodings, snapshot.encodings, snapshot.names,
+            tolerance=tolerance, top_k=top_k, aggregate=aggregate,
+            groups=self.get_label_groups(snapshot) if aggregate else None,
+        )
+
+    def _maybe_build_index(self) -> None:
+        # Phải được gọi khi đang giữ self._lock
+        if self.index_kind == ann_index.BruteForceIndex.kind:
+            return # Snapshot chính là chỉ mục brute force, không cần bản sao
+        if self.index_kind == ann_index.CentroidIndex.kind:
+            if self._snapshot.size < config.CENTROID_MIN_GALLERY_SIZE:
+                return
+            options = {"shortlist": config.CENTROID_SHORTLIST}
+        elif self.index_kind == ann_index.QuantizedIndex.kind:
+            if self._store is None or self._snapshot.size < config.QUANTIZED_MIN_GALLERY_SIZE:
+                return # Không có snapshot trên đĩa: giữ ma trận float và brute force thì không tốn thêm bản nén
+            options = {"precision": config.QUANTIZED_PRECISION, "scale": config.QUANTIZED_SCALE}
+        else:
+            if self._snapshot.size < config.IVF_MIN_GALLERY_SIZE:
+                return
+            options = {"nlist": config.IVF_NLIST, "nprobe": config.IVF_NPROBE}
+        index = ann_index.make_index(self.index_kind, dim=self._snapshot.encodings.shape[1], **options)
+        index.build(self._snapshot.encodings, self._snapshot.encoding_ids, labels=self._snapshot.user_ids)
+        self._index = index
+
+    def _remove_where(self, mask: np.ndarray) -> bool:
+        # Phải được gọi khi đang giữ self._lock
+        if not mask.any():
+            return False
+        keep = ~mask
+        current = self._snapshot
+        if self._index is not None:
+            self._index.remove(current.encoding_ids[mask])
+        self._snapshot = GallerySnapshot(
+            encodings=np.ascontiguousarray(current.encodings[keep]),
+            names=current.names[keep],
+            user_ids=current.user_ids[keep],
+            encoding_ids=current.encoding_ids[keep],
+            version=current.version + 1,
+        )
+        return True
+
+    @staticmethod
+    def _build(vectors: List[np.ndarray], names: List[str], user_ids: List[int],
+               encoding_ids: List[int], version: int) -> GallerySnapshot:
+        if not vectors:
+            return _empty_snapshot(version)
+        return GallerySnapshot(
+            encodings=np.ascontiguousarray(np.vstack(vectors), dtype=SNAPSHOT_DTYPE),
+            names=np.array(names, dtype=object),
+            user_ids=np.asarray(user_ids, dtype=np.int64),
+            encoding_ids=np.asarray(encoding_ids, dtype=np.int64),
+            version=version,
+        )
+
+
+# Một instance dùng chung cho cả process; dùng chung giữa các worker khi có FACE_GALLERY_SNAPSHOT_DIR
+gallery_cache = GalleryCache(
+    store=gallery_store.GalleryStore(config.GALLERY_SNAPSHOT_DIR) if config.GALLERY_SNAPSHOT_DIR else None
+)
@@ -0,0 +1,173 @@
+# app/gallery_store.py
+"""
+On-disk gallery snapshot shared by every worker process.
+
+Layout of the snapshot directory (FACE_GALLERY_SNAPSHOT_DIR):
+
+    CURRENT                    -- stamp of the active snapshot, switched with os.replace
+    encodings-<stamp>.npy      -- (N, 128) float32 matrix, opened with np.load(mmap_mode="r")
+    ids-<stamp>.npy            -- (N, 2) int64: encoding id, user id
+    labels-<stamp>.json        -- user names (one per row) and DB consistency info
+
+Data files are immutable once written; a writer creates a new stamp and then
+atomically points CURRENT at it, so readers never see a half-written snapshot.
+Every process memory-maps the same files, so the matrix lives once in the page
+cache however many uvicorn workers are running, and a cold start does not
+touch SQLite.
+
+    python -m app.gallery_store      # (re)build the snapshot from the database
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Iterator, NamedTuple, Optional
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError: # Windows: không có khóa giữa các process, chỉ nên chạy một worker
+    fcntl = None
+
+CURRENT_FILE = "CURRENT"
+LOCK_FILE = ".lock"
+STORAGE_DTYPE = "<f4"
+
+
+class StoredGallery(NamedTuple):
+    stamp: str
+    encodings: np.ndarray # read-only memmap
+    names: np.ndarray
+    user_ids: np.ndarray
+    encoding_ids: np.ndarray
+    max_encoding_id: int
+
+
+class GalleryStore:
+    """Reads and atomically writes gallery snapshots in `directory`."""
+
+    def __init__(self, directory: str, keep: int = 2):
+        self.directory = os.path.abspath(directory)
+        self.keep = max(1, keep)
+        self._thread_lock = threading.Lock()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def current_stamp(self) -> Optional[str]:
+        """Stamp of the active snapshot, None if nothing has been written yet."""
+        try:
+            with open(self._path(CURRENT_FILE), "r", encoding="utf-8") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def read(self, stamp: Optional[str] = None) -> Optional[StoredGallery]:
+        """Opens snapshot `stamp` (default: the active one); None if it is missing or incomplete."""
+        stamp = stamp or self.current_stamp()
+        if stamp is None:
+            return None
+        try:
+            with open(self._path(f"labels-{stamp}.json"), "r", encoding="utf-8") as f:
+                labels = json.load(f)
+            encodings = np.load(self._path(f"encodings-{stamp}.npy"), mmap_mode="r")
+            ids = np.load(self._path(f"ids-{stamp}.npy"))
+        except (FileNotFoundError, ValueError, OSError) as e:
+            print(f"Không đọc được gallery snapshot {stamp}: {e}")
+            return None
+        names = labels.get("names", [])
+        if not (len(names) == encodings.shape[0] == ids.shape[0]):
+            print(f"Gallery snapshot {stamp} không nhất quán, bỏ qua.")
+            return None
+        return StoredGallery(
+            stamp=stamp,
+            encodings=encodings,
+            names=np.array(names, dtype=object),
+            user_ids=np.ascontiguousarray(ids[:, 1]) if ids.size else np.empty((0,), dtype=np.int64),
+            encoding_ids=np.ascontiguousarray(ids[:, 0]) if ids.size else np.empty((0,), dtype=np.int64),
+            max_encoding_id=int(labels.get("max_encoding_id", 0)),
+        )
+
+    def write(self, encodings: np.ndarray, names, user_ids: np.ndarray, encoding_ids: np.ndarray) -> str:
+        """Writes a new snapshot and makes it the active one. Returns its stamp."""
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = f"{time.time_ns():x}-{uuid.uuid4().hex[:8]}"
+        matrix = np.ascontiguousarray(encodings, dtype=STORAGE_DTYPE)
+        ids = np.stack([np.asarray(encoding_ids, dtype=np.int64), np.asarray(user_ids, dtype=np.int64)], axis=1)
+        labels = {
+            "stamp": stamp,
+            "names": [str(name) for name in names],
+            "max_encoding_id": int(ids[:, 0].max()) if ids.size else 0,
+        }
+        self._write_file(f"encodings-{stamp}.npy", lambda f: np.save(f, matrix))
+        self._write_file(f"ids-{stamp}.npy", lambda f: np.save(f, ids))
+        self._write_file(f"labels-{stamp}.json", lambda f: f.write(json.dumps(labels, ensure_ascii=False).encode("utf-8")))
+        self._write_file(CURRENT_FILE, lambda f: f.write(stamp.encode("utf-8")))
+        self._cleanup(stamp)
+        return stamp
+
+    @contextmanager
+    def lock(self) -> Iterator[None]:
+        """Serializes writers across threads and (where fcntl exists) across processes."""
+        os.makedirs(self.directory, exist_ok=True)
+        with self._thread_lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self._path(LOCK_FILE), "a+") as lock_file:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _write_file(self, name: str, write) -> None:
+        # Ghi ra file tạm, fsync rồi đổi tên: file đích hoặc đầy đủ hoặc chưa tồn tại
+        tmp_path = self._path(f".{name}.{uuid.uuid4().hex[:8]}.tmp")
+        with open(tmp_path, "wb") as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._path(name))
+
+    def _cleanup(self, active_stamp: str) -> None:
+        # Giữ `keep` snapshot mới nhất; process nào còn memmap bản cũ vẫn giữ được file đang mở
+        stamps = set()
+        for name in os.listdir(self.directory):
+            if name.startswith("labels-") and name.endswith(".json"):
+                stamps.add(name[len("labels-"):-len(".json")])
+        others = sorted(s for s in stamps if s != active_stamp)
+        stale = others[:max(0, len(others) - (self.keep - 1))]
+        for stamp in stale:
+            for name in (f"labels-{stamp}.json", f"ids-{stamp}.npy", f"encodings-{stamp}.npy"):
+                try:
+                    os.remove(self._path(name))
+                except OSError:
+                    pass
+
+
+def main():
+    import argparse
+
+    from . import config
+    from . import gallery
+    from . import models
+    from .database import SessionLocal, engine
+
+    parser = argparse.ArgumentParser(description="Ghi lại gallery snapshot dùng chung từ database.")
+    parser.add_argument("--dir", default=config.GALLERY_SNAPSHOT_DIR or "gallery_snapshot",
+                        help="Thư mục snapshot (mặc định FACE_GALLERY_SNAPSHOT_DIR).")
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine)
+    cache = gallery.GalleryCache(index_kind="brute", store=GalleryStore(args.dir))
+    with SessionLocal() as db:
+        snapshot = cache.load(db)
+    print(f"Đã ghi gallery snapshot {cache.store_stamp} ({snapshot.size} mã hóa) vào {os.path.abspath(args.dir)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,55 @@
 # app/main.py
 
-from fastapi import FastAPI, File, UploadFile, Depends, HTTPException, Query, Request
+from fastapi import FastAPI, File, UploadFile, Depends, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 import numpy as np
 from typing import List, Tuple, Optional # Đảm bảo Optional được import
 import os
+import asyncio
+import io
+import time
+import zipfile
+from contextlib import asynccontextmanager
 
 # Thêm các import này
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, HTMLResponse 
+from starlette.background import BackgroundTask
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 
 # Đảm bảo các import này đúng với cấu trúc thư mục của bạn
+from . import admission
 from . import crud
 from . import models
 from . import schemas
-from . import face_utils
-from .database import SessionLocal, engine, get_db 
+from . import config
+from . import gallery
+from . import metrics
+from . import recognition
+from . import result_cache
+from . import tracking
+from . import warmup
+from . import workers
+from .database import get_db 
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Tạo bảng/migration trước khi nhận request; nạp model và gallery ở nền (xem app/warmup.py)."""
+    await warmup.prepare_database()
+    warmup_task = asyncio.create_task(warmup.warm_up())
+    try:
+        yield
+    finally:
+        warmup_task.cancel()
+        workers.shutdown(wait=False)
 
-# Tạo các bảng trong database nếu chúng chưa tồn tại
-models.Base.metadata.create_all(bind=engine)
 
 app = FastAPI(
     title="Face Recognition API with Frontend",
     description="API for user registration and face recognition, also serving frontend files.",
-    version="1.0.2" # Cập nhật version
+    version="1.0.2", # Cập nhật version
+    lifespan=lifespan,
 )
 
 # --- Cấu hình đường dẫn đến thư mục gốc của project ---
@@ -47,8 +72,46 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Next-After-Id", "Retry-After"],
 )
 
+
+# --- Đo thời gian request ---
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Đếm request theo route và gửi thời gian từng bước cho trình duyệt qua header Server-Timing."""
+    timings, token = metrics.start_request()
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        metrics.end_request(token)
+    elapsed = time.perf_counter() - start # Với StreamingResponse: thời gian đến khi gửi header
+    route_path = getattr(request.scope.get("route"), "path", "unmatched")
+    metrics.REQUESTS.inc(request.method, route_path, str(response.status_code))
+    metrics.REQUEST_DURATION.observe(elapsed, request.method, route_path)
+    response.headers["Server-Timing"] = metrics.server_timing_header(timings, elapsed)
+    return response
+
+
+@app.exception_handler(admission.Overloaded)
+async def overloaded_handler(request: Request, exc: admission.Overloaded):
+    """Từ chối nhanh khi quá tải, client nên thử lại sau Retry-After giây."""
+    return JSONResponse(status_code=503, content={"detail": str(exc)},
+                        headers={"Retry-After": str(exc.retry_after)})
+
+
+metrics.register_callback("face_gallery_encodings", "Số mã hóa trong gallery cache.", lambda: gallery.gallery_cache.size)
+metrics.register_callback("face_gallery_version", "Phiên bản hiện tại của gallery cache.", lambda: gallery.gallery_cache.version)
+metrics.register_callback("face_result_cache_entries", "Số kết quả trong cache nhận dạng.",
+                          lambda: result_cache.result_cache.stats()["size"])
+metrics.register_callback("face_result_cache_hits_total", "Số lần trả kết quả từ cache (khớp chính xác).",
+                          lambda: result_cache.result_cache.hits, kind="counter")
+metrics.register_callback("face_result_cache_phash_hits_total", "Số lần trả kết quả từ cache (khớp perceptual hash).",
+                          lambda: result_cache.result_cache.phash_hits, kind="counter")
+metrics.register_callback("face_result_cache_misses_total", "Số lần không có kết quả trong cache.",
+                          lambda: result_cache.result_cache.misses, kind="counter")
+
 # --- Mount thư mục tĩnh ---
 # Phục vụ các file CSS từ thư mục "css" ở gốc
 app.mount("/css", StaticFiles(directory=os.path.join(PROJECT_ROOT_PATH, "css")), name="css_files")
@@ -86,8 +149,9 @@ async def serve_recognize_page():
 
 @app.post("/api/users/register_with_multiple_faces/", response_model=schemas.UserResponse, tags=["API - Users"])
 async def api_register_user_with_multiple_faces(
+    request: Request,
     username: str = Query(..., min_length=3, max_length=50, description="Tên người dùng để đăng ký."),
-    image_files: List[UploadFile] = File(..., description=f"Danh sách các file ảnh chứa khuôn mặt (tối đa {models.MAX_ENCODINGS_PER_USER} mã hóa sẽ được lưu)."),
+    image_files: List[UploadFile] = File(..., description=f"Danh sách các file ảnh chứa khuôn mặt (tối đa {models.MAX_ENCODINGS_PER_USER} mã hóa đa dạng nhất sẽ được lưu)."),
     db: Session = Depends(get_db)
 ):
     if not image_files:
@@ -104,27 +168,35 @@ async def api_register_user_with_multiple_faces(
     face_detection_errors = 0
     successful_encodings_from_files = 0
 
+    image_uploads = []
     for image_file in image_files:
         if not image_file.content_type or not image_file.content_type.startswith("image/"):
             print(f"Bỏ qua file không phải ảnh: {image_file.filename}")
             continue
+        image_uploads.append((image_file.filename, await image_file.read()))
 
-        image_bytes = await image_file.read()
+    async def encode_upload(image_bytes: bytes):
         try:
-            image_np = face_utils.load_image_into_numpy_array(image_bytes)
-            if image_np is None:
-                print(f"DEBUG: image_np is None sau khi load từ {image_file.filename}")
-                face_detection_errors += 1
-                continue
+            _, encodings = await recognition.detect_and_encode(image_bytes)
+            return encodings, None
         except ValueError as e:
-            print(f"Lỗi khi đọc ảnh {image_file.filename}: {str(e)}")
+            return [], e
+
+    # Xử lý song song tất cả các ảnh trong worker pool, kết quả giữ đúng thứ tự upload.
+    # Đăng ký được ưu tiên hơn nhận dạng khi phải xếp hàng (xem app/admission.py)
+    results = await admission.run_admitted(request, admission.REGISTER, lambda: asyncio.gather(
+        *(encode_upload(image_bytes) for _, image_bytes in image_uploads)))
+    if results is None:
+        return Response(status_code=admission.CLIENT_CLOSED_REQUEST)
+
+    for (filename, _), (current_image_encodings, load_error) in zip(image_uploads, results):
+        if load_error is not None:
+            print(f"Lỗi khi đọc ảnh {filename}: {str(load_error)}")
             face_detection_errors += 1
             continue
         
-        current_image_encodings = face_utils.get_face_encodings_from_image(image_np)
-        
         if not current_image_encodings:
-            print(f"Không tìm thấy khuôn mặt trong ảnh: {image_file.filename}")
+            print(f"Không tìm thấy khuôn mặt trong ảnh: {filename}")
             face_detection_errors += 1
             continue
         
@@ -132,10 +204,7 @@ async def api_register_user_with_multiple_faces(
         user_encodings_np.append(current_image_encodings[0])
         successful_encodings_from_files += 1
         processed_images_count +=1 # Đếm cả ảnh xử lý thành công encoding
-
-        if len(user_encodings_np) >= models.MAX_ENCODINGS_PER_USER:
-            print(f"Đã đạt giới hạn {models.MAX_ENCODINGS_PER_USER} mã hóa. Dừng xử lý thêm ảnh.")
-            break 
+    # Không dừng ở MAX_ENCODINGS_PER_USER: crud chọn ra các mã hóa đa dạng nhất trong tất cả ứng viên
     
     if not user_encodings_np:
         detail_message = "Không thể trích xuất bất kỳ mã hóa khuôn mặt nào từ các ảnh được cung cấp."
@@ -152,7 +221,7 @@ async def api_register_user_with_multiple_faces(
         # Giả sử frontend có cơ chế kiểm tra user tồn tại hoặc người dùng biết họ đang thêm ảnh.
         print(f"Người dùng '{username}' đã tồn tại. Thử thêm mã hóa mới...")
         try:
-            # user_encodings_np đã được giới hạn bởi MAX_ENCODINGS_PER_USER ở vòng lặp trên
+            # crud chỉ thêm các mã hóa khác xa mã hóa đã có, trong giới hạn MAX_ENCODINGS_PER_USER
             updated_user = crud.add_encodings_to_user(db=db, user_id=db_user.id, encodings_np=user_encodings_np)
             if not updated_user:
                  raise HTTPException(status_code=500, detail="Không thể cập nhật mã hóa cho người dùng hiện tại.")
@@ -171,7 +240,7 @@ async def api_register_user_with_multiple_faces(
         # Tạo user mới
         print(f"Tạo người dùng mới '{username}' với {len(user_encodings_np)} mã hóa.")
         try:
-            # user_encodings_np đã được giới hạn bởi MAX_ENCODINGS_PER_USER
+            # crud chọn tối đa MAX_ENCODINGS_PER_USER mã hóa đa dạng nhất
             created_user = crud.create_user_with_encodings(db=db, name=username, encodings_np=user_encodings_np)
         except ValueError as e: # Lỗi từ crud (ví dụ: tên user đã tồn tại do race condition)
             raise HTTPException(status_code=409 if "đã tồn tại" in str(e).lower() else 400, detail=str(e))
@@ -189,114 +258,290 @@ async def api_register_user_with_multiple_faces(
 
 @app.post("/api/recognize/", response_model=schemas.RecognitionResponse, tags=["API - Recognition"])
 async def api_recognize_faces_in_image(
+    request: Request,
     image_file: UploadFile = File(..., description="Ảnh cần nhận dạng khuôn mặt."),
+    top_k: int = Query(1, ge=1, le=10, description="Số ứng viên (user khác nhau) trả về cho mỗi khuôn mặt."),
+    session_id: Optional[str] = Query(None, max_length=100, description="ID phiên camera; nếu có, các khuôn mặt ổn định giữa các frame không bị encode lại."),
     db: Session = Depends(get_db)
 ):
     if not image_file.content_type or not image_file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="File tải lên không phải là ảnh.")
 
     image_bytes = await image_file.read()
+
+    if session_id:
+        try:
+            response = await admission.run_admitted(request, admission.RECOGNIZE, lambda: recognition.recognize_image_bytes_tracked(
+                image_bytes, tracking.tracker_registry.get(session_id), top_k=top_k, db=db
+            ))
+            return response if response is not None else Response(status_code=admission.CLIENT_CLOSED_REQUEST)
+        except admission.Overloaded:
+            raise
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Không thể đọc hoặc xử lý ảnh: {str(e)}")
+        except Exception as e:
+            print(f"ERROR in tracked recognition (main.py): {type(e).__name__} - {e}")
+            raise HTTPException(status_code=500, detail=f"Server error during face detection: {str(e)}")
+
     try:
-        unknown_image_np = face_utils.load_image_into_numpy_array(image_bytes)
-        if unknown_image_np is None: # Quan trọng
-            print("DEBUG: unknown_image_np is None after load in recognize endpoint!")
-            raise HTTPException(status_code=400, detail="Không thể xử lý ảnh tải lên (ảnh lỗi hoặc không được hỗ trợ).")
+        # Decode + HOG detect + encode chạy trong worker pool để không chặn event loop;
+        # frame lặp lại được trả lời từ cache kết quả
+        response = await admission.run_admitted(
+            request, admission.RECOGNIZE, lambda: recognition.recognize_image_bytes(image_bytes, top_k=top_k, db=db))
+        return response if response is not None else Response(status_code=admission.CLIENT_CLOSED_REQUEST)
+    except admission.Overloaded:
+        raise
     except ValueError as e:
         print(f"ERROR loading image for recognition: {str(e)}")
         raise HTTPException(status_code=400, detail=f"Không thể đọc hoặc xử lý ảnh: {str(e)}")
-    
-    # print(f"DEBUG (recognize): unknown_image_np.shape: {unknown_image_np.shape}, dtype: {unknown_image_np.dtype}")
+    except Exception as e:
+        print(f"ERROR in face_recognition processing (main.py): {type(e).__name__} - {e}")
+        raise HTTPException(status_code=500, detail=f"Server error during face detection: {str(e)}")
 
-    face_locations = []
-    unknown_encodings_np = []
+
+@app.post("/api/detect/", response_model=schemas.DetectionResponse, tags=["API - Recognition"])
+async def api_detect_faces_in_image(
+    request: Request,
+    image_file: UploadFile = File(..., description="Ảnh cần tìm khuôn mặt."),
+    upsample: int = Query(config.DETECTION_UPSAMPLE, ge=0, le=3,
+                          description="Số lần upsample của HOG; 0 nhanh nhất, cao hơn bắt được mặt nhỏ hơn."),
+):
+    """
+    Chỉ trả về box khuôn mặt (không encode, không so khớp gallery), rẻ hơn nhiều so với
+    /api/recognize/: dùng để vẽ khung mỗi frame, còn danh tính được làm mới thưa hơn.
+    """
+    if not image_file.content_type or not image_file.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="File tải lên không phải là ảnh.")
+    image_bytes = await image_file.read()
     try:
-        # Sử dụng model="hog" (mặc định) cho tốc độ, hoặc "cnn" cho độ chính xác cao hơn nhưng chậm hơn
-        face_locations = face_recognition.face_locations(unknown_image_np, model="hog") 
-        if face_locations: # Chỉ lấy encoding nếu có location
-            unknown_encodings_np = face_recognition.face_encodings(unknown_image_np, known_face_locations=face_locations)
+        response = await admission.run_admitted(
+            request, admission.RECOGNIZE, lambda: recognition.detect_boxes(image_bytes, upsample=upsample))
+        return response if response is not None else Response(status_code=admission.CLIENT_CLOSED_REQUEST)
+    except admission.Overloaded:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Không thể đọc hoặc xử lý ảnh: {str(e)}")
     except Exception as e:
-        print(f"ERROR in face_recognition processing (main.py): {type(e).__name__} - {e}")
-        # Cân nhắc việc lưu ảnh lỗi để debug nếu cần
-        # from PIL import Image
-        # import time
-        # try:
-        #     error_img = Image.fromarray(unknown_image_np)
-        #     error_img.save(f"error_image_recognize_{int(time.time())}.jpg")
-        #     print("DEBUG: Saved error image from recognize endpoint.")
-        # except Exception as save_err:
-        #     print(f"DEBUG: Could not save error image: {save_err}")
+        print(f"ERROR in face detection (main.py): {type(e).__name__} - {e}")
         raise HTTPException(status_code=500, detail=f"Server error during face detection: {str(e)}")
 
-    # Trường hợp 1: Không tìm thấy khuôn mặt nào (cả location và encoding đều rỗng)
-    if not face_locations: # Nếu không có face_locations thì cũng không có unknown_encodings_np
-        return schemas.RecognitionResponse(
-            recognized_faces=[],
-            message="Không tìm thấy khuôn mặt nào trong ảnh được cung cấp."
-        )
-    
-    # Trường hợp 2: Có locations nhưng không có encodings (hiếm khi xảy ra với face_recognition, nhưng để an toàn)
-    # Điều này có nghĩa là face_recognition.face_encodings() không trả về gì dù có locations.
-    if face_locations and not unknown_encodings_np:
-        recognized_matches_only_locs: List[schemas.RecognitionMatch] = []
-        for loc in face_locations:
-             recognized_matches_only_locs.append(schemas.RecognitionMatch(name="Unknown (encoding error)", distance=None, box=list(loc)))
-        return schemas.RecognitionResponse(
-            recognized_faces=recognized_matches_only_locs,
-            message=f"Phát hiện {len(face_locations)} vị trí khuôn mặt nhưng không thể tạo mã hóa."
-        )
-
-    # Từ đây, chúng ta chắc chắn có cả face_locations và unknown_encodings_np (cùng số lượng)
-
-    known_encodings_from_db, known_names_from_db = crud.get_all_known_encodings_and_names(db)
-    
-    # Trường hợp 3: Có khuôn mặt trong ảnh gửi lên, nhưng DB không có dữ liệu để so sánh
-    if not known_encodings_from_db:
-        recognized_matches_no_db: List[schemas.RecognitionMatch] = []
-        for i, loc in enumerate(face_locations): # Dùng face_locations đã có
-             # unknown_encoding = unknown_encodings_np[i] # không cần thiết vì không có gì để so sánh
-             recognized_matches_no_db.append(schemas.RecognitionMatch(name="Unknown (no known faces in DB)", distance=None, box=list(loc)))
-        return schemas.RecognitionResponse(
-            recognized_faces=recognized_matches_no_db,
-            message=f"Phát hiện {len(face_locations)} khuôn mặt, nhưng không có dữ liệu khuôn mặt nào trong hệ thống để so sánh."
-        )
-
-    # Trường hợp 4: Xử lý nhận dạng chính
-    recognized_matches: List[schemas.RecognitionMatch] = []
-    for i, unknown_encoding_single in enumerate(unknown_encodings_np): # Đổi tên biến để tránh nhầm lẫn
-        current_location = face_locations[i] # (top, right, bottom, left)
-        name, distance = face_utils.find_best_match(
-            unknown_encoding=unknown_encoding_single,
-            known_encodings=known_encodings_from_db,
-            known_names=known_names_from_db,
-            tolerance=face_utils.RECOGNITION_TOLERANCE
-        )
-        if name and distance is not None: # Tìm thấy match
-            recognized_matches.append(schemas.RecognitionMatch(name=name, distance=distance, box=list(current_location)))
-        else: # Không tìm thấy match (vượt tolerance)
-            recognized_matches.append(schemas.RecognitionMatch(name="Unknown", distance=None, box=list(current_location)))
-            
-    message = f"Đã xử lý {len(unknown_encodings_np)} khuôn mặt được phát hiện."
-    
-    # Kiểm tra xem có match nào không, nếu không thì message có thể cụ thể hơn
-    found_known_face = any(match.name != "Unknown" and match.name != "Unknown (encoding error)" and match.name != "Unknown (no known faces in DB)" for match in recognized_matches)
-    if not found_known_face and recognized_matches: # Có phát hiện nhưng không match ai
-        message += " Không nhận dạng được khuôn mặt nào đã biết."
-    elif not recognized_matches and unknown_encodings_np : # Lỗi logic đâu đó nếu có encoding mà không có match (kể cả Unknown)
-        message = "Lỗi logic: Có mã hóa nhưng không có kết quả nhận dạng."
+
+@app.get("/api/capture-profile/", response_model=schemas.CaptureProfile, tags=["API - Recognition"])
+async def api_capture_profile():
+    """Kích thước, chất lượng JPEG và tốc độ frame mà các trang web nên dùng khi gửi ảnh."""
+    return schemas.CaptureProfile(
+        recognition=schemas.CaptureSettings(
+            max_width=config.CAPTURE_MAX_WIDTH,
+            max_height=config.CAPTURE_MAX_HEIGHT,
+            jpeg_quality=config.CAPTURE_JPEG_QUALITY,
+            target_fps=config.CAPTURE_TARGET_FPS,
+        ),
+        registration=schemas.CaptureSettings(
+            max_width=config.CAPTURE_REGISTER_MAX_WIDTH,
+            max_height=config.CAPTURE_REGISTER_MAX_HEIGHT,
+            jpeg_quality=config.CAPTURE_REGISTER_JPEG_QUALITY,
+        ),
+        full_recognition_interval_ms=config.CAPTURE_FULL_RECOGNITION_INTERVAL_MS,
+    )
 
 
-    return schemas.RecognitionResponse(
-        recognized_faces=recognized_matches,
-        message=message
+@app.get("/health/live", response_model=schemas.HealthStatus, tags=["Monitoring"])
+async def health_live():
+    """Liveness: process còn chạy và event loop còn phản hồi (không kiểm tra model hay DB)."""
+    return schemas.HealthStatus(status="alive", checks=dict(warmup.readiness.checks))
+
+
+@app.get("/health/ready", response_model=schemas.HealthStatus, tags=["Monitoring"],
+         responses={503: {"model": schemas.HealthStatus, "description": "Worker chưa warm-up xong"}})
+async def health_ready():
+    """Readiness: 200 khi database, model dlib và gallery đã sẵn sàng, 503 trong lúc warm-up hoặc khi warm-up lỗi."""
+    readiness = warmup.readiness
+    status = schemas.HealthStatus(
+        status="ready" if readiness.ready else ("failed" if readiness.error else "starting"),
+        checks=dict(readiness.checks),
+        error=readiness.error,
     )
+    if not readiness.ready:
+        return JSONResponse(status_code=503, content=status.model_dump())
+    return status
+
+
+@app.get("/metrics", response_class=PlainTextResponse, tags=["Monitoring"])
+async def prometheus_metrics():
+    """Số liệu dạng text Prometheus: thời gian từng bước, request, khuôn mặt, gallery, cache."""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/api/recognize/cache/", tags=["API - Recognition"])
+async def api_recognition_cache_stats():
+    """Số lần hit/miss của cache kết quả nhận dạng."""
+    return result_cache.result_cache.stats()
+
+
+@app.post("/api/recognize/batch/", tags=["API - Recognition"],
+          response_class=StreamingResponse,
+          responses={200: {"content": {"application/x-ndjson": {}}, "description": "Mỗi dòng là một BatchRecognitionItem (JSON)."}})
+async def api_recognize_batch(
+    image_files: Optional[List[UploadFile]] = File(None, description="Các ảnh cần nhận dạng."),
+    archive: Optional[UploadFile] = File(None, description="Hoặc một file zip/tar chứa các ảnh."),
+    top_k: int = Query(1, ge=1, le=10, description="Số ứng viên (user khác nhau) trả về cho mỗi khuôn mặt."),
+    db: Session = Depends(get_db)
+):
+    """
+    Nhận dạng nhiều ảnh trong một request. Kết quả được stream dạng NDJSON, mỗi dòng
+    một ảnh, theo thứ tự xử lý xong (dùng trường `index` để ghép lại với ảnh gốc).
+    Khi đã có FACE_ADMISSION_MAX_BATCHES lô đang chạy, request bị từ chối ngay (503 + Retry-After).
+    """
+    # Nhận lô trước khi đọc ảnh vào bộ nhớ; Overloaded -> 503 qua overloaded_handler
+    ticket = admission.controller.admit_batch()
+    try:
+        images = await read_batch_images(image_files, archive)
+        # Nạp gallery trước khi stream, vì DB session đóng khi endpoint trả về
+        gallery.gallery_cache.get_snapshot(db)
+    except BaseException:
+        ticket.release()
+        raise
+    ticket.add_images(len(images))
+
+    async def ndjson_lines():
+        try:
+            async for item in recognition.recognize_batch(images, top_k=top_k, ticket=ticket):
+                yield item.model_dump_json() + "\n"
+        finally:
+            ticket.release()
+
+    # background: trả chỗ của lô cả khi client ngắt kết nối trước khi stream bắt đầu
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson", background=BackgroundTask(ticket.release))
+
+
+async def read_batch_images(image_files: Optional[List[UploadFile]], archive: Optional[UploadFile]) -> List[Tuple[str, bytes]]:
+    """Đọc ảnh upload và ảnh trong file nén của một request theo lô; HTTPException 400 nếu không hợp lệ."""
+    images: List[Tuple[str, bytes]] = []
+    for image_file in image_files or []:
+        if not image_file.content_type or not image_file.content_type.startswith("image/"):
+            raise HTTPException(status_code=400, detail=f"File '{image_file.filename}' không phải là ảnh.")
+        images.append((image_file.filename, await image_file.read()))
+    if archive is not None:
+        if not archive.content_type or archive.content_type not in recognition.ARCHIVE_CONTENT_TYPES:
+            raise HTTPException(status_code=400, detail="File nén phải là zip hoặc tar.")
+        try:
+            # Giải nén trong thread riêng (file tạm của upload không pickle được sang process pool)
+            images.extend(await asyncio.to_thread(
+                recognition.read_archive_images, archive.file, archive.filename,
+                config.BATCH_MAX_IMAGES - len(images)
+            ))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if not images:
+        raise HTTPException(status_code=400, detail="Cần ít nhất một ảnh (image_files hoặc archive).")
+    if len(images) > config.BATCH_MAX_IMAGES:
+        raise HTTPException(status_code=400, detail=f"Chỉ cho phép tối đa {config.BATCH_MAX_IMAGES} ảnh mỗi lô.")
+    return images
+
+
+@app.websocket("/ws/recognize")
+async def ws_recognize_stream(websocket: WebSocket, top_k: int = Query(1, ge=1, le=10), track: bool = Query(True)):
+    """
+    Nhận dạng liên tục qua WebSocket: client gửi từng frame (JPEG/PNG) dưới dạng binary message,
+    server trả về StreamRecognitionResponse (JSON) trên cùng socket.
+
+    Chỉ frame mới nhất đang chờ được xử lý; các frame đến trong lúc server bận sẽ bị thay thế
+    (đếm trong dropped_frames), nên độ trễ luôn ổn định thay vì tồn đọng không giới hạn.
+    Với track=true (mặc định), mỗi kết nối có một tracker riêng để không encode lại khuôn mặt đứng yên.
+    Khi server quá tải, frame không được xử lý và server trả busy=true kèm retry_after (giây).
+    """
+    await websocket.accept()
+    tracker = tracking.FaceTracker() if track else None
+    latest_frame: Optional[bytes] = None
+    dropped_frames = 0
+    frame_ready = asyncio.Event()
+
+    async def receive_frames():
+        nonlocal latest_frame, dropped_frames
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            frame = message.get("bytes")
+            if not frame:
+                continue # Bỏ qua text message
+            if latest_frame is not None:
+                dropped_frames += 1
+            latest_frame = frame
+            frame_ready.set()
+
+    receiver = asyncio.create_task(receive_frames())
+    try:
+        while True:
+            waiter = asyncio.create_task(frame_ready.wait())
+            await asyncio.wait({waiter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if not waiter.done(): # Client đã ngắt kết nối
+                waiter.cancel()
+                break
+            frame_ready.clear()
+            frame, latest_frame = latest_frame, None
+            dropped, dropped_frames = dropped_frames, 0
+
+            try:
+                # Mỗi frame lấy một slot như /api/recognize/; khi quá tải, frame bị bỏ và client được báo "busy"
+                async with admission.controller.slot(admission.RECOGNIZE):
+                    if tracker is not None:
+                        result = await recognition.recognize_image_bytes_tracked(frame, tracker, top_k=top_k)
+                    else:
+                        result = await recognition.recognize_image_bytes(frame, top_k=top_k)
+                response = schemas.StreamRecognitionResponse(**result.model_dump(), dropped_frames=dropped)
+            except admission.Overloaded as e:
+                response = schemas.StreamRecognitionResponse(recognized_faces=[], dropped_frames=dropped, busy=True,
+                                                             error=str(e), retry_after=e.retry_after)
+            except ValueError as e:
+                response = schemas.StreamRecognitionResponse(recognized_faces=[], dropped_frames=dropped, error=f"Không thể đọc hoặc xử lý ảnh: {str(e)}")
+            except Exception as e:
+                print(f"ERROR in websocket recognition: {type(e).__name__} - {e}")
+                response = schemas.StreamRecognitionResponse(recognized_faces=[], dropped_frames=dropped, error=f"Server error during face detection: {str(e)}")
+
+            if receiver.done():
+                break
+            try:
+                await websocket.send_json(response.model_dump())
+            except (WebSocketDisconnect, RuntimeError):
+                break
+    finally:
+        receiver.cancel()
+        try:
+            await receiver
+        except (asyncio.CancelledError, Exception):
+            pass # WebSocketDisconnect/RuntimeError khi client đóng kết nối giữa chừng
 
 
 # --- Các Endpoints CRUD cơ bản cho Users ---
+# Phân trang keyset: header X-Next-After-Id chứa giá trị after_id cho trang tiếp theo (không có nếu đã hết)
+NEXT_CURSOR_HEADER = "X-Next-After-Id"
+
 @app.get("/api/users/", response_model=List[schemas.UserResponse], tags=["API - Users Management"])
-def api_read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    users = crud.get_users(db, skip=skip, limit=limit)
+def api_read_users(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    after_id: Optional[int] = Query(None, description="Chỉ lấy người dùng có ID lớn hơn giá trị này (cursor); khi có thì bỏ qua skip."),
+    db: Session = Depends(get_db)
+):
+    users = crud.get_users(db, skip=skip, limit=limit, after_id=after_id)
+    if users and len(users) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = str(users[-1].id)
     return users
 
+@app.get("/api/users/summary/", response_model=List[schemas.UserSummary], tags=["API - Users Management"])
+def api_read_user_summaries(
+    response: Response,
+    limit: int = Query(1000, ge=1, le=10000),
+    after_id: Optional[int] = Query(None, description="Chỉ lấy người dùng có ID lớn hơn giá trị này (cursor)."),
+    db: Session = Depends(get_db)
+):
+    rows = crud.get_user_summaries(db, limit=limit, after_id=after_id)
+    if rows and len(rows) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = str(rows[-1][0])
+    return [schemas.UserSummary(id=user_id, name=name, encoding_count=count) for user_id, name, count in rows]
+
 @app.get("/api/users/{user_id}", response_model=schemas.UserResponse, tags=["API - Users Management"])
 def api_read_user(user_id: int, db: Session = Depends(get_db)):
     db_user = crud.get_user(db, user_id=user_id)
@@ -311,5 +556,47 @@ def api_delete_user_endpoint(user_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="User not found or could not be deleted")
     return schemas.MessageResponse(message=f"User with ID {user_id} and their encodings successfully deleted.")
 
-# Import face_recognition ở đầu file nếu chưa có
-import face_recognition 
\ No newline at end of file
+# --- Xuất / nhập toàn bộ gallery (file .npz, xem crud.export_gallery) ---
+@app.get("/api/gallery/export", tags=["API - Users Management"],
+         response_class=Response, responses={200: {"content": {"application/octet-stream": {}}}})
+def api_export_gallery(db: Session = Depends(get_db)):
+    archive = crud.export_gallery(db)
+    buffer = io.BytesIO()
+    np.savez(buffer, **archive)
+    filename = f"gallery-{time.strftime('%Y%m%d-%H%M%S')}.npz"
+    return Response(
+        content=buffer.getvalue(),
+        media_type="application/octet-stream",
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "X-Gallery-Users": str(len(archive["names"])),
+            "X-Gallery-Encodings": str(len(archive["encodings"])),
+        },
+    )
+
+@app.post("/api/gallery/import", response_model=schemas.GalleryImportResponse, tags=["API - Users Management"])
+def api_import_gallery(
+    file: UploadFile = File(..., description="File .npz đã xuất từ /api/gallery/export."),
+    mode: str = Query("merge", pattern="^(skip|merge|replace)$",
+                      description="Tên đã tồn tại: skip (bỏ qua), merge (thêm đến giới hạn) hoặc replace (thay toàn bộ mã hóa)."),
+    db: Session = Depends(get_db)
+):
+    try:
+        with np.load(file.file, allow_pickle=False) as npz:
+            archive = {key: npz[key] for key in npz.files}
+    except (ValueError, OSError, zipfile.BadZipFile) as e:
+        # Không trả nguyên thông báo lỗi của numpy cho client
+        print(f"Không đọc được file gallery '{file.filename}': {type(e).__name__} - {e}")
+        raise HTTPException(status_code=400, detail="File gallery không hợp lệ (cần file .npz từ /api/gallery/export).")
+    try:
+        users_created, users_updated, encodings_added = crud.import_gallery(db, archive, mode=mode)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return schemas.GalleryImportResponse(
+        users_created=users_created,
+        users_updated=users_updated,
+        encodings_added=encodings_added,
+        mode=mode,
+    )
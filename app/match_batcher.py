@@ -0,0 +1,114 @@
+# app/match_batcher.py
+"""
+Gộp các lần so khớp gallery của nhiều request đồng thời thành một phép nhân ma trận.
+
+Khi nhiều camera gửi frame cùng lúc, mỗi request sau khi encode xong sẽ chờ tối đa
+`window_ms` mili giây (hoặc tới khi đủ `max_batch` khuôn mặt) để các request khác
+góp mã hóa của chúng; sau đó một lần `gallery_cache.match` chạy cho cả lô, kết quả
+được chia lại cho từng request. Gallery chỉ được đọc qua bộ nhớ cache CPU một lần
+cho cả lô thay vì một lần cho mỗi request.
+
+Chỉ phần so khớp được gộp: face_recognition encode từng ảnh một (dlib nhận một ảnh
+mỗi lần gọi), nên decode/detect/encode vẫn chạy song song trong worker pool như cũ.
+
+`window_ms` là độ trễ thêm tối đa mà một request phải chịu; 0 = tắt (so khớp ngay).
+"""
+import asyncio
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from . import config
+from . import gallery
+from . import matching
+from . import metrics
+
+Candidates = List[Tuple[str, float]]
+
+BATCH_SIZE = metrics.registry.register(metrics.Histogram(
+    "face_match_batch_faces", "Số khuôn mặt trong mỗi lần so khớp gộp.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)))
+BATCH_REQUESTS = metrics.registry.register(metrics.Histogram(
+    "face_match_batch_requests", "Số request được gộp trong mỗi lần so khớp.",
+    buckets=(1, 2, 4, 8, 16, 32, 64)))
+
+
+class MatchBatcher:
+    """
+    Hàng đợi so khớp dùng chung trong một event loop.
+
+    Lô được so khớp khi (a) request đầu tiên của lô đã chờ `window_ms`, hoặc
+    (b) tổng số khuôn mặt đang chờ đạt `max_batch`. Mọi request trong lô dùng cùng
+    một snapshot gallery và top_k lớn nhất của lô (kết quả được cắt lại theo top_k
+    của từng request, với gộp "min" theo user thì cho cùng kết quả).
+    """
+
+    def __init__(self, window_ms: float = config.MATCH_BATCH_WINDOW_MS,
+                 max_batch: int = config.MATCH_BATCH_MAX_FACES):
+        self.window_ms = window_ms
+        self.max_batch = max(1, max_batch)
+        self._pending: List[Tuple[List[np.ndarray], int, asyncio.Future]] = []
+        self._pending_faces = 0
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self.batches = 0
+        self.requests = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window_ms > 0
+
+    async def match(self, encodings: List[np.ndarray], top_k: int = 1) -> List[Candidates]:
+        """Ứng viên (tên, khoảng cách) cho từng mã hóa, như `gallery_cache.match(..., aggregate="min")`."""
+        if not encodings:
+            return []
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        start = time.perf_counter()
+        self._pending.append((list(encodings), top_k, future))
+        self._pending_faces += len(encodings)
+        if self._pending_faces >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window_ms / 1000.0, self._flush)
+        try:
+            return await future
+        finally:
+            # Thời gian chờ lô + so khớp, tính cho request này
+            metrics.record_stage("match", time.perf_counter() - start)
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending, self._pending_faces = self._pending, [], 0
+        batch = [item for item in batch if not item[2].done()] # Bỏ request đã bị huỷ
+        if not batch:
+            return
+        all_encodings = [enc for encodings, _, _ in batch for enc in encodings]
+        try:
+            results = gallery.gallery_cache.match(
+                all_encodings,
+                tolerance=matching.RECOGNITION_TOLERANCE,
+                top_k=max(top_k for _, top_k, _ in batch),
+                aggregate="min",
+                snapshot=gallery.gallery_cache.get_snapshot()
+            )
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.batches += 1
+        self.requests += len(batch)
+        BATCH_SIZE.observe(len(all_encodings))
+        BATCH_REQUESTS.observe(len(batch))
+        offset = 0
+        for encodings, top_k, future in batch:
+            if not future.done():
+                future.set_result([candidates[:top_k] for candidates in results[offset:offset + len(encodings)]])
+            offset += len(encodings)
+
+
+# Một instance dùng chung cho cả process (các request của cùng worker uvicorn)
+match_batcher = MatchBatcher()
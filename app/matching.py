@@ -0,0 +1,237 @@
+# app/matching.py
+"""
+Pure-NumPy matching of face encodings against the gallery.
+Kept free of face_recognition/dlib imports so the CRUD layer and scripts can use it.
+"""
+import numpy as np
+from typing import List, Tuple, Optional, Union
+
+# Default tolerance, can be adjusted
+RECOGNITION_TOLERANCE = 0.5 # CLI uses 0.6, 0.5 is a bit stricter
+
+
+def face_distance_matrix(
+    unknown_encodings: Union[List[np.ndarray], np.ndarray],
+    known_encodings: np.ndarray,
+    known_sq_norms: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Euclidean distances between every unknown and every known encoding, as a
+    (faces, gallery) matrix computed with a single matrix multiply:
+    |u - k|^2 = |u|^2 + |k|^2 - 2 u.k
+    """
+    unknown = np.asarray(unknown_encodings, dtype=known_encodings.dtype)
+    if unknown.ndim == 1:
+        unknown = unknown[np.newaxis, :]
+    if known_sq_norms is None:
+        known_sq_norms = np.einsum("ij,ij->i", known_encodings, known_encodings)
+    unknown_sq_norms = np.einsum("ij,ij->i", unknown, unknown)
+    sq_distances = unknown_sq_norms[:, np.newaxis] + known_sq_norms[np.newaxis, :] - 2.0 * (unknown @ known_encodings.T)
+    np.maximum(sq_distances, 0.0, out=sq_distances) # Loại bỏ giá trị âm nhỏ do sai số làm tròn
+    return np.sqrt(sq_distances, out=sq_distances)
+
+
+def group_labels(known_names: Union[List[str], np.ndarray]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Groups gallery columns by label for per-user aggregation.
+
+    Returns:
+        (unique_labels, order, starts): `order` sorts the columns so that each
+        label is contiguous, and `starts` marks where each label's run begins
+        (suitable for np.ufunc.reduceat).
+    """
+    names = np.asarray(known_names, dtype=object)
+    unique_labels, inverse = np.unique(names.astype(str), return_inverse=True)
+    order = np.argsort(inverse, kind="stable")
+    starts = np.searchsorted(inverse[order], np.arange(len(unique_labels)))
+    return unique_labels.astype(object), order, starts
+
+
+def match_faces_batch(
+    unknown_encodings: Union[List[np.ndarray], np.ndarray],
+    known_encodings: np.ndarray,
+    known_names: Union[List[str], np.ndarray],
+    tolerance: float = RECOGNITION_TOLERANCE,
+    top_k: int = 1,
+    aggregate: Optional[str] = None,
+    groups: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None,
+    known_sq_norms: Optional[np.ndarray] = None
+) -> List[List[Tuple[str, float]]]:
+    """
+    Matches all faces of one image against the gallery in one vectorized pass.
+
+    Args:
+        aggregate: None to rank individual encodings, or "min"/"mean" to first
+            reduce each user's encodings to one distance (so the top-k are distinct users).
+        groups: Precomputed `group_labels(known_names)`, reused across calls when the gallery is unchanged.
+
+    Returns:
+        For each unknown face, up to `top_k` (name, distance) candidates within
+        tolerance, closest first. An empty list means no match.
+    """
+    num_faces = len(unknown_encodings)
+    if num_faces == 0:
+        return []
+    if len(known_encodings) == 0:
+        return [[] for _ in range(num_faces)]
+    if aggregate not in (None, "min", "mean"):
+        raise ValueError(f"Unsupported aggregate: {aggregate}")
+
+    known_encodings = np.asarray(known_encodings)
+    distances = face_distance_matrix(unknown_encodings, known_encodings, known_sq_norms)
+
+    if aggregate is None:
+        labels = np.asarray(known_names, dtype=object)
+    else:
+        labels, order, starts = groups if groups is not None else group_labels(known_names)
+        sorted_distances = distances[:, order]
+        if aggregate == "min":
+            distances = np.minimum.reduceat(sorted_distances, starts, axis=1)
+        else:
+            counts = np.diff(np.append(starts, sorted_distances.shape[1]))
+            distances = np.add.reduceat(sorted_distances, starts, axis=1) / counts
+
+    k = min(max(top_k, 1), distances.shape[1])
+    if k < distances.shape[1]:
+        candidate_idx = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    else:
+        candidate_idx = np.broadcast_to(np.arange(k), (num_faces, k))
+    candidate_dist = np.take_along_axis(distances, candidate_idx, axis=1)
+    ranking = np.argsort(candidate_dist, axis=1, kind="stable")
+    candidate_idx = np.take_along_axis(candidate_idx, ranking, axis=1)
+    candidate_dist = np.take_along_axis(candidate_dist, ranking, axis=1)
+
+    results: List[List[Tuple[str, float]]] = []
+    for face_idx in range(num_faces):
+        within = candidate_dist[face_idx] <= tolerance
+        results.append([
+            (labels[j], float(d))
+            for j, d in zip(candidate_idx[face_idx][within], candidate_dist[face_idx][within])
+        ])
+    return results
+
+
+def exact_distances(
+    unknown_encodings: Union[List[np.ndarray], np.ndarray],
+    known_encodings: np.ndarray,
+    rows: np.ndarray
+) -> np.ndarray:
+    """
+    Float64 distances from each unknown encoding to its own candidate rows of
+    `known_encodings` (`rows` is (faces, n)); only those rows are read, so a
+    memory-mapped gallery is touched at a few pages only.
+    """
+    unknown = np.asarray(unknown_encodings, dtype=np.float64).reshape(rows.shape[0], -1)
+    candidates = np.asarray(known_encodings[rows.ravel()], dtype=np.float64).reshape(rows.shape + (-1,))
+    return np.linalg.norm(candidates - unknown[:, np.newaxis, :], axis=2)
+
+
+def match_faces_with_index(
+    unknown_encodings: Union[List[np.ndarray], np.ndarray],
+    index,
+    known_ids: np.ndarray,
+    known_names: np.ndarray,
+    tolerance: float = RECOGNITION_TOLERANCE,
+    top_k: int = 1,
+    aggregate: Optional[str] = None,
+    candidates_per_user: int = 1,
+    known_encodings: Optional[np.ndarray] = None,
+    rerank: int = 0
+) -> List[List[Tuple[str, float]]]:
+    """
+    Same contract as `match_faces_batch`, but candidates come from a nearest-neighbour
+    index (see app/ann_index.py) instead of a full scan.
+
+    `known_ids` must be sorted ascending and aligned with `known_names`; the index
+    returns encoding ids which are mapped back to names with a binary search.
+    With an aggregate, `top_k * candidates_per_user` neighbours are fetched and
+    reduced per user, so "mean" is computed over the neighbours that were returned.
+
+    With `rerank` > 0 and `known_encodings` (rows aligned with `known_ids`), `rerank`
+    times more neighbours are fetched and their exact distances recomputed from
+    `known_encodings` before ranking and the tolerance check; used for indexes
+    with approximate distances (QuantizedIndex).
+    """
+    num_faces = len(unknown_encodings)
+    if num_faces == 0:
+        return []
+    if len(known_ids) == 0:
+        return [[] for _ in range(num_faces)]
+    if aggregate not in (None, "min", "mean"):
+        raise ValueError(f"Unsupported aggregate: {aggregate}")
+
+    fetch = top_k * max(candidates_per_user, 1) if aggregate else top_k
+    rerank = rerank if known_encodings is not None else 0
+    queries = np.asarray(unknown_encodings, dtype=np.float64)
+    distances, ids = index.search(queries, fetch * max(rerank, 1))
+    positions = np.clip(np.searchsorted(known_ids, ids), 0, len(known_ids) - 1)
+    # Bỏ các id đã bị xóa khỏi gallery nhưng index chưa kịp cập nhật (và phần padding -1)
+    valid = (ids >= 0) & (known_ids[positions] == ids)
+    if rerank:
+        # Khoảng cách của index chỉ dùng để chọn ứng viên: tính lại chính xác rồi xếp hạng lại
+        distances = np.where(valid, exact_distances(queries, known_encodings, positions), np.inf)
+        order = np.argsort(distances, axis=1, kind="stable")[:, :fetch]
+        distances, positions, valid = (np.take_along_axis(a, order, axis=1) for a in (distances, positions, valid))
+    valid &= distances <= tolerance
+
+    results: List[List[Tuple[str, float]]] = []
+    for face_idx in range(num_faces):
+        face_names = known_names[positions[face_idx][valid[face_idx]]]
+        face_distances = distances[face_idx][valid[face_idx]]
+        if aggregate is None:
+            results.append([(name, float(d)) for name, d in zip(face_names[:top_k], face_distances[:top_k])])
+            continue
+        per_user = {}
+        for name, d in zip(face_names, face_distances):
+            per_user.setdefault(name, []).append(float(d))
+        reduce = min if aggregate == "min" else (lambda values: sum(values) / len(values))
+        ranked = sorted(((name, reduce(values)) for name, values in per_user.items()), key=lambda item: item[1])
+        results.append(ranked[:top_k])
+    return results
+
+
+def select_diverse_encodings(
+    candidates: Union[List[np.ndarray], np.ndarray],
+    existing: Optional[Union[List[np.ndarray], np.ndarray]] = None,
+    max_total: int = 10,
+    min_distance: float = 0.0
+) -> List[int]:
+    """
+    Picks which candidate encodings to store for one user (greedy farthest-point
+    / k-center selection).
+
+    `existing` encodings are always kept. Candidates are then added one at a time,
+    each time taking the one farthest from everything kept so far, until
+    `max_total` encodings are kept or the farthest remaining candidate is closer
+    than `min_distance` to a kept one (a near-duplicate frame). Without existing
+    encodings the first pick is the candidate closest to the candidates' mean.
+
+    Returns:
+        Indices into `candidates` of the encodings to add, in ascending order.
+    """
+    candidates = np.asarray(candidates, dtype=np.float64).reshape(-1, 128) if len(candidates) else np.empty((0, 128))
+    existing = np.asarray(existing, dtype=np.float64).reshape(-1, 128) if existing is not None and len(existing) else np.empty((0, 128))
+    allowed = max_total - existing.shape[0]
+    if allowed <= 0 or candidates.shape[0] == 0:
+        return []
+
+    # Khoảng cách giữa mọi cặp ứng viên, tính một lần (số ứng viên mỗi user nhỏ)
+    pairwise = face_distance_matrix(candidates, candidates)
+    picked: List[int] = []
+    if existing.shape[0]:
+        # Khoảng cách từ mỗi ứng viên tới mã hóa đã lưu gần nhất
+        nearest = face_distance_matrix(candidates, existing).min(axis=1)
+    else:
+        first = int(np.argmin(face_distance_matrix(candidates.mean(axis=0), candidates)[0]))
+        picked.append(first)
+        nearest = pairwise[first].copy()
+    nearest[picked] = -np.inf
+
+    while len(picked) < allowed:
+        best = int(np.argmax(nearest))
+        if not np.isfinite(nearest[best]) or nearest[best] < min_distance:
+            break # Các ứng viên còn lại đều gần như trùng với mã hóa đã giữ
+        picked.append(best)
+        np.minimum(nearest, pairwise[best], out=nearest)
+        nearest[picked] = -np.inf
+    return sorted(picked)
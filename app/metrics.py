@@ -0,0 +1,191 @@
+# app/metrics.py
+"""
+Đo thời gian từng bước của pipeline và xuất số liệu dạng text Prometheus (/metrics).
+
+Các bước (stage): decode, detect, encode, gallery_fetch, match, db_commit.
+Mỗi lần đo được ghi vào histogram `face_stage_duration_seconds{stage=...}` và, nếu
+đang trong một request HTTP, cộng dồn vào thời gian của request đó để middleware
+trả về header `Server-Timing`.
+
+Tự cài đặt (không dùng prometheus_client) vì chỉ cần vài counter/histogram trong
+một process; với nhiều worker uvicorn, mỗi worker có số liệu riêng.
+"""
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+STAGES = ("decode", "detect", "encode", "gallery_fetch", "match", "db_commit")
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Giá trị chỉ tăng, theo từng bộ nhãn."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}" for labels, value in items]
+
+
+class CallbackMetric:
+    """Giá trị đọc tại thời điểm xuất số liệu qua một hàm callback (gauge, hoặc counter do module khác đếm)."""
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], float], kind: str = "gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.kind = kind
+
+    def samples(self) -> List[str]:
+        return [f"{self.name} {_format_value(self.callback())}"]
+
+
+class Histogram:
+    """Phân phối giá trị (thường là thời gian, tính bằng giây) theo bucket cố định."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelValues, Tuple[List[int], List[float]]] = {} # labels -> (bucket counts, [sum])
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        with self._lock:
+            counts, total = self._series.setdefault(labelvalues, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            total[0] += value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            series = [(labels, list(counts), total[0]) for labels, (counts, total) in self._series.items()]
+        lines = []
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Toàn bộ số liệu theo định dạng text exposition 0.0.4 của Prometheus."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_DURATION = registry.register(Histogram(
+    "face_stage_duration_seconds", "Thời gian từng bước của pipeline nhận dạng.", ("stage",)))
+REQUESTS = registry.register(Counter(
+    "face_http_requests_total", "Số request HTTP theo route và mã trạng thái.", ("method", "route", "status")))
+REQUEST_DURATION = registry.register(Histogram(
+    "face_http_request_duration_seconds", "Thời gian xử lý request HTTP theo route.", ("method", "route")))
+FACES_DETECTED = registry.register(Counter(
+    "face_faces_detected_total", "Tổng số khuôn mặt được phát hiện trong các ảnh đã xử lý."))
+IMAGES_PROCESSED = registry.register(Counter(
+    "face_images_processed_total", "Tổng số ảnh đã chạy qua decode/detect."))
+
+# Thời gian các bước của request hiện tại (None ngoài request HTTP)
+_request_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "face_request_timings", default=None)
+
+
+def register_callback(name: str, documentation: str, callback: Callable[[], float], kind: str = "gauge") -> None:
+    """Số liệu có giá trị lấy từ module khác (kích thước gallery, cache, ...) lúc xuất số liệu."""
+    registry.register(CallbackMetric(name, documentation, callback, kind=kind))
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    STAGE_DURATION.observe(seconds, stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+def record_stages(timings: Dict[str, float]) -> None:
+    """Ghi các thời gian do worker pool trả về (xem face_utils, tham số `timings`)."""
+    for stage, seconds in timings.items():
+        record_stage(stage, seconds)
+
+
+@contextmanager
+def timer(stage: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def start_request() -> Tuple[Dict[str, float], contextvars.Token]:
+    timings: Dict[str, float] = {}
+    return timings, _request_timings.set(timings)
+
+
+def end_request(token: contextvars.Token) -> None:
+    _request_timings.reset(token)
+
+
+def server_timing_header(timings: Dict[str, float], total_seconds: Optional[float] = None) -> str:
+    """Giá trị header Server-Timing, ví dụ `decode;dur=12.1, detect;dur=40.3, total;dur=58.0` (ms)."""
+    parts = [f"{stage};dur={seconds * 1000.0:.1f}" for stage, seconds in timings.items()]
+    if total_seconds is not None:
+        parts.append(f"total;dur={total_seconds * 1000.0:.1f}")
+    return ", ".join(parts)
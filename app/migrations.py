@@ -0,0 +1,130 @@
+# app/migrations.py
+"""
+Chuyển bảng face_encodings từ định dạng JSON text sang float32 nhị phân.
+
+Chạy tự động khi khởi động app (idempotent), hoặc thủ công:
+
+    python -m app.migrations [--keep-json] [--vacuum]
+"""
+import argparse
+import json
+
+import numpy as np
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from . import models
+
+FACE_ENCODINGS_TABLE = models.FaceEncoding.__tablename__
+LEGACY_TABLE = f"{FACE_ENCODINGS_TABLE}_legacy"
+
+
+def _face_encoding_columns(engine: Engine) -> dict:
+    inspector = inspect(engine)
+    if not inspector.has_table(FACE_ENCODINGS_TABLE):
+        return {}
+    return {col["name"]: col for col in inspector.get_columns(FACE_ENCODINGS_TABLE)}
+
+
+def upgrade_face_encodings_schema(engine: Engine) -> bool:
+    """
+    Thêm các cột encoding_blob/encoding_dtype và bỏ ràng buộc NOT NULL của encoding_data.
+    SQLite không hỗ trợ ALTER COLUMN nên bảng được tạo lại và copy dữ liệu sang.
+    Trả về True nếu schema đã được thay đổi.
+    """
+    columns = _face_encoding_columns(engine)
+    if not columns:
+        return False # Bảng chưa tồn tại, create_all sẽ tạo đúng schema mới
+    if "encoding_blob" in columns and columns["encoding_data"]["nullable"]:
+        return False
+
+    with engine.begin() as conn:
+        if engine.dialect.name == "sqlite":
+            for index in inspect(conn).get_indexes(FACE_ENCODINGS_TABLE):
+                conn.execute(text(f'DROP INDEX IF EXISTS "{index["name"]}"'))
+            conn.execute(text(f"ALTER TABLE {FACE_ENCODINGS_TABLE} RENAME TO {LEGACY_TABLE}"))
+            models.FaceEncoding.__table__.create(conn)
+            conn.execute(text(
+                f"INSERT INTO {FACE_ENCODINGS_TABLE} (id, encoding_data, user_id) "
+                f"SELECT id, encoding_data, user_id FROM {LEGACY_TABLE}"
+            ))
+            conn.execute(text(f"DROP TABLE {LEGACY_TABLE}"))
+        else:
+            if "encoding_blob" not in columns:
+                conn.execute(text(f"ALTER TABLE {FACE_ENCODINGS_TABLE} ADD COLUMN encoding_blob BYTEA"))
+                conn.execute(text(f"ALTER TABLE {FACE_ENCODINGS_TABLE} ADD COLUMN encoding_dtype VARCHAR(8)"))
+            conn.execute(text(f"ALTER TABLE {FACE_ENCODINGS_TABLE} ALTER COLUMN encoding_data DROP NOT NULL"))
+    print(f"Đã nâng cấp schema bảng {FACE_ENCODINGS_TABLE} để lưu mã hóa dạng nhị phân.")
+    return True
+
+
+def migrate_encodings_to_binary(engine: Engine, batch_size: int = 1000, keep_json: bool = False) -> int:
+    """
+    Chuyển các dòng còn lưu JSON sang encoding_blob (float32).
+    Nếu keep_json=True thì giữ lại cột JSON để phiên bản cũ của app vẫn đọc được.
+    Trả về số dòng đã chuyển đổi.
+    """
+    upgrade_face_encodings_schema(engine)
+    storage_dtype = np.dtype(models.ENCODING_STORAGE_DTYPE)
+    converted = 0
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(text(
+                f"SELECT id, encoding_data FROM {FACE_ENCODINGS_TABLE} "
+                "WHERE encoding_blob IS NULL AND encoding_data IS NOT NULL AND id > :last_id "
+                "ORDER BY id LIMIT :limit"
+            ), {"last_id": last_id, "limit": batch_size}).all()
+            if not rows:
+                break
+            updates = []
+            for encoding_id, encoding_data in rows:
+                last_id = encoding_id
+                try:
+                    vector = np.asarray(json.loads(encoding_data), dtype=storage_dtype)
+                except (json.JSONDecodeError, TypeError, ValueError) as e:
+                    print(f"Bỏ qua encoding ID {encoding_id} (JSON lỗi): {e}")
+                    continue
+                updates.append({
+                    "id": encoding_id,
+                    "blob": vector.tobytes(),
+                    "dtype": models.ENCODING_STORAGE_DTYPE,
+                    "data": encoding_data if keep_json else None,
+                })
+            if updates:
+                conn.execute(text(
+                    f"UPDATE {FACE_ENCODINGS_TABLE} "
+                    "SET encoding_blob = :blob, encoding_dtype = :dtype, encoding_data = :data WHERE id = :id"
+                ), updates)
+                converted += len(updates)
+    if converted:
+        print(f"Đã chuyển {converted} mã hóa sang định dạng nhị phân.")
+    return converted
+
+
+def vacuum(engine: Engine) -> None:
+    """Thu hồi dung lượng file SQLite sau khi xóa JSON."""
+    if engine.dialect.name != "sqlite":
+        return
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("VACUUM"))
+
+
+def main():
+    from .database import engine
+
+    parser = argparse.ArgumentParser(description="Chuyển face_encodings từ JSON sang float32 nhị phân.")
+    parser.add_argument("--keep-json", action="store_true", help="Giữ lại cột JSON cũ sau khi chuyển đổi.")
+    parser.add_argument("--vacuum", action="store_true", help="Chạy VACUUM sau khi chuyển đổi (chỉ SQLite).")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine)
+    converted = migrate_encodings_to_binary(engine, batch_size=args.batch_size, keep_json=args.keep_json)
+    if args.vacuum:
+        vacuum(engine)
+    print(f"Hoàn tất: {converted} dòng được chuyển đổi.")
+
+
+if __name__ == "__main__":
+    main()
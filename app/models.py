@@ -1,13 +1,15 @@
 # app/models.py
 import json
-from sqlalchemy import Column, Integer, String, Text, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, LargeBinary, ForeignKey
 from sqlalchemy.orm import relationship # For defining relationships
 import numpy as np
-from typing import List
+from typing import List, Optional
 
 from .database import Base
 
 MAX_ENCODINGS_PER_USER = 10
+# Kiểu dữ liệu dùng để lưu mã hóa dạng nhị phân (little-endian float32, 512 bytes cho 128 chiều)
+ENCODING_STORAGE_DTYPE = "<f4"
 
 class User(Base):
     __tablename__ = "users"
@@ -23,25 +25,50 @@ class FaceEncoding(Base):
     __tablename__ = "face_encodings"
 
     id = Column(Integer, primary_key=True, index=True)
-    encoding_data = Column(Text, nullable=False)
+    # Định dạng cũ (JSON text), chỉ còn được đọc trong giai đoạn chuyển đổi, xem app/migrations.py
+    encoding_data = Column(Text, nullable=True)
+    # Định dạng mới: raw bytes của vector, kiểu dữ liệu ghi trong encoding_dtype
+    encoding_blob = Column(LargeBinary, nullable=True)
+    encoding_dtype = Column(String(8), nullable=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     user = relationship("User", back_populates="encodings")
 
-    def get_encoding_array(self) -> np.ndarray:
-        """Converts the JSON string encoding back to a numpy array."""
-        if self.encoding_data:
+    @staticmethod
+    def decode_encoding(encoding_blob: Optional[bytes], encoding_dtype: Optional[str],
+                        encoding_data: Optional[str] = None) -> np.ndarray:
+        """
+        Decodes stored encoding columns into a float64 numpy array.
+        Prefers the binary column and falls back to legacy JSON text.
+        """
+        if encoding_blob:
+            try:
+                return np.frombuffer(encoding_blob, dtype=np.dtype(encoding_dtype or ENCODING_STORAGE_DTYPE)).astype(np.float64)
+            except (TypeError, ValueError):
+                raise ValueError("Invalid binary face encoding data.")
+        if encoding_data:
             try:
-                return np.array(json.loads(self.encoding_data))
+                return np.array(json.loads(encoding_data), dtype=np.float64)
             except json.JSONDecodeError:
                 # Log this
                 raise ValueError("Invalid face encoding data format.")
         raise ValueError("FaceEncoding object has no encoding data.")
 
+    @staticmethod
+    def encode_encoding(encoding_array: np.ndarray) -> bytes:
+        """Serializes a 1D encoding to raw bytes in ENCODING_STORAGE_DTYPE."""
+        return np.ascontiguousarray(encoding_array, dtype=np.dtype(ENCODING_STORAGE_DTYPE)).tobytes()
+
+    def get_encoding_array(self) -> np.ndarray:
+        """Converts the stored encoding (binary or legacy JSON) back to a numpy array."""
+        return self.decode_encoding(self.encoding_blob, self.encoding_dtype, self.encoding_data)
+
     def set_encoding_array(self, encoding_array: np.ndarray):
-        """Converts a numpy array encoding to a JSON string for storage."""
+        """Stores a numpy array encoding as raw float32 bytes."""
         if not isinstance(encoding_array, np.ndarray) or encoding_array.ndim != 1 or encoding_array.size == 0:
             raise ValueError("Invalid encoding array provided: Must be a non-empty 1D numpy array.")
-        self.encoding_data = json.dumps(encoding_array.tolist())
+        self.encoding_blob = self.encode_encoding(encoding_array)
+        self.encoding_dtype = ENCODING_STORAGE_DTYPE
+        self.encoding_data = None
 
     def __repr__(self):
         return f"<FaceEncoding(id={self.id}, user_id={self.user_id})>"
\ No newline at end of file
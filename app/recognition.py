@@ -0,0 +1,381 @@
+# app/recognition.py
+"""
+Logic nhận dạng dùng chung cho các endpoint (HTTP, WebSocket, ...):
+chạy pipeline trong worker pool và dựng RecognitionResponse từ kết quả.
+"""
+import asyncio
+import os
+import tarfile
+import zipfile
+from typing import AsyncIterator, BinaryIO, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from . import admission
+from . import config
+from . import face_utils
+from . import gallery
+from . import match_batcher
+from . import metrics
+from . import result_cache
+from . import schemas
+from . import tracking
+from . import workers
+
+
+async def detect_and_encode(image_bytes: bytes) -> Tuple[List[Tuple[int, int, int, int]], List[np.ndarray]]:
+    """
+    Decode + HOG detect + encode trong worker pool để không chặn event loop.
+    ValueError nếu ảnh không đọc được; lỗi khác là lỗi của face_recognition.
+    """
+    face_locations, encodings = await workers.run_timed_in_worker(face_utils.detect_and_encode, image_bytes)
+    metrics.IMAGES_PROCESSED.inc()
+    metrics.FACES_DETECTED.inc(amount=len(face_locations))
+    return face_locations, encodings
+
+
+async def match_encodings(
+    unknown_encodings_np: List[np.ndarray],
+    top_k: int = 1,
+    db: Optional[Session] = None
+) -> Optional[List[List[Tuple[str, float]]]]:
+    """
+    So khớp qua `match_batcher` (gộp với các request đồng thời) khi được bật.
+    None nếu không gộp, khi đó `build_recognition_response` tự so khớp như trước.
+    """
+    batcher = match_batcher.match_batcher
+    if not batcher.enabled or not unknown_encodings_np:
+        return None
+    with metrics.timer("gallery_fetch"):
+        gallery_snapshot = gallery.gallery_cache.get_snapshot(db) # Nạp gallery (lần đầu) bằng session của request
+    if not gallery_snapshot.size:
+        return None
+    return await batcher.match(unknown_encodings_np, top_k=top_k)
+
+
+async def detect_boxes(image_bytes: bytes, upsample: int = config.DETECTION_UPSAMPLE) -> schemas.DetectionResponse:
+    """Chỉ decode + HOG detect (không encode, không so khớp) trong worker pool."""
+    face_locations, (height, width) = await workers.run_timed_in_worker(face_utils.detect_only, image_bytes, upsample)
+    metrics.IMAGES_PROCESSED.inc()
+    metrics.FACES_DETECTED.inc(amount=len(face_locations))
+    return schemas.DetectionResponse(
+        boxes=[list(box) for box in face_locations],
+        width=width,
+        height=height,
+    )
+
+
+async def recognize_image_bytes(image_bytes: bytes, top_k: int = 1, db: Optional[Session] = None) -> schemas.RecognitionResponse:
+    """
+    Toàn bộ quá trình nhận dạng cho một ảnh đã upload.
+    Ảnh giống hệt (hoặc gần giống, nếu bật perceptual hash) một ảnh vừa nhận dạng với
+    cùng phiên bản gallery được trả lời thẳng từ `result_cache`.
+    """
+    cache = result_cache.result_cache
+    if not cache.enabled:
+        face_locations, unknown_encodings_np = await detect_and_encode(image_bytes)
+        candidates_per_face = await match_encodings(unknown_encodings_np, top_k=top_k, db=db)
+        return build_recognition_response(face_locations, unknown_encodings_np, top_k=top_k, db=db,
+                                          candidates_per_face=candidates_per_face)
+
+    with metrics.timer("gallery_fetch"):
+        gallery_version = gallery.gallery_cache.get_snapshot(db).version
+    key = result_cache.content_hash(image_bytes)
+    cached = cache.get(key, top_k, gallery_version)
+    if cached is not None:
+        return cached
+    phash = None
+    if cache.uses_phash:
+        phash = await workers.run_in_worker(face_utils.perceptual_hash, image_bytes)
+        cached = cache.get(key, top_k, gallery_version, phash=phash)
+        if cached is not None:
+            return cached
+
+    face_locations, unknown_encodings_np = await detect_and_encode(image_bytes)
+    candidates_per_face = await match_encodings(unknown_encodings_np, top_k=top_k, db=db)
+    response = build_recognition_response(face_locations, unknown_encodings_np, top_k=top_k, db=db,
+                                          candidates_per_face=candidates_per_face)
+    cache.put(key, top_k, gallery_version, response, phash=phash)
+    return response
+
+
+async def recognize_image_bytes_tracked(
+    image_bytes: bytes,
+    tracker: tracking.FaceTracker,
+    top_k: int = 1,
+    db: Optional[Session] = None
+) -> schemas.RecognitionResponse:
+    """
+    Như `recognize_image_bytes`, nhưng chỉ encode + so khớp những khuôn mặt mà tracker
+    của phiên cho là mới hoặc đã thay đổi; các khuôn mặt ổn định dùng lại kết quả cũ.
+    """
+    async with tracker.lock: # Các frame của cùng một phiên được xử lý tuần tự
+        image_np, face_locations, original_shape = await workers.run_timed_in_worker(face_utils.decode_and_detect, image_bytes)
+        metrics.IMAGES_PROCESSED.inc()
+        metrics.FACES_DETECTED.inc(amount=len(face_locations))
+        tracks = tracker.associate(face_locations)
+
+        to_encode = [i for i, track in enumerate(tracks) if tracker.needs_encoding(track)]
+        if to_encode:
+            new_encodings = await workers.run_timed_in_worker(
+                face_utils.encode_faces, image_np, [face_locations[i] for i in to_encode]
+            )
+            for i, encoding in zip(to_encode, new_encodings):
+                tracker.record_encoding(tracks[i], encoding)
+
+        # So khớp lại các track vừa encode, hoặc đã so khớp với một phiên bản gallery cũ hơn
+        with metrics.timer("gallery_fetch"):
+            gallery_snapshot = gallery.gallery_cache.get_snapshot(db)
+        stale = [t for t in tracks if t.encoding is not None and t.gallery_version != gallery_snapshot.version]
+        if stale and gallery_snapshot.size:
+            if match_batcher.match_batcher.enabled:
+                results = await match_batcher.match_batcher.match([t.encoding for t in stale], top_k=top_k)
+            else:
+                with metrics.timer("match"):
+                    results = gallery.gallery_cache.match(
+                        [t.encoding for t in stale],
+                        tolerance=face_utils.RECOGNITION_TOLERANCE,
+                        top_k=top_k,
+                        aggregate="min",
+                        snapshot=gallery_snapshot
+                    )
+            for track, candidates in zip(stale, results):
+                track.candidates = candidates
+                track.gallery_version = gallery_snapshot.version
+
+        encodings = [t.encoding for t in tracks if t.encoding is not None]
+        if len(encodings) != len(tracks):
+            encodings = [] # Có khuôn mặt không encode được, xử lý như trường hợp 2 bên dưới
+        return build_recognition_response(
+            face_utils.boxes_to_original(face_locations, image_np.shape, original_shape), encodings, top_k=top_k, db=db,
+            candidates_per_face=[t.candidates for t in tracks],
+            track_ids=[t.track_id for t in tracks]
+        )
+
+
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png", ".bmp", ".webp", ".gif")
+# Content type được chấp nhận cho file nén của /api/recognize/batch/
+ARCHIVE_CONTENT_TYPES = (
+    "application/zip", "application/x-zip-compressed", "application/x-tar", "application/gzip",
+    "application/x-gzip", "application/x-bzip2", "application/x-xz", "application/octet-stream",
+)
+
+
+def read_archive_images(
+    fileobj: BinaryIO,
+    filename: str,
+    max_images: int = config.BATCH_MAX_IMAGES,
+    max_total_bytes: int = config.BATCH_MAX_ARCHIVE_BYTES,
+    max_image_bytes: int = config.BATCH_MAX_IMAGE_BYTES
+) -> List[Tuple[str, bytes]]:
+    """
+    Đọc các file ảnh (theo phần mở rộng) trong một file zip hoặc tar (có thể nén gzip/bz2/xz).
+    ValueError nếu không phải file nén hợp lệ, có quá nhiều ảnh, một ảnh lớn hơn
+    `max_image_bytes` hoặc tổng dung lượng sau giải nén vượt `max_total_bytes`.
+    Kích thước khai báo trong header được kiểm tra trước, và mỗi lần đọc cũng bị giới hạn
+    (header có thể sai), nên không bao giờ giải nén quá giới hạn vào bộ nhớ.
+    """
+    images: List[Tuple[str, bytes]] = []
+    total_bytes = 0
+
+    def add(name: str, declared_size: int, open_member) -> None:
+        nonlocal total_bytes
+        if not name.lower().endswith(IMAGE_SUFFIXES) or os.path.basename(name).startswith("."):
+            return
+        if len(images) >= max_images:
+            raise ValueError(f"File nén chứa quá {max_images} ảnh.")
+        if declared_size > max_image_bytes:
+            raise ValueError(f"Ảnh '{name}' lớn hơn {max_image_bytes} byte sau giải nén.")
+        if total_bytes + declared_size > max_total_bytes:
+            raise ValueError(f"Tổng dung lượng ảnh sau giải nén vượt quá {max_total_bytes} byte.")
+        with open_member() as member:
+            data = member.read(min(max_image_bytes, max_total_bytes - total_bytes) + 1)
+        if len(data) > max_image_bytes:
+            raise ValueError(f"Ảnh '{name}' lớn hơn {max_image_bytes} byte sau giải nén.")
+        total_bytes += len(data)
+        if total_bytes > max_total_bytes:
+            raise ValueError(f"Tổng dung lượng ảnh sau giải nén vượt quá {max_total_bytes} byte.")
+        images.append((name, data))
+
+    fileobj.seek(0)
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        try:
+            with zipfile.ZipFile(fileobj) as archive:
+                for info in archive.infolist():
+                    if not info.is_dir():
+                        add(info.filename, info.file_size, lambda info=info: archive.open(info))
+        except (zipfile.BadZipFile, zipfile.LargeZipFile) as e:
+            raise ValueError(f"Không đọc được file nén '{filename}': {e}")
+        return images
+    fileobj.seek(0)
+    try:
+        with tarfile.open(fileobj=fileobj, mode="r:*") as archive:
+            for member in archive:
+                if member.isfile():
+                    add(member.name, member.size, lambda member=member: archive.extractfile(member))
+    except tarfile.TarError as e:
+        raise ValueError(f"Không đọc được file nén '{filename}' (chỉ hỗ trợ zip/tar): {e}")
+    return images
+
+
+async def recognize_batch(images: List[Tuple[str, bytes]], top_k: int = 1,
+                          ticket: Optional[admission.BatchTicket] = None) -> AsyncIterator[schemas.BatchRecognitionItem]:
+    """
+    Nhận dạng nhiều ảnh: decode/detect/encode song song trong worker pool, và mỗi khi
+    có ảnh xử lý xong thì so khớp mã hóa của tất cả các ảnh vừa xong trong một lần,
+    trả kết quả từng ảnh ngay (theo thứ tự hoàn thành, không theo thứ tự upload).
+    Gallery phải được nạp trước (hàm này không dùng DB session).
+    `ticket` (từ `admission.controller.admit_batch`) đếm các ảnh còn chờ vào độ sâu hàng đợi.
+    """
+    max_in_flight = config.BATCH_MAX_IN_FLIGHT or 2 * workers.pool_size()
+    semaphore = asyncio.Semaphore(max_in_flight) # Không chiếm hết pool của các request khác
+
+    async def process(index: int, image_bytes: bytes):
+        # Ảnh của lô xếp hàng sau request đăng ký/nhận dạng đơn lẻ, nhưng không bị từ chối
+        # (cả lô đã được nhận bởi admit_batch)
+        async with semaphore:
+            if ticket is not None:
+                ticket.image_started()
+            async with admission.controller.slot(admission.BATCH, bounded=False):
+                try:
+                    face_locations, encodings = await detect_and_encode(image_bytes)
+                    return index, face_locations, encodings, None
+                except ValueError as e:
+                    return index, [], [], f"Không thể đọc hoặc xử lý ảnh: {str(e)}"
+                except Exception as e:
+                    print(f"ERROR in batch recognition: {type(e).__name__} - {e}")
+                    return index, [], [], f"Server error during face detection: {str(e)}"
+
+    pending = {asyncio.ensure_future(process(i, data)) for i, (_, data) in enumerate(images)}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            finished = [task.result() for task in done]
+
+            # Một lần so khớp cho mã hóa của tất cả các ảnh vừa xong
+            all_encodings = [enc for _, _, encodings, _ in finished for enc in encodings]
+            with metrics.timer("gallery_fetch"):
+                gallery_snapshot = gallery.gallery_cache.get_snapshot()
+            all_candidates = []
+            if all_encodings and gallery_snapshot.size:
+                with metrics.timer("match"):
+                    all_candidates = gallery.gallery_cache.match(
+                        all_encodings,
+                        tolerance=face_utils.RECOGNITION_TOLERANCE,
+                        top_k=top_k,
+                        aggregate="min",
+                        snapshot=gallery_snapshot
+                    )
+
+            offset = 0
+            for index, face_locations, encodings, error in finished:
+                filename = images[index][0]
+                if error:
+                    yield schemas.BatchRecognitionItem(index=index, filename=filename, error=error)
+                    continue
+                candidates_per_face = None
+                if all_candidates:
+                    candidates_per_face = all_candidates[offset:offset + len(encodings)]
+                offset += len(encodings)
+                response = build_recognition_response(
+                    face_locations, encodings, top_k=top_k, candidates_per_face=candidates_per_face
+                )
+                yield schemas.BatchRecognitionItem(
+                    index=index, filename=filename,
+                    recognized_faces=response.recognized_faces, message=response.message
+                )
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def build_recognition_response(
+    face_locations: List[Tuple[int, int, int, int]],
+    unknown_encodings_np: List[np.ndarray],
+    top_k: int = 1,
+    db: Optional[Session] = None,
+    candidates_per_face: Optional[List[List[Tuple[str, float]]]] = None,
+    track_ids: Optional[List[int]] = None
+) -> schemas.RecognitionResponse:
+    """
+    So khớp các mã hóa của một ảnh với gallery và dựng response.
+    `db` chỉ cần cho lần đầu tiên, khi gallery cache chưa được nạp.
+    Nếu `candidates_per_face` đã có (ví dụ từ tracker) thì không so khớp lại.
+    """
+    # Trường hợp 1: Không tìm thấy khuôn mặt nào (cả location và encoding đều rỗng)
+    if not face_locations: # Nếu không có face_locations thì cũng không có unknown_encodings_np
+        return schemas.RecognitionResponse(
+            recognized_faces=[],
+            message="Không tìm thấy khuôn mặt nào trong ảnh được cung cấp."
+        )
+    
+    # Trường hợp 2: Có locations nhưng không có encodings (hiếm khi xảy ra với face_recognition, nhưng để an toàn)
+    # Điều này có nghĩa là face_recognition.face_encodings() không trả về gì dù có locations.
+    if face_locations and not unknown_encodings_np:
+        recognized_matches_only_locs: List[schemas.RecognitionMatch] = []
+        for loc in face_locations:
+             recognized_matches_only_locs.append(schemas.RecognitionMatch(name="Unknown (encoding error)", distance=None, box=list(loc)))
+        return schemas.RecognitionResponse(
+            recognized_faces=recognized_matches_only_locs,
+            message=f"Phát hiện {len(face_locations)} vị trí khuôn mặt nhưng không thể tạo mã hóa."
+        )
+
+    # Từ đây, chúng ta chắc chắn có cả face_locations và unknown_encodings_np (cùng số lượng)
+
+    # Gallery được cache trong process, chỉ đọc DB ở lần gọi đầu tiên
+    with metrics.timer("gallery_fetch"):
+        gallery_snapshot = gallery.gallery_cache.get_snapshot(db)
+    known_encodings_from_db, known_names_from_db = gallery_snapshot.encodings, gallery_snapshot.names
+    
+    # Trường hợp 3: Có khuôn mặt trong ảnh gửi lên, nhưng DB không có dữ liệu để so sánh
+    if len(known_encodings_from_db) == 0:
+        recognized_matches_no_db: List[schemas.RecognitionMatch] = []
+        for i, loc in enumerate(face_locations): # Dùng face_locations đã có
+             # unknown_encoding = unknown_encodings_np[i] # không cần thiết vì không có gì để so sánh
+             recognized_matches_no_db.append(schemas.RecognitionMatch(name="Unknown (no known faces in DB)", distance=None, box=list(loc)))
+        return schemas.RecognitionResponse(
+            recognized_faces=recognized_matches_no_db,
+            message=f"Phát hiện {len(face_locations)} khuôn mặt, nhưng không có dữ liệu khuôn mặt nào trong hệ thống để so sánh."
+        )
+
+    # Trường hợp 4: Xử lý nhận dạng chính
+    # So khớp tất cả khuôn mặt trong ảnh với gallery trong một lần (brute force hoặc chỉ mục ANN),
+    # gộp theo user (min) để top_k trả về các user khác nhau
+    if candidates_per_face is None:
+        with metrics.timer("match"):
+            candidates_per_face = gallery.gallery_cache.match(
+                unknown_encodings_np,
+                tolerance=face_utils.RECOGNITION_TOLERANCE,
+                top_k=top_k,
+                aggregate="min",
+                snapshot=gallery_snapshot
+            )
+    if track_ids is None:
+        track_ids = [None] * len(face_locations)
+    recognized_matches: List[schemas.RecognitionMatch] = []
+    for current_location, candidates, track_id in zip(face_locations, candidates_per_face, track_ids): # (top, right, bottom, left)
+        extra_candidates = None
+        if top_k > 1:
+            extra_candidates = [schemas.RecognitionCandidate(name=c_name, distance=c_dist) for c_name, c_dist in candidates]
+        if candidates: # Tìm thấy match
+            name, distance = candidates[0]
+            recognized_matches.append(schemas.RecognitionMatch(name=name, distance=distance, box=list(current_location), candidates=extra_candidates, track_id=track_id))
+        else: # Không tìm thấy match (vượt tolerance)
+            recognized_matches.append(schemas.RecognitionMatch(name="Unknown", distance=None, box=list(current_location), candidates=extra_candidates, track_id=track_id))
+            
+    message = f"Đã xử lý {len(unknown_encodings_np)} khuôn mặt được phát hiện."
+    
+    # Kiểm tra xem có match nào không, nếu không thì message có thể cụ thể hơn
+    found_known_face = any(match.name != "Unknown" and match.name != "Unknown (encoding error)" and match.name != "Unknown (no known faces in DB)" for match in recognized_matches)
+    if not found_known_face and recognized_matches: # Có phát hiện nhưng không match ai
+        message += " Không nhận dạng được khuôn mặt nào đã biết."
+    elif not recognized_matches and unknown_encodings_np : # Lỗi logic đâu đó nếu có encoding mà không có match (kể cả Unknown)
+        message = "Lỗi logic: Có mã hóa nhưng không có kết quả nhận dạng."
+
+
+    return schemas.RecognitionResponse(
+        recognized_faces=recognized_matches,
+        message=message
+    )
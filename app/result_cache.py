@@ -0,0 +1,122 @@
+# app/result_cache.py
+"""
+Cache LRU cho kết quả nhận dạng của từng ảnh.
+
+Client webcam thường gửi lại đúng cùng một frame (cảnh tĩnh, video tạm dừng):
+kết quả được tra theo hash của bytes upload (và tuỳ chọn theo perceptual hash
+của một thumbnail nhỏ, để bắt cả các frame gần giống nhau sau khi nén lại).
+Mọi kết quả bị xoá khi phiên bản gallery thay đổi.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from . import config
+from . import schemas
+
+
+def content_hash(image_bytes: bytes) -> bytes:
+    return hashlib.blake2b(image_bytes, digest_size=16).digest()
+
+
+class RecognitionResultCache:
+    """
+    LRU (content hash, top_k) -> RecognitionResponse, gắn với một phiên bản gallery.
+
+    Khi `phash_max_distance` >= 0, mỗi kết quả còn được đánh chỉ mục theo dHash của ảnh;
+    ảnh có dHash cách một dHash đã biết không quá `phash_max_distance` bit được coi là cùng frame.
+    Thread-safe; các response được trả về dùng chung, không được sửa.
+    """
+
+    def __init__(self, max_entries: int = config.RESULT_CACHE_SIZE,
+                 phash_max_distance: int = config.RESULT_CACHE_PHASH_MAX_DISTANCE):
+        self.max_entries = max_entries
+        self.phash_max_distance = phash_max_distance
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[bytes, int], Tuple[Optional[int], schemas.RecognitionResponse]]" = OrderedDict()
+        self._gallery_version: Optional[int] = None
+        self.hits = 0
+        self.phash_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @property
+    def uses_phash(self) -> bool:
+        return self.enabled and self.phash_max_distance >= 0
+
+    def get(self, key: bytes, top_k: int, gallery_version: int,
+            phash: Optional[int] = None) -> Optional[schemas.RecognitionResponse]:
+        """Kết quả đã cache cho ảnh `key` (hoặc ảnh có dHash gần `phash`), None nếu không có."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            self._check_version(gallery_version)
+            entry = self._entries.get((key, top_k))
+            if entry is not None:
+                self._entries.move_to_end((key, top_k))
+                self.hits += 1
+                return entry[1]
+            if phash is not None and self.phash_max_distance >= 0:
+                # Quét tuyến tính: cache nhỏ (vài trăm phần tử), rẻ hơn nhiều so với một lần detect
+                for cached_key, (cached_phash, response) in reversed(self._entries.items()):
+                    if cached_key[1] == top_k and cached_phash is not None \
+                            and bin(cached_phash ^ phash).count("1") <= self.phash_max_distance:
+                        self._entries.move_to_end(cached_key)
+                        self.phash_hits += 1
+                        return response
+            if phash is not None or not self.uses_phash:
+                self.misses += 1 # Lần tra exact trước lần tra dHash không tính là miss
+            return None
+
+    def put(self, key: bytes, top_k: int, gallery_version: int, response: schemas.RecognitionResponse,
+            phash: Optional[int] = None) -> None:
+        """Lưu kết quả được tính với phiên bản gallery `gallery_version`."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._check_version(gallery_version)
+            if gallery_version != self._gallery_version:
+                return # Gallery đã đổi trong lúc nhận dạng, kết quả đã cũ
+            self._entries[(key, top_k)] = (phash, response)
+            self._entries.move_to_end((key, top_k))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            lookups = self.hits + self.phash_hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "phash_hits": self.phash_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.phash_hits) / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "gallery_version": self._gallery_version,
+            }
+
+    def _check_version(self, gallery_version: int) -> None:
+        # Phải được gọi khi đang giữ self._lock
+        if self._gallery_version is None or gallery_version > self._gallery_version:
+            if self._entries:
+                self._entries.clear()
+                self.invalidations += 1
+            self._gallery_version = gallery_version
+
+
+# Một instance dùng chung cho cả process
+result_cache = RecognitionResultCache()
@@ -1,6 +1,6 @@
 # app/schemas.py
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 # --- FaceEncoding Schemas ---
 
@@ -27,6 +27,11 @@ class UserResponse(BaseModel): # Schema để hiển thị thông tin người d
     class Config:
         from_attributes = True
 
+class UserSummary(BaseModel): # Dạng rút gọn cho danh sách lớn, không kèm danh sách mã hóa
+    id: int = Field(..., description="ID của người dùng.")
+    name: str = Field(..., description="Tên của người dùng.")
+    encoding_count: int = Field(..., description="Số mã hóa khuôn mặt đang lưu cho người dùng này.")
+
 class RecognitionMatch(BaseModel):
     name: str = Field(..., description="Tên người được nhận dạng, hoặc 'Unknown'.")
     distance: Optional[float] = Field(
@@ -48,6 +53,16 @@ class RecognitionResponse(BaseModel):
 class MessageResponse(BaseModel):
     message: str = Field(..., description="Thông báo kết quả hoạt động.")
 
+class GalleryImportResponse(BaseModel):
+    users_created: int = Field(..., description="Số người dùng mới được tạo.")
+    users_updated: int = Field(..., description="Số người dùng đã tồn tại được thêm hoặc thay mã hóa.")
+    encodings_added: int = Field(..., description="Tổng số mã hóa đã ghi vào database.")
+    mode: str = Field(..., description="Cách xử lý tên đã tồn tại (skip, merge hoặc replace).")
+
+class RecognitionCandidate(BaseModel):
+    name: str = Field(..., description="Tên người dùng ứng viên.")
+    distance: float = Field(..., description="Khoảng cách nhỏ nhất tới các mã hóa của người dùng này.")
+
 class RecognitionMatch(BaseModel):
     name: str = Field(..., description="Tên người được nhận dạng, hoặc 'Unknown'.")
     distance: Optional[float] = Field(
@@ -58,6 +73,14 @@ class RecognitionMatch(BaseModel):
         None,
         description="Tọa độ [top, right, bottom, left] của khuôn mặt trong ảnh gốc đã gửi đi."
     )
+    candidates: Optional[List[RecognitionCandidate]] = Field(
+        None,
+        description="Top-k ứng viên gần nhất (chỉ có khi gọi với top_k > 1)."
+    )
+    track_id: Optional[int] = Field(
+        None,
+        description="ID của track khuôn mặt trong phiên (chỉ có khi bật tracking theo phiên)."
+    )
 
 class RecognitionResponse(BaseModel):
     recognized_faces: List[RecognitionMatch] = Field(
@@ -67,4 +90,50 @@ class RecognitionResponse(BaseModel):
     message: Optional[str] = Field(
         None,
         description="Thông báo tùy chọn về quá trình nhận dạng."
-    )
\ No newline at end of file
+    )
+
+class DetectionResponse(BaseModel):
+    boxes: List[List[int]] = Field(
+        default_factory=list,
+        description="Tọa độ [top, right, bottom, left] của từng khuôn mặt trong ảnh gốc (không nhận dạng)."
+    )
+    width: int = Field(..., description="Chiều rộng ảnh gốc.")
+    height: int = Field(..., description="Chiều cao ảnh gốc.")
+
+class CaptureSettings(BaseModel):
+    max_width: int = Field(..., description="Chiều rộng tối đa của ảnh gửi lên (client thu nhỏ giữ tỉ lệ).")
+    max_height: int = Field(..., description="Chiều cao tối đa của ảnh gửi lên.")
+    jpeg_quality: float = Field(..., ge=0.0, le=1.0, description="Chất lượng JPEG (0-1) khi client nén ảnh.")
+    target_fps: Optional[float] = Field(None, description="Số frame tối đa mỗi giây (chỉ cho luồng camera).")
+
+class CaptureProfile(BaseModel):
+    recognition: CaptureSettings = Field(..., description="Thông số cho trang nhận dạng trực tiếp.")
+    registration: CaptureSettings = Field(..., description="Thông số cho ảnh chụp khi đăng ký.")
+    full_recognition_interval_ms: int = Field(
+        ...,
+        description="Chế độ hybrid: khoảng cách tối thiểu giữa hai lần nhận dạng đầy đủ."
+    )
+
+class HealthStatus(BaseModel):
+    status: str = Field(..., description='"alive" (liveness), "ready", "starting" hoặc "failed" (readiness).')
+    checks: Dict[str, bool] = Field(
+        default_factory=dict,
+        description="Các bước khởi động đã xong: database, models (dlib), gallery."
+    )
+    error: Optional[str] = Field(None, description="Lỗi khi warm-up, nếu có.")
+
+class StreamRecognitionResponse(RecognitionResponse):
+    dropped_frames: int = Field(
+        0,
+        description="Số frame đã bị bỏ qua (vì có frame mới hơn) kể từ kết quả trước trên cùng kết nối."
+    )
+    error: Optional[str] = Field(None, description="Lỗi khi xử lý frame này (nếu có).")
+    busy: bool = Field(False, description="True nếu frame bị bỏ qua vì server quá tải.")
+    retry_after: Optional[int] = Field(None, description="Khi busy: số giây client nên chờ trước khi gửi frame tiếp theo.")
+
+class BatchRecognitionItem(BaseModel):
+    index: int = Field(..., description="Vị trí của ảnh trong lô (theo thứ tự upload / trong file nén).")
+    filename: Optional[str] = Field(None, description="Tên file ảnh.")
+    recognized_faces: List[RecognitionMatch] = Field(default_factory=list)
+    message: Optional[str] = None
+    error: Optional[str] = Field(None, description="Lỗi khi xử lý ảnh này (nếu có).")
@@ -0,0 +1,169 @@
+# app/tracking.py
+"""
+Theo dõi khuôn mặt theo phiên (mỗi camera / kết nối) để không phải encode lại
+những khuôn mặt đứng yên qua nhiều frame liên tiếp.
+
+Mỗi frame: detect như bình thường, ghép box mới với các track cũ theo IoU, và chỉ
+encode + so khớp những khuôn mặt mới, đã di chuyển / đổi kích thước đáng kể, hoặc
+đã quá `reencode_interval` frame kể từ lần encode trước. Các khuôn mặt còn lại dùng
+lại danh tính của track.
+"""
+import asyncio
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from . import config
+
+Box = Tuple[int, int, int, int] # (top, right, bottom, left)
+
+
+def box_iou_matrix(boxes_a: List[Box], boxes_b: List[Box]) -> np.ndarray:
+    """IoU giữa mọi cặp box (top, right, bottom, left), kích thước (len(a), len(b))."""
+    if not boxes_a or not boxes_b:
+        return np.zeros((len(boxes_a), len(boxes_b)))
+    a = np.asarray(boxes_a, dtype=np.float64)[:, np.newaxis, :]
+    b = np.asarray(boxes_b, dtype=np.float64)[np.newaxis, :, :]
+    inter_h = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    inter_w = np.clip(np.minimum(a[..., 1], b[..., 1]) - np.maximum(a[..., 3], b[..., 3]), 0, None)
+    inter = inter_h * inter_w
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 1] - a[..., 3])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 1] - b[..., 3])
+    union = area_a + area_b - inter
+    return np.where(union > 0, inter / np.where(union > 0, union, 1), 0.0)
+
+
+def _box_area(box: Box) -> float:
+    top, right, bottom, left = box
+    return max(0, bottom - top) * max(0, right - left)
+
+
+class Track:
+    """Một khuôn mặt được theo dõi qua nhiều frame."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, box: Box):
+        self.track_id = next(self._ids)
+        self.box = box
+        self.encoded_box: Optional[Box] = None # Box tại lần encode gần nhất
+        self.encoding: Optional[np.ndarray] = None
+        self.candidates: List[Tuple[str, float]] = []
+        self.gallery_version: Optional[int] = None # Phiên bản gallery lúc so khớp
+        self.frames_since_encode = 0
+        self.missed_frames = 0
+
+
+class FaceTracker:
+    """
+    Tracker cho một luồng frame. Không thread-safe: các frame của cùng một phiên phải
+    được xử lý tuần tự (giữ `lock` trong lúc xử lý, xem app/recognition.py).
+    """
+
+    def __init__(
+        self,
+        iou_threshold: float = config.TRACK_IOU_THRESHOLD,
+        reencode_interval: int = config.TRACK_REENCODE_INTERVAL,
+        move_iou_threshold: float = config.TRACK_MOVE_IOU_THRESHOLD,
+        size_change_ratio: float = config.TRACK_SIZE_CHANGE_RATIO,
+        max_missed_frames: int = config.TRACK_MAX_MISSED_FRAMES
+    ):
+        self.iou_threshold = iou_threshold
+        self.reencode_interval = reencode_interval
+        self.move_iou_threshold = move_iou_threshold
+        self.size_change_ratio = size_change_ratio
+        self.max_missed_frames = max_missed_frames
+        self.tracks: List[Track] = []
+        self.lock = asyncio.Lock()
+
+    def associate(self, boxes: List[Box]) -> List[Track]:
+        """
+        Ghép các box của frame hiện tại với track (greedy theo IoU giảm dần), tạo track
+        mới cho box chưa ghép và bỏ các track mất dấu quá lâu.
+        Trả về track tương ứng với từng box, theo đúng thứ tự `boxes`.
+        """
+        iou = box_iou_matrix([t.box for t in self.tracks], list(boxes))
+        assigned: List[Optional[Track]] = [None] * len(boxes)
+        used_tracks = set()
+        if iou.size:
+            for flat in np.argsort(-iou, axis=None):
+                track_idx, box_idx = np.unravel_index(flat, iou.shape)
+                if iou[track_idx, box_idx] < self.iou_threshold:
+                    break
+                if track_idx in used_tracks or assigned[box_idx] is not None:
+                    continue
+                used_tracks.add(track_idx)
+                assigned[box_idx] = self.tracks[track_idx]
+
+        survivors = []
+        for idx, track in enumerate(self.tracks):
+            if idx in used_tracks:
+                track.missed_frames = 0
+                survivors.append(track)
+            else:
+                track.missed_frames += 1
+                if track.missed_frames <= self.max_missed_frames:
+                    survivors.append(track)
+
+        result: List[Track] = []
+        for box, track in zip(boxes, assigned):
+            if track is None:
+                track = Track(tuple(box))
+                survivors.append(track)
+            else:
+                track.box = tuple(box)
+                track.frames_since_encode += 1
+            result.append(track)
+        self.tracks = survivors
+        return result
+
+    def needs_encoding(self, track: Track) -> bool:
+        """True nếu track mới, đến hạn encode lại, hoặc box đã di chuyển/đổi kích thước đáng kể."""
+        if track.encoding is None or track.encoded_box is None:
+            return True
+        if track.frames_since_encode >= self.reencode_interval:
+            return True
+        if box_iou_matrix([track.encoded_box], [track.box])[0, 0] < self.move_iou_threshold:
+            return True
+        old_area, new_area = _box_area(track.encoded_box), _box_area(track.box)
+        if old_area <= 0 or new_area <= 0:
+            return True
+        return max(old_area, new_area) / min(old_area, new_area) > self.size_change_ratio
+
+    @staticmethod
+    def record_encoding(track: Track, encoding: np.ndarray) -> None:
+        track.encoding = encoding
+        track.encoded_box = track.box
+        track.frames_since_encode = 0
+        track.gallery_version = None # Buộc so khớp lại với gallery
+
+
+class TrackerRegistry:
+    """Giữ tracker theo session_id, bỏ phiên ít dùng nhất / quá hạn để bộ nhớ có giới hạn."""
+
+    def __init__(self, max_sessions: int = config.TRACK_MAX_SESSIONS, ttl_seconds: float = config.TRACK_SESSION_TTL_SECONDS):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions: "OrderedDict[str, Tuple[FaceTracker, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> FaceTracker:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            tracker = entry[0] if entry is not None and now - entry[1] <= self.ttl_seconds else FaceTracker()
+            # OrderedDict giữ thứ tự dùng gần nhất: phần tử đầu là phiên cũ nhất
+            while self._sessions and (
+                len(self._sessions) >= self.max_sessions
+                or now - next(iter(self._sessions.values()))[1] > self.ttl_seconds
+            ):
+                self._sessions.popitem(last=False)
+            self._sessions[session_id] = (tracker, now)
+            return tracker
+
+
+tracker_registry = TrackerRegistry()
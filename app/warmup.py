@@ -0,0 +1,102 @@
+# app/warmup.py
+"""
+Khởi động và trạng thái sẵn sàng của một worker uvicorn.
+
+Lúc import, app không chạm vào database hay nạp model dlib. Lifespan của app
+(app/main.py) gọi `prepare_database` trước khi nhận request, rồi chạy `warm_up`
+ở nền:
+
+    models    -- nạp model dlib và chạy detect + encode một lần trên ảnh giả, trong
+                 từng worker của pool (app/workers.py)
+    gallery   -- nạp gallery cache (và chỉ mục ANN) rồi so khớp thử một mã hóa
+
+`/health/live` chỉ cho biết process còn chạy; `/health/ready` trả 503 cho tới khi
+mọi bước đã xong, để load balancer không gửi traffic tới worker còn "lạnh".
+"""
+import asyncio
+import time
+from typing import Dict, Optional
+
+import numpy as np
+
+from . import config
+from . import face_utils
+from . import gallery
+from . import metrics
+from . import migrations
+from . import models
+from . import workers
+from .database import engine
+
+CHECKS = ("database", "models", "gallery")
+
+WARMUP_DURATION = metrics.registry.register(metrics.Histogram(
+    "face_warmup_seconds", "Thời gian từng bước khởi động (database, models, gallery).", ("check",)))
+
+
+class Readiness:
+    """Trạng thái các bước khởi động; chỉ được cập nhật từ event loop."""
+
+    def __init__(self):
+        self.checks: Dict[str, bool] = {check: False for check in CHECKS}
+        self.error: Optional[str] = None
+        self.started_at = time.time()
+
+    @property
+    def ready(self) -> bool:
+        return all(self.checks.values())
+
+    def mark(self, check: str, started: float) -> None:
+        self.checks[check] = True
+        WARMUP_DURATION.observe(time.perf_counter() - started, check)
+
+
+def _prepare_database() -> None:
+    # Tạo các bảng trong database nếu chúng chưa tồn tại
+    models.Base.metadata.create_all(bind=engine)
+    # Chuyển các mã hóa JSON cũ sang dạng nhị phân (không làm gì nếu đã chuyển xong)
+    migrations.migrate_encodings_to_binary(engine)
+
+
+def _warm_gallery() -> None:
+    snapshot = gallery.gallery_cache.get_snapshot()
+    gallery.gallery_cache.match([np.zeros(gallery.ENCODING_DIM)], top_k=1, aggregate="min", snapshot=snapshot)
+
+
+async def prepare_database() -> None:
+    """Tạo bảng và chạy migration (trong thread, không chặn event loop)."""
+    started = time.perf_counter()
+    await asyncio.to_thread(_prepare_database)
+    readiness.mark("database", started)
+
+
+async def warm_up() -> None:
+    """Nạp model trong mọi worker của pool và nạp gallery; lỗi được ghi vào `readiness.error`."""
+    try:
+        if config.WARMUP_ENABLED:
+            started = time.perf_counter()
+            # Mỗi job giữ worker của nó tới khi model nạp xong, nên pool_size() job chạy
+            # song song sẽ rơi vào từng worker (process pool: mỗi process nạp model riêng)
+            # run_in_worker (không phải run_timed_in_worker): thời gian warm-up không được lẫn
+            # vào histogram các bước của request, chỉ được ghi ra log cho từng worker
+            results = await asyncio.gather(*(workers.run_in_worker(workers.call_timed, face_utils.warm_up)
+                                             for _ in range(workers.pool_size())))
+            for pid, timings in results:
+                print(f"Warm-up worker {pid}: " + ", ".join(
+                    f"{stage.replace('warmup_', '')} {seconds:.2f}s" for stage, seconds in timings.items()))
+            readiness.mark("models", started)
+            started = time.perf_counter()
+            await asyncio.to_thread(_warm_gallery)
+            readiness.mark("gallery", started)
+        else:
+            # Không warm-up: sẵn sàng ngay, model và gallery được nạp ở request đầu tiên
+            readiness.checks.update({"models": True, "gallery": True})
+    except Exception as e:
+        readiness.error = f"{type(e).__name__}: {e}"
+        print(f"Lỗi khi warm-up: {readiness.error}")
+
+
+# Một instance dùng chung cho cả process
+readiness = Readiness()
+metrics.register_callback("face_ready", "1 nếu worker đã warm-up xong và sẵn sàng nhận traffic.",
+                          lambda: int(readiness.ready))
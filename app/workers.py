@@ -0,0 +1,72 @@
+# app/workers.py
+"""
+Chạy các tác vụ nặng về CPU (decode ảnh, HOG detect, encode) ngoài event loop.
+
+Các endpoint `async def` gọi `await run_in_worker(fn, *args)` thay vì gọi trực tiếp,
+để một request đang nhận dạng không chặn các request khác (kể cả file tĩnh)
+trên cùng worker uvicorn.
+"""
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from . import config
+from . import metrics
+
+_executor: Optional[Executor] = None
+_executor_lock = threading.Lock()
+
+
+def pool_size() -> int:
+    return config.WORKER_POOL_SIZE or os.cpu_count() or 1
+
+
+def get_executor() -> Executor:
+    """Tạo (một lần) và trả về pool dùng chung theo cấu hình FACE_WORKER_POOL."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                if config.WORKER_POOL_KIND == "process":
+                    _executor = ProcessPoolExecutor(max_workers=pool_size())
+                else:
+                    _executor = ThreadPoolExecutor(max_workers=pool_size(), thread_name_prefix="face-worker")
+    return _executor
+
+
+async def run_in_worker(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Chạy `fn(*args, **kwargs)` trong pool và chờ kết quả mà không chặn event loop.
+    Với process pool, `fn` và các tham số phải pickle được (hàm top-level).
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(fn, *args, **kwargs))
+
+
+def call_timed(fn: Callable[..., Any], *args, **kwargs) -> Tuple[Any, Dict[str, float]]:
+    """
+    Gọi `fn(*args, timings=..., **kwargs)` và trả về (kết quả, thời gian từng bước).
+    Chạy trong worker (kể cả process pool), nên thời gian được trả về cùng kết quả
+    thay vì ghi trực tiếp vào app/metrics.py.
+    """
+    timings: Dict[str, float] = {}
+    result = fn(*args, timings=timings, **kwargs)
+    return result, timings
+
+
+async def run_timed_in_worker(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """Như `run_in_worker` cho các hàm nhận tham số `timings`; thời gian được ghi vào metrics."""
+    result, timings = await run_in_worker(call_timed, fn, *args, **kwargs)
+    metrics.record_stages(timings)
+    return result
+
+
+def shutdown(wait: bool = True) -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait)
+            _executor = None
@@ -0,0 +1,122 @@
+# benchmarks/bench_ann.py
+"""
+Recall và độ trễ của IVFIndex và CentroidIndex so với brute force trên dữ liệu 128 chiều tổng hợp.
+
+Dữ liệu mô phỏng gallery thật: mỗi user có vài mã hóa nằm quanh một "tâm" ngẫu nhiên,
+truy vấn là một ảnh mới của user đã biết (tâm + nhiễu).
+
+    python benchmarks/bench_ann.py --sizes 10000 100000 --nprobe 1 2 4 8 16 32 --shortlist 4 8 16 32
+
+recall@k: tỉ lệ k láng giềng của brute force được tìm thấy; top1_user: tỉ lệ truy vấn có
+láng giềng gần nhất thuộc đúng user đã sinh ra truy vấn.
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.ann_index import BruteForceIndex, CentroidIndex, IVFIndex  # noqa: E402
+
+
+def make_gallery(num_encodings: int, encodings_per_user: int = 10, dim: int = 128, seed: int = 0):
+    """Sinh gallery tổng hợp; trả về (vectors, ids, owners, user_centers)."""
+    rng = np.random.default_rng(seed)
+    num_users = max(1, num_encodings // encodings_per_user)
+    centers = rng.normal(size=(num_users, dim))
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    centers *= 0.7 # Khoảng cách giữa các user ~1.0, giống embedding dlib
+    owners = np.arange(num_encodings) % num_users
+    vectors = centers[owners] + rng.normal(scale=0.025, size=(num_encodings, dim))
+    return vectors, np.arange(num_encodings, dtype=np.int64), owners, centers
+
+
+def make_queries(centers: np.ndarray, num_queries: int, seed: int = 1):
+    """Truy vấn và user thật của từng truy vấn."""
+    rng = np.random.default_rng(seed)
+    picked = rng.integers(0, centers.shape[0], size=num_queries)
+    return centers[picked] + rng.normal(scale=0.025, size=(num_queries, centers.shape[1])), picked
+
+
+def time_search(index, queries: np.ndarray, k: int, **kwargs):
+    start = time.perf_counter()
+    distances, ids = index.search(queries, k, **kwargs)
+    elapsed_ms = (time.perf_counter() - start) * 1000.0 / queries.shape[0]
+    return ids, elapsed_ms
+
+
+def recall_at_k(approx_ids: np.ndarray, exact_ids: np.ndarray) -> float:
+    hits = sum(len(set(a.tolist()) & set(e.tolist())) for a, e in zip(approx_ids, exact_ids))
+    return hits / exact_ids.size
+
+
+def top1_user_accuracy(found_ids: np.ndarray, owners: np.ndarray, true_users: np.ndarray) -> float:
+    top1 = found_ids[:, 0]
+    return float(np.mean((top1 >= 0) & (owners[np.clip(top1, 0, None)] == true_users)))
+
+
+def run(sizes, nprobes, shortlists, num_queries: int, k: int, nlist: int):
+    results = []
+    for size in sizes:
+        vectors, ids, owners, centers = make_gallery(size)
+        queries, true_users = make_queries(centers, num_queries)
+
+        brute = BruteForceIndex()
+        brute.build(vectors, ids)
+        exact_ids, brute_ms = time_search(brute, queries, k)
+        brute_top1 = top1_user_accuracy(exact_ids, owners, true_users)
+        results.append({"size": size, "index": "brute", "nprobe": None, "recall": 1.0,
+                        "top1_user": brute_top1, "ms_per_query": brute_ms})
+        print(f"N={size:>7}  brute            recall@{k}=1.000  top1_user={brute_top1:.3f}  {brute_ms:8.3f} ms/query")
+
+        centroid = CentroidIndex()
+        start = time.perf_counter()
+        centroid.build(vectors, ids, labels=owners)
+        build_s = time.perf_counter() - start
+        print(f"N={size:>7}  centroid build ({centroid.num_users} users) {build_s:.2f} s")
+        for shortlist in shortlists:
+            approx_ids, centroid_ms = time_search(centroid, queries, k, shortlist=shortlist)
+            recall = recall_at_k(approx_ids, exact_ids)
+            top1 = top1_user_accuracy(approx_ids, owners, true_users)
+            results.append({"size": size, "index": "centroid", "shortlist": shortlist, "build_s": build_s,
+                            "recall": recall, "top1_user": top1, "ms_per_query": centroid_ms})
+            print(f"N={size:>7}  centroid sl={shortlist:<4} recall@{k}={recall:.3f}  top1_user={top1:.3f}  {centroid_ms:8.3f} ms/query")
+
+        ivf = IVFIndex(nlist=nlist)
+        start = time.perf_counter()
+        ivf.build(vectors, ids)
+        build_s = time.perf_counter() - start
+        print(f"N={size:>7}  ivf build ({ivf.num_lists} lists) {build_s:.2f} s")
+        for nprobe in nprobes:
+            approx_ids, ivf_ms = time_search(ivf, queries, k, nprobe=nprobe)
+            recall = recall_at_k(approx_ids, exact_ids)
+            top1 = top1_user_accuracy(approx_ids, owners, true_users)
+            results.append({"size": size, "index": "ivf", "nprobe": nprobe, "nlist": ivf.num_lists,
+                            "build_s": build_s, "recall": recall, "top1_user": top1, "ms_per_query": ivf_ms})
+            print(f"N={size:>7}  ivf nprobe={nprobe:<4} recall@{k}={recall:.3f}  top1_user={top1:.3f}  {ivf_ms:8.3f} ms/query")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--shortlist", type=int, nargs="+", default=[4, 8, 16, 32],
+                        help="Số user được giữ lại ở bước lọc theo tâm của CentroidIndex.")
+    parser.add_argument("--nlist", type=int, default=0, help="0 = sqrt(N)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--json", type=Path, help="Ghi kết quả ra file JSON.")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.nprobe, args.shortlist, args.queries, args.k, args.nlist)
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
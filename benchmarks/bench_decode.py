@@ -0,0 +1,91 @@
+# benchmarks/bench_decode.py
+"""
+Thời gian và bộ nhớ đỉnh khi giải mã ảnh upload: cách cũ (open + convert + np.array)
+so với face_utils.decode_image ở kích thước đầy đủ và giảm bằng DCT scaling.
+
+Ảnh JPEG được sinh tổng hợp (1080p và 12MP, chất lượng giống ảnh điện thoại/webcam).
+Bộ nhớ đỉnh đo bằng tracemalloc: gồm các buffer Python/NumPy (bytes trung gian, mảng
+kết quả), không gồm buffer nội bộ của Pillow.
+
+    python benchmarks/bench_decode.py --max-sides 0 1600 960 640 --repeat 10
+"""
+import argparse
+import io
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app import face_utils  # noqa: E402
+
+SIZES = {"1080p": (1920, 1080), "12MP": (4000, 3000)}
+
+
+def make_jpeg(width: int, height: int, quality: int = 90, seed: int = 0) -> bytes:
+    """JPEG tổng hợp có gradient + nhiễu, để encoder không nén quá mức như ảnh phẳng."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([x * 255 // width, y * 255 // height, (x + y) * 255 // (width + height)], axis=-1)
+    noise = rng.integers(-20, 20, size=(height // 8, width // 8, 3)).repeat(8, axis=0).repeat(8, axis=1)
+    pixels = np.clip(base + noise[:height, :width], 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def legacy_decode(data: bytes) -> np.ndarray:
+    """Cách giải mã trước đây của load_image_into_numpy_array."""
+    image = Image.open(io.BytesIO(data))
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return np.array(image)
+
+
+def measure(fn, repeat: int):
+    fn() # Làm nóng
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    result = fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return float(np.median(timings)) * 1000.0, peak / 2**20, result.shape
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-sides", type=int, nargs="+", default=[0, 1600, 960, 640],
+                        help="Các giá trị FACE_DECODE_MAX_SIDE cần đo (0 = giải mã đầy đủ).")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--quality", type=int, default=90)
+    parser.add_argument("--json", type=Path, help="Ghi kết quả ra file JSON.")
+    args = parser.parse_args()
+
+    results = []
+    for label, (width, height) in SIZES.items():
+        data = make_jpeg(width, height, quality=args.quality)
+        print(f"{label} ({width}x{height}, {len(data) / 2**20:.1f} MiB JPEG)")
+        cases = [("legacy", lambda: legacy_decode(data))]
+        for max_side in args.max_sides:
+            cases.append((f"decode_image max_side={max_side or 'full'}",
+                          lambda max_side=max_side: face_utils.decode_image(data, max_side=max_side)[0]))
+        for name, fn in cases:
+            ms, peak_mib, shape = measure(fn, args.repeat)
+            results.append({"image": label, "method": name, "ms": ms, "peak_mib": peak_mib,
+                            "decoded_width": shape[1], "decoded_height": shape[0]})
+            print(f"  {name:<32} {ms:8.1f} ms  peak {peak_mib:7.1f} MiB  -> {shape[1]}x{shape[0]}")
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
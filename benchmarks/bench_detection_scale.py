@@ -0,0 +1,81 @@
+# benchmarks/bench_detection_scale.py
+"""
+Thời gian HOG detect và recall theo độ phân giải detect (FACE_DETECTION_MAX_SIDE).
+
+Recall được tính so với detect trên ảnh gốc: một khuôn mặt được coi là tìm thấy
+nếu có box (đã quy đổi về toạ độ gốc) với IoU >= --iou.
+
+    python benchmarks/bench_detection_scale.py path/to/images --scales 0 1280 960 640 480 320
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app import face_utils  # noqa: E402
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+
+def box_iou(a, b) -> float:
+    top, right, bottom, left = max(a[0], b[0]), min(a[1], b[1]), min(a[2], b[2]), max(a[3], b[3])
+    inter = max(0, right - left) * max(0, bottom - top)
+    area_a = (a[1] - a[3]) * (a[2] - a[0])
+    area_b = (b[1] - b[3]) * (b[2] - b[0])
+    union = area_a + area_b - inter
+    return inter / union if union > 0 else 0.0
+
+
+def load_images(directory: Path):
+    paths = sorted(p for p in directory.rglob("*") if p.suffix.lower() in IMAGE_SUFFIXES)
+    return [(p, face_utils.load_image_into_numpy_array(p.read_bytes())) for p in paths]
+
+
+def run(images, scales, iou_threshold: float, repeat: int):
+    reference = {}
+    results = []
+    for max_side in scales:
+        total_s = 0.0
+        found = 0
+        expected = 0
+        for path, image_np in images:
+            start = time.perf_counter()
+            for _ in range(repeat):
+                boxes = face_utils.detect_faces(image_np, detection_max_side=max_side)
+            total_s += (time.perf_counter() - start) / repeat
+            if max_side == 0:
+                reference[path] = boxes
+            truth = reference.get(path, [])
+            expected += len(truth)
+            found += sum(1 for t in truth if any(box_iou(t, b) >= iou_threshold for b in boxes))
+        recall = found / expected if expected else float("nan")
+        ms = total_s * 1000.0 / max(1, len(images))
+        results.append({"max_side": max_side, "ms_per_image": ms, "recall": recall, "faces": expected})
+        print(f"max_side={max_side or 'full':>5}  {ms:8.1f} ms/image  recall={recall:.3f} ({found}/{expected})")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", type=Path, help="Thư mục ảnh có khuôn mặt.")
+    parser.add_argument("--scales", type=int, nargs="+", default=[0, 1280, 960, 640, 480, 320],
+                        help="Các giá trị max_side; 0 (ảnh gốc) luôn được chạy trước làm chuẩn.")
+    parser.add_argument("--iou", type=float, default=0.5)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", type=Path, help="Ghi kết quả ra file JSON.")
+    args = parser.parse_args()
+
+    images = load_images(args.images)
+    if not images:
+        parser.error(f"Không tìm thấy ảnh trong {args.images}")
+    scales = [0] + [s for s in args.scales if s != 0]
+    results = run(images, scales, args.iou, args.repeat)
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+# benchmarks/bench_quantized.py
+"""
+Độ chính xác và tốc độ của QuantizedIndex (float16 / int8) so với quét float64 chính xác.
+
+Gallery tổng hợp giống benchmarks/bench_ann.py (mỗi user vài mã hóa quanh một tâm, khoảng
+cách giữa các user ~1.0 như embedding dlib). Với --db, chạy thêm trên các mã hóa thật của
+một database SQLite (được chép sang thư mục tạm, không sửa file gốc); khi đó mỗi mã hóa
+đã lưu là một truy vấn.
+
+    python benchmarks/bench_quantized.py --sizes 10000 100000 --rerank 0 4 --db sql_app.db
+
+Các cột:
+  bytes/vec  - bộ nhớ của một mã hóa trong ma trận được quét (không tính id)
+  recall@k   - tỉ lệ k láng giềng của float64 được tìm thấy
+  top1_user  - tỉ lệ truy vấn có láng giềng gần nhất thuộc đúng user (chỉ dữ liệu tổng hợp)
+  decision   - tỉ lệ truy vấn có cùng kết luận với float64 ở ngưỡng --tolerance
+               (cùng mã hóa gần nhất nếu khớp, hoặc cùng "không khớp")
+  max_err    - sai số tuyệt đối lớn nhất của khoảng cách top-1
+"""
+import argparse
+import json
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.ann_index import BruteForceIndex, QuantizedIndex  # noqa: E402
+from app.matching import RECOGNITION_TOLERANCE, exact_distances, face_distance_matrix  # noqa: E402
+
+VARIANTS = (
+    ("float32", None),
+    ("float16", "vector"),
+    ("int8", "vector"),
+    ("int8", "global"),
+)
+
+
+class Float32Scan:
+    """Quét chính xác trên ma trận float32, như nhánh brute force của gallery cache."""
+
+    def __init__(self, vectors: np.ndarray):
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.sq_norms = np.einsum("ij,ij->i", self.vectors, self.vectors)
+        self.bytes_per_vector = self.vectors.itemsize * self.vectors.shape[1] + self.sq_norms.itemsize
+
+    def search(self, queries: np.ndarray, k: int):
+        distances = face_distance_matrix(queries, self.vectors, self.sq_norms)
+        found = np.argpartition(distances, k - 1, axis=1)[:, :k] if k < distances.shape[1] else \
+            np.broadcast_to(np.arange(distances.shape[1]), distances.shape)
+        found_d = np.take_along_axis(distances, found, axis=1)
+        order = np.argsort(found_d, axis=1, kind="stable")
+        return np.take_along_axis(found_d, order, axis=1), np.take_along_axis(found, order, axis=1)
+
+
+def make_gallery(num_encodings: int, encodings_per_user: int = 10, dim: int = 128, seed: int = 0):
+    """Sinh gallery tổng hợp; trả về (vectors, owners, user_centers)."""
+    rng = np.random.default_rng(seed)
+    num_users = max(1, num_encodings // encodings_per_user)
+    centers = rng.normal(size=(num_users, dim))
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    centers *= 0.7
+    owners = np.arange(num_encodings) % num_users
+    return centers[owners] + rng.normal(scale=0.025, size=(num_encodings, dim)), owners, centers
+
+
+def make_queries(centers: np.ndarray, num_queries: int, seed: int = 1):
+    """Truy vấn và user thật của từng truy vấn (một nửa ở xa hơn, gần ngưỡng tolerance)."""
+    rng = np.random.default_rng(seed)
+    picked = rng.integers(0, centers.shape[0], size=num_queries)
+    noise = rng.normal(scale=0.025, size=(num_queries, centers.shape[1]))
+    noise[num_queries // 2:] *= 1.6
+    return centers[picked] + noise, picked
+
+
+def load_db_encodings(db_path: Path) -> np.ndarray:
+    """Mã hóa (float32 như khi lưu) của một database SQLite, đọc từ bản sao trong thư mục tạm."""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    from app import gallery, migrations, models
+
+    with tempfile.TemporaryDirectory() as tmp:
+        copy = Path(tmp) / "bench.db"
+        shutil.copyfile(db_path, copy)
+        engine = create_engine(f"sqlite:///{copy}")
+        models.Base.metadata.create_all(bind=engine)
+        migrations.migrate_encodings_to_binary(engine)
+        with sessionmaker(bind=engine)() as db:
+            encodings = gallery.GalleryCache(index_kind="brute").load(db).encodings
+        engine.dispose()
+    return np.asarray(encodings)
+
+
+def search_batched(index, queries: np.ndarray, k: int, batch: int):
+    start = time.perf_counter()
+    parts = [index.search(queries[i:i + batch], k) for i in range(0, queries.shape[0], batch)]
+    elapsed_ms = (time.perf_counter() - start) * 1000.0 / queries.shape[0]
+    return np.vstack([d for d, _ in parts]), np.vstack([i for _, i in parts]), elapsed_ms
+
+
+def rerank(queries: np.ndarray, vectors: np.ndarray, ids: np.ndarray, k: int):
+    """Tính lại khoảng cách chính xác của các ứng viên (id = chỉ số hàng) và giữ k tốt nhất."""
+    valid = ids >= 0
+    distances = np.where(valid, exact_distances(queries, vectors, np.clip(ids, 0, None)), np.inf)
+    order = np.argsort(distances, axis=1, kind="stable")[:, :k]
+    return np.take_along_axis(distances, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+
+def recall_at_k(found_ids: np.ndarray, exact_ids: np.ndarray) -> float:
+    hits = sum(len(set(a.tolist()) & set(e.tolist())) for a, e in zip(found_ids, exact_ids))
+    return hits / exact_ids.size
+
+
+def decision_agreement(distances, ids, exact_distances_, exact_ids, tolerance: float) -> float:
+    matched = distances[:, 0] <= tolerance
+    exact_matched = exact_distances_[:, 0] <= tolerance
+    same = (matched == exact_matched) & (~exact_matched | (ids[:, 0] == exact_ids[:, 0]))
+    return float(np.mean(same))
+
+
+def bench_dataset(label: str, vectors: np.ndarray, queries: np.ndarray, owners, true_users,
+                  k: int, batch: int, rerank_factors, tolerance: float):
+    results = []
+    ids = np.arange(vectors.shape[0], dtype=np.int64)
+    k = min(k, vectors.shape[0])
+
+    reference = BruteForceIndex()
+    reference.build(vectors, ids)
+    exact_d, exact_i, exact_ms = search_batched(reference, queries, k, batch)
+
+    def report(variant, bytes_per_vector, build_s, distances, found, ms, factor=None):
+        row = {
+            "data": label, "size": int(vectors.shape[0]), "variant": variant, "rerank": factor,
+            "bytes_per_vector": bytes_per_vector, "build_s": build_s, "ms_per_query": ms,
+            "recall": recall_at_k(found, exact_i),
+            "top1_user": (float(np.mean((found[:, 0] >= 0) & (owners[np.clip(found[:, 0], 0, None)] == true_users)))
+                          if owners is not None else None),
+            "decision": decision_agreement(distances, found, exact_d, exact_i, tolerance),
+            "max_err": float(np.max(np.abs(distances[:, 0] - exact_d[:, 0]))),
+        }
+        results.append(row)
+        top1 = f"{row['top1_user']:.3f}" if row["top1_user"] is not None else "  -  "
+        name = variant + (f" rr={factor}" if factor else "")
+        print(f"{label:<10} N={row['size']:>7}  {name:<20} {bytes_per_vector:>5} B/vec  "
+              f"recall@{k}={row['recall']:.3f}  top1_user={top1}  decision={row['decision']:.4f}  "
+              f"max_err={row['max_err']:.5f}  {ms:8.3f} ms/query")
+
+    report("float64", 8 * vectors.shape[1] + 8, 0.0, exact_d, exact_i, exact_ms)
+    for precision, scale in VARIANTS:
+        if precision == "float32":
+            start = time.perf_counter()
+            index = Float32Scan(vectors)
+            build_s = time.perf_counter() - start
+            distances, found, ms = search_batched(index, queries, k, batch)
+            report("float32", index.bytes_per_vector, build_s, distances, found, ms)
+            continue
+        index = QuantizedIndex(dim=vectors.shape[1], precision=precision, scale=scale)
+        start = time.perf_counter()
+        index.build(vectors, ids)
+        build_s = time.perf_counter() - start
+        variant = f"{precision}/{scale}" if precision == "int8" else precision
+        for factor in rerank_factors:
+            start = time.perf_counter()
+            distances, found, _ = search_batched(index, queries, k * max(factor, 1), batch)
+            if factor:
+                distances, found = rerank(queries, vectors, found, k)
+            ms = (time.perf_counter() - start) * 1000.0 / queries.shape[0]
+            report(variant, index.bytes_per_vector, build_s, distances, found, ms, factor)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--rerank", type=int, nargs="+", default=[0, 4],
+                        help="Hệ số re-rank (lấy k x hệ số ứng viên rồi tính lại bằng float); 0 = không re-rank.")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=8, help="Số khuôn mặt mỗi lần search (như một lô so khớp).")
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--tolerance", type=float, default=RECOGNITION_TOLERANCE)
+    parser.add_argument("--db", type=Path, help="Chạy thêm trên mã hóa thật của database SQLite này.")
+    parser.add_argument("--json", type=Path, help="Ghi kết quả ra file JSON.")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        vectors, owners, centers = make_gallery(size)
+        queries, true_users = make_queries(centers, args.queries)
+        results += bench_dataset("synthetic", vectors, queries, owners, true_users,
+                                 args.k, args.batch, args.rerank, args.tolerance)
+    if args.db:
+        vectors = load_db_encodings(args.db).astype(np.float64)
+        if vectors.shape[0] == 0:
+            print(f"{args.db} không có mã hóa nào.")
+        else:
+            results += bench_dataset(args.db.name, vectors, vectors.copy(), None, None,
+                                     args.k, args.batch, args.rerank, args.tolerance)
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+# benchmarks/bench_suite.py
+"""
+Bộ benchmark tái lập được cho toàn bộ stack nhận dạng, kết quả ghi ra JSON để so sánh giữa các lần chạy.
+
+Các phần đo:
+  match   - face_utils.find_best_match (1 khuôn mặt) và gallery_cache.match (nhiều khuôn mặt)
+            trên gallery tổng hợp (vector đơn vị 128 chiều ngẫu nhiên)
+  load    - nạp gallery từ SQLite: crud.get_all_known_encodings_and_names và GalleryCache.load
+  e2e     - /api/recognize/ và /api/users/register_with_multiple_faces/ qua client ASGI trong process
+            (httpx.ASGITransport, trong lifespan của app và sau khi /health/ready báo sẵn sàng),
+            ở nhiều mức đồng thời: độ trễ p50/p95/max và throughput
+
+Repo không kèm ảnh khuôn mặt mẫu: truyền thư mục ảnh thật bằng --images. Nếu không có, e2e
+dùng ảnh JPEG tổng hợp (không có khuôn mặt), tức là chỉ đo decode + detect + overhead HTTP,
+và đăng ký sẽ trả 400 (vẫn được ghi lại theo mã trạng thái).
+
+Mọi dữ liệu (SQLite) nằm trong một thư mục tạm, không đụng tới sql_app.db của project.
+Phần e2e cần thêm gói httpx (pip install httpx).
+
+    python benchmarks/bench_suite.py --sizes 1000 10000 100000 --concurrency 1 4 16 --json results.json
+"""
+import argparse
+import asyncio
+import io
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(PROJECT_ROOT))
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+ENCODINGS_PER_USER = 10
+
+
+def make_gallery(num_encodings: int, dim: int = 128, seed: int = 0):
+    """Gallery tổng hợp: vector đơn vị ngẫu nhiên, mỗi user ENCODINGS_PER_USER vector."""
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(size=(num_encodings, dim))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    names = np.array([f"user{i // ENCODINGS_PER_USER:06d}" for i in range(num_encodings)], dtype=object)
+    return vectors, names
+
+
+def percentiles(samples_ms):
+    values = np.asarray(samples_ms, dtype=np.float64)
+    if values.size == 0:
+        return {"p50_ms": None, "p95_ms": None, "max_ms": None, "mean_ms": None}
+    return {
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "max_ms": float(values.max()),
+        "mean_ms": float(values.mean()),
+    }
+
+
+def timed_repeat(fn, repeat: int):
+    fn() # Làm nóng
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000.0)
+    return samples
+
+
+def bench_match(sizes, repeat: int, faces_per_image: int):
+    from app import face_utils, gallery
+
+    results = []
+    rng = np.random.default_rng(42)
+    for size in sizes:
+        vectors, names = make_gallery(size)
+        known_list = list(vectors)
+        # Truy vấn gần một vector có sẵn để luôn có kết quả trong tolerance
+        queries = vectors[rng.integers(0, size, faces_per_image)] + rng.normal(scale=0.01, size=(faces_per_image, 128))
+
+        samples = timed_repeat(lambda: face_utils.find_best_match(queries[0], known_list, names), repeat)
+        results.append({"bench": "find_best_match", "size": size, **percentiles(samples)})
+        print(f"match  N={size:>7}  find_best_match           p50 {results[-1]['p50_ms']:8.3f} ms")
+
+        cache = gallery.GalleryCache(index_kind="brute")
+        cache._snapshot = gallery.GalleryCache._build(list(vectors), list(names), list(range(size)), list(range(1, size + 1)), 1)
+        cache._loaded = True
+        samples = timed_repeat(lambda: cache.match(queries, top_k=1, aggregate="min"), repeat)
+        results.append({"bench": "gallery_match", "size": size, "faces": faces_per_image, **percentiles(samples)})
+        print(f"match  N={size:>7}  gallery_match ({faces_per_image} faces)  p50 {results[-1]['p50_ms']:8.3f} ms")
+    return results
+
+
+def populate_database(engine, vectors: np.ndarray, names: np.ndarray) -> None:
+    """Ghi gallery tổng hợp thẳng vào DB (executemany), nhanh hơn nhiều so với qua ORM."""
+    from app import models
+
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    unique_names = list(dict.fromkeys(names.tolist()))
+    user_ids = {name: i + 1 for i, name in enumerate(unique_names)}
+    storage = vectors.astype(models.ENCODING_STORAGE_DTYPE)
+    with engine.begin() as conn:
+        conn.execute(models.User.__table__.insert(), [{"id": uid, "name": name} for name, uid in user_ids.items()])
+        conn.execute(models.FaceEncoding.__table__.insert(), [
+            {"user_id": user_ids[name], "encoding_blob": row.tobytes(), "encoding_dtype": models.ENCODING_STORAGE_DTYPE}
+            for name, row in zip(names.tolist(), storage)
+        ])
+
+
+def bench_load(sizes, repeat: int):
+    from app import crud, gallery
+    from app.database import SessionLocal, engine
+
+    results = []
+    for size in sizes:
+        vectors, names = make_gallery(size)
+        start = time.perf_counter()
+        populate_database(engine, vectors, names)
+        populate_s = time.perf_counter() - start
+
+        def load_crud():
+            with SessionLocal() as db:
+                crud.get_all_known_encodings_and_names(db)
+
+        def load_cache():
+            with SessionLocal() as db:
+                gallery.GalleryCache(index_kind="brute").load(db)
+
+        for bench, fn in (("load_get_all_known_encodings_and_names", load_crud), ("load_gallery_cache", load_cache)):
+            samples = timed_repeat(fn, repeat)
+            results.append({"bench": bench, "size": size, "populate_s": populate_s, **percentiles(samples)})
+            print(f"load   N={size:>7}  {bench:<40} p50 {results[-1]['p50_ms']:9.1f} ms")
+    return results
+
+
+def load_sample_images(directory, count: int = 8):
+    if directory:
+        paths = sorted(p for p in Path(directory).rglob("*") if p.suffix.lower() in IMAGE_SUFFIXES)
+        if not paths:
+            raise SystemExit(f"Không tìm thấy ảnh trong {directory}")
+        return [(p.name, p.read_bytes()) for p in paths], False
+    from PIL import Image
+
+    rng = np.random.default_rng(7)
+    images = []
+    for i in range(count):
+        pixels = rng.integers(0, 255, size=(60, 80, 3), dtype=np.uint8).repeat(8, axis=0).repeat(8, axis=1)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, "JPEG", quality=85)
+        images.append((f"synthetic_{i}.jpg", buffer.getvalue()))
+    return images, True
+
+
+async def run_load(client, make_request, total: int, concurrency: int):
+    """Gửi `total` request với tối đa `concurrency` request đồng thời; trả về (độ trễ ms, mã trạng thái, thời gian)."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    statuses = {}
+
+    async def one(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            response = await make_request(client, i)
+            latencies.append((time.perf_counter() - start) * 1000.0)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return latencies, statuses, time.perf_counter() - start
+
+
+async def wait_until_ready(client, timeout: float = 300.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        response = await client.get("/health/ready")
+        if response.status_code == 200:
+            return
+        body = response.json()
+        if body.get("error"):
+            raise RuntimeError(f"Warm-up thất bại: {body['error']}")
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"App chưa sẵn sàng sau {timeout:g} giây: {body}")
+        await asyncio.sleep(0.1)
+
+
+async def bench_e2e(gallery_size: int, concurrency_levels, total_requests: int, images, synthetic: bool):
+    import httpx
+
+    from app import gallery
+    from app.database import engine
+
+    vectors, names = make_gallery(gallery_size)
+    populate_database(engine, vectors, names)
+    from app import main
+
+    gallery.gallery_cache.invalidate() # Gallery do phần load nạp trước đó (nếu có) đã cũ
+    results = []
+    run_id = int(time.time())
+    user_numbers = itertools.count() # Tên người dùng không trùng giữa các mức đồng thời
+
+    async def recognize(client, i):
+        filename, data = images[i % len(images)]
+        return await client.post("/api/recognize/", files={"image_file": (filename, data, "image/jpeg")})
+
+    async def register(client, i):
+        picked = [images[(i + j) % len(images)] for j in range(min(3, len(images)))]
+        return await client.post(
+            "/api/users/register_with_multiple_faces/",
+            params={"username": f"bench_{run_id}_{next(user_numbers):06d}"},
+            files=[("image_files", (filename, data, "image/jpeg")) for filename, data in picked],
+        )
+
+    # ASGITransport không chạy lifespan: tự chạy để có create_all + migration và warm-up như khi
+    # chạy uvicorn, rồi chờ /health/ready trước khi đo
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.app.router.lifespan_context(main.app), \
+            httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await wait_until_ready(client)
+        await recognize(client, 0)
+        for endpoint, make_request in (("recognize", recognize), ("register", register)):
+            for concurrency in concurrency_levels:
+                latencies, statuses, elapsed = await run_load(client, make_request, total_requests, concurrency)
+                result = {
+                    "bench": f"e2e_{endpoint}", "gallery_size": gallery_size, "concurrency": concurrency,
+                    "requests": total_requests, "throughput_rps": total_requests / elapsed,
+                    "statuses": {str(k): v for k, v in sorted(statuses.items())},
+                    "synthetic_images": synthetic, **percentiles(latencies),
+                }
+                results.append(result)
+                print(f"e2e    {endpoint:<9} c={concurrency:<3} {result['throughput_rps']:7.1f} req/s  "
+                      f"p50 {result['p50_ms']:8.1f} ms  p95 {result['p95_ms']:8.1f} ms  {result['statuses']}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--parts", nargs="+", choices=["match", "load", "e2e"], default=["match", "load", "e2e"])
+    parser.add_argument("--repeat", type=int, default=20, help="Số lần lặp cho match/load.")
+    parser.add_argument("--faces-per-image", type=int, default=4)
+    parser.add_argument("--images", type=Path, help="Thư mục ảnh khuôn mặt thật cho phần e2e.")
+    parser.add_argument("--e2e-gallery-size", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=64, help="Số request cho mỗi mức đồng thời.")
+    parser.add_argument("--result-cache", action="store_true",
+                        help="Giữ cache kết quả nhận dạng (mặc định tắt, vì ảnh mẫu được gửi lặp lại).")
+    parser.add_argument("--workdir", type=Path, help="Thư mục chứa SQLite tạm (mặc định: thư mục tạm mới).")
+    parser.add_argument("--json", type=Path, help="Ghi kết quả ra file JSON.")
+    args = parser.parse_args()
+
+    if not args.result_cache:
+        os.environ.setdefault("FACE_RESULT_CACHE_SIZE", "0")
+    json_path = args.json.resolve() if args.json else None
+    workdir = args.workdir or Path(tempfile.mkdtemp(prefix="face_bench_"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    os.chdir(workdir) # SQLALCHEMY_DATABASE_URL là đường dẫn tương đối ./sql_app.db
+    print(f"Thư mục làm việc: {workdir}")
+
+    results = []
+    if "match" in args.parts:
+        results += bench_match(args.sizes, args.repeat, args.faces_per_image)
+    if "load" in args.parts:
+        results += bench_load(args.sizes, max(1, args.repeat // 4))
+    if "e2e" in args.parts:
+        images, synthetic = load_sample_images(args.images)
+        results += asyncio.run(bench_e2e(args.e2e_gallery_size, args.concurrency, args.requests, images, synthetic))
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "env": {k: v for k, v in os.environ.items() if k.startswith("FACE_")},
+        "results": results,
+    }
+    if json_path:
+        json_path.write_text(json.dumps(report, indent=2))
+        print(f"Đã ghi {json_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+// js/capture.js
+// Thông số chụp ảnh do server gợi ý (GET /api/capture-profile/) và các hàm chụp/điều tốc dùng chung
+// cho recognize.js và register.js.
+
+// Dùng khi server không trả về profile (server cũ hoặc lỗi mạng)
+const DEFAULT_CAPTURE_PROFILE = {
+    recognition: { max_width: 640, max_height: 480, jpeg_quality: 0.8, target_fps: 10 },
+    registration: { max_width: 1280, max_height: 960, jpeg_quality: 0.9, target_fps: null },
+    full_recognition_interval_ms: 400,
+};
+
+async function loadCaptureProfile() {
+    try {
+        const response = await fetch(`${FASTAPI_BASE_URL}/api/capture-profile/`);
+        if (!response.ok) throw new Error(`status ${response.status}`);
+        return await response.json();
+    } catch (err) {
+        console.warn("Không lấy được capture profile, dùng giá trị mặc định:", err);
+        return DEFAULT_CAPTURE_PROFILE;
+    }
+}
+
+// Chụp frame hiện tại của video, thu nhỏ (giữ tỉ lệ) để vừa max_width x max_height.
+// Trả về { blob, scale } với scale = kích thước video / kích thước ảnh gửi đi (để quy đổi box).
+function captureVideoFrame(video, settings) {
+    const ratio = Math.min(1, settings.max_width / video.videoWidth, settings.max_height / video.videoHeight);
+    const width = Math.max(1, Math.round(video.videoWidth * ratio));
+    const height = Math.max(1, Math.round(video.videoHeight * ratio));
+    const tempCanvas = document.createElement('canvas');
+    tempCanvas.width = width;
+    tempCanvas.height = height;
+    tempCanvas.getContext('2d').drawImage(video, 0, 0, width, height);
+    return new Promise(resolve => {
+        tempCanvas.toBlob(blob => resolve({ blob, scale: video.videoWidth / width }), 'image/jpeg', settings.jpeg_quality);
+    });
+}
+
+// Điều tốc cho luồng camera: chỉ một request tại một thời điểm, frame kế tiếp được gửi sau
+// max(1 / target_fps, thời gian phản hồi trung bình) kể từ lúc gửi frame trước, và chờ
+// theo Retry-After khi server trả 503.
+class FramePacer {
+    constructor(targetFps) {
+        this.minIntervalMs = targetFps ? 1000 / targetFps : 0;
+        this.avgRoundTripMs = 0;
+        this.startedAt = 0;
+        this.backoffUntil = 0;
+    }
+
+    start() {
+        this.startedAt = performance.now();
+    }
+
+    // Gọi khi có phản hồi; trả về số ms cần chờ trước khi gửi frame tiếp theo
+    finish(retryAfterSeconds = 0) {
+        const now = performance.now();
+        const roundTrip = now - this.startedAt;
+        this.avgRoundTripMs = this.avgRoundTripMs ? 0.8 * this.avgRoundTripMs + 0.2 * roundTrip : roundTrip;
+        if (retryAfterSeconds > 0) {
+            this.backoffUntil = now + retryAfterSeconds * 1000;
+        }
+        const nextAt = Math.max(this.startedAt + Math.max(this.minIntervalMs, this.avgRoundTripMs), this.backoffUntil);
+        return Math.max(0, nextAt - now);
+    }
+}
+
+// Đổi box [top, right, bottom, left] từ toạ độ ảnh gửi đi sang toạ độ video
+function scaleBox(box, scale) {
+    return scale === 1 ? box : box.map(v => Math.round(v * scale));
+}
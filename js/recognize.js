@@ -4,13 +4,23 @@ document.addEventListener('DOMContentLoaded', () => {
     const canvas = document.getElementById('recognitionCanvas');
     const messageArea = document.getElementById('messageArea');
     const toggleButton = document.getElementById('toggleRecognitionButton');
+    const transportSelect = document.getElementById('transportMode'); // "http" hoặc "ws"
     const context = canvas.getContext('2d');
 
     let stream;
-    const processingInterval = 0;
-    let recognitionLoopId = null; // ID cho setTimeout/setInterval
+    let captureProfile = DEFAULT_CAPTURE_PROFILE; // Được thay bằng profile của server khi tải trang
+    let pacer = null; // FramePacer: một request tại một thời điểm, tốc độ theo profile và độ trễ đo được
+    let recognitionLoopId = null; // ID của setTimeout cho frame tiếp theo
     let isRecognitionActive = false; // Trạng thái nhận dạng đang chạy hay không
     let isProcessingFrame = false; // Cờ để tránh xử lý chồng chéo
+    let socket = null; // Kết nối WebSocket khi dùng chế độ "ws"
+
+    // Chế độ "hybrid": mỗi frame chỉ gọi /api/detect/ (box), nhận dạng đầy đủ sau mỗi
+    // captureProfile.full_recognition_interval_ms
+    const LABEL_MATCH_MIN_IOU = 0.3; // Box mới nhận tên của box nhận dạng gần nhất nếu đủ chồng lấn
+    let hybridMode = false;
+    let lastFullRecognitionAt = 0;
+    let lastRecognizedFaces = [];
 
     async function startCamera() {
         try {
@@ -51,6 +61,12 @@ document.addEventListener('DOMContentLoaded', () => {
                     const rectWidth = right - left;
                     const rectHeight = bottom - top;
 
+                    if (!face.name) { // Box chưa có danh tính (chế độ hybrid, chờ lần nhận dạng tiếp theo)
+                        context.strokeStyle = "yellow";
+                        context.lineWidth = 2;
+                        context.strokeRect(rectX, rectY, rectWidth, rectHeight);
+                        return;
+                    }
                     context.strokeStyle = (face.name !== "Unknown" && !face.name.includes("Unknown (")) ? "lime" : "red";
                     context.lineWidth = 2;
                     context.strokeRect(rectX, rectY, rectWidth, rectHeight);
@@ -70,82 +86,207 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
     
+    function scaleFaces(faces, scale) {
+        // Box trả về theo ảnh đã thu nhỏ khi gửi, canvas vẽ theo kích thước video
+        return (faces || []).map(face => face.box ? { ...face, box: scaleBox(face.box, scale) } : face);
+    }
+
+    function scheduleNextFrame(delayMs) {
+        if (!isRecognitionActive) return;
+        recognitionLoopId = setTimeout(processFrameAndRecognize, delayMs);
+    }
+
+    function isVideoReady() {
+        return video.srcObject && !video.paused && !video.ended && video.readyState >= video.HAVE_METADATA;
+    }
+
+    function showRecognitionSummary(result) {
+        if (result.message) { // Hiển thị message từ server (nếu có và khác với message mặc định)
+            // Chỉ hiển thị nếu message khác với thông báo mặc định "Đang nhận dạng..."
+            if (result.recognized_faces && result.recognized_faces.length > 0) {
+                 // Có thể tạo message tổng hợp ở đây dựa trên result.recognized_faces
+                let names = result.recognized_faces.map(f => f.name).filter(name => name !== "Unknown" && !name.includes("Unknown (")).join(', ');
+                if(names) {
+                    showMessage(`Phát hiện: ${names}. (${result.message})`, 'info');
+                } else {
+                    showMessage(result.message, 'info');
+                }
+            } else {
+                 showMessage(result.message, 'info'); // Ví dụ: "Không tìm thấy khuôn mặt nào..."
+            }
+        }
+    }
+
+    function boxIoU(a, b) { // box: [top, right, bottom, left]
+        const interH = Math.min(a[2], b[2]) - Math.max(a[0], b[0]);
+        const interW = Math.min(a[1], b[1]) - Math.max(a[3], b[3]);
+        if (interH <= 0 || interW <= 0) return 0;
+        const inter = interH * interW;
+        const areaA = (a[2] - a[0]) * (a[1] - a[3]);
+        const areaB = (b[2] - b[0]) * (b[1] - b[3]);
+        return inter / (areaA + areaB - inter);
+    }
+
+    function labelDetectedBoxes(boxes) {
+        // Gán tên từ lần nhận dạng đầy đủ gần nhất cho các box vừa phát hiện (theo IoU)
+        return boxes.map(box => {
+            let best = null;
+            let bestIoU = LABEL_MATCH_MIN_IOU;
+            lastRecognizedFaces.forEach(face => {
+                if (!face.box) return;
+                const iou = boxIoU(box, face.box);
+                if (iou >= bestIoU) {
+                    best = face;
+                    bestIoU = iou;
+                }
+            });
+            return best ? { ...best, box } : { box };
+        });
+    }
+
     async function processFrameAndRecognize() {
-        if (isProcessingFrame || !isRecognitionActive || !video.srcObject || video.paused || video.ended || video.readyState < video.HAVE_METADATA) {
-            return; // Không xử lý nếu đang xử lý, không active, hoặc video không sẵn sàng
+        if (isProcessingFrame || !isRecognitionActive) {
+            return; // Không xử lý nếu đang xử lý hoặc không active
+        }
+        if (!isVideoReady()) {
+            scheduleNextFrame(100); // Thử lại khi video sẵn sàng
+            return;
         }
         isProcessingFrame = true;
+        pacer.start();
+        let retryAfter = 0;
 
-        const tempCanvas = document.createElement('canvas');
-        tempCanvas.width = video.videoWidth;
-        tempCanvas.height = video.videoHeight;
-        const tempContext = tempCanvas.getContext('2d');
-        tempContext.drawImage(video, 0, 0, tempCanvas.width, tempCanvas.height);
-
-        tempCanvas.toBlob(async (blob) => {
+        try {
+            const { blob, scale } = await captureVideoFrame(video, captureProfile.recognition);
             if (!blob) {
-                console.error("Không thể tạo blob từ video frame.");
-                isProcessingFrame = false;
-                return;
+                throw new Error("Không thể tạo blob từ video frame.");
             }
 
             const formData = new FormData();
             formData.append('image_file', blob, "recognition_frame.jpg");
 
-            try {
-                // Đảm bảo URL đúng với API endpoint trong main.py
-                const response = await fetch(`${FASTAPI_BASE_URL}/api/recognize/`, {
-                    method: 'POST',
-                    body: formData,
-                });
-                const result = await response.json();
-
-                if (response.ok) {
-                    drawRecognitions(result);
-                    if (result.message) { // Hiển thị message từ server (nếu có và khác với message mặc định)
-                        // Chỉ hiển thị nếu message khác với thông báo mặc định "Đang nhận dạng..."
-                        if (result.recognized_faces && result.recognized_faces.length > 0) {
-                             // Có thể tạo message tổng hợp ở đây dựa trên result.recognized_faces
-                            let names = result.recognized_faces.map(f => f.name).filter(name => name !== "Unknown" && !name.includes("Unknown (")).join(', ');
-                            if(names) {
-                                showMessage(`Phát hiện: ${names}. (${result.message})`, 'info');
-                            } else {
-                                showMessage(result.message, 'info');
-                            }
-                        } else {
-                             showMessage(result.message, 'info'); // Ví dụ: "Không tìm thấy khuôn mặt nào..."
-                        }
-                    }
-                } else {
-                    const errorDetail = result.detail || `Lỗi server (${response.status})`;
-                    showMessage(`Lỗi nhận dạng: ${errorDetail}`, 'error');
-                    drawRecognitions(null); // Xóa các hình vẽ cũ nếu có lỗi
-                    console.error("API Error:", result);
-                }
-            } catch (err) {
-                console.error("Lỗi khi gọi API nhận dạng:", err);
-                showMessage(`Lỗi kết nối hoặc xử lý: ${err.message}`, 'error');
+            // Chế độ hybrid: phần lớn frame chỉ lấy box, danh tính được làm mới theo chu kỳ
+            const now = performance.now();
+            const fullRecognition = !hybridMode || now - lastFullRecognitionAt >= captureProfile.full_recognition_interval_ms;
+            if (fullRecognition) lastFullRecognitionAt = now;
+            const endpoint = fullRecognition ? '/api/recognize/' : '/api/detect/';
+
+            // Đảm bảo URL đúng với API endpoint trong main.py
+            const response = await fetch(`${FASTAPI_BASE_URL}${endpoint}`, {
+                method: 'POST',
+                body: formData,
+            });
+            const result = await response.json();
+
+            if (response.ok && !fullRecognition) {
+                drawRecognitions({ recognized_faces: labelDetectedBoxes(result.boxes.map(box => scaleBox(box, scale))) });
+            } else if (response.ok) {
+                result.recognized_faces = scaleFaces(result.recognized_faces, scale);
+                lastRecognizedFaces = result.recognized_faces;
+                drawRecognitions(result);
+                showRecognitionSummary(result);
+            } else {
+                retryAfter = Number(response.headers.get('Retry-After')) || 0; // 503 khi server quá tải
+                const errorDetail = result.detail || `Lỗi server (${response.status})`;
+                showMessage(`Lỗi nhận dạng: ${errorDetail}`, 'error');
+                drawRecognitions(null); // Xóa các hình vẽ cũ nếu có lỗi
+                console.error("API Error:", result);
+            }
+        } catch (err) {
+            console.error("Lỗi khi gọi API nhận dạng:", err);
+            showMessage(`Lỗi kết nối hoặc xử lý: ${err.message}`, 'error');
+            drawRecognitions(null);
+            retryAfter = 1;
+        } finally {
+            isProcessingFrame = false;
+            scheduleNextFrame(pacer.finish(retryAfter));
+        }
+    }
+
+    // --- Chế độ WebSocket: một kết nối cho cả phiên, server chỉ xử lý frame mới nhất ---
+
+    let socketFrameScale = 1; // Tỉ lệ thu nhỏ của frame đang chờ kết quả trên WebSocket
+
+    async function sendFrameOverSocket() {
+        if (!isRecognitionActive || !socket || socket.readyState !== WebSocket.OPEN || isProcessingFrame) {
+            return;
+        }
+        if (!isVideoReady()) {
+            recognitionLoopId = setTimeout(sendFrameOverSocket, 100); // Thử lại khi video sẵn sàng
+            return;
+        }
+        isProcessingFrame = true;
+        pacer.start();
+        const { blob, scale } = await captureVideoFrame(video, captureProfile.recognition);
+        if (!blob || !socket || socket.readyState !== WebSocket.OPEN) {
+            isProcessingFrame = false;
+            return;
+        }
+        socketFrameScale = scale;
+        socket.send(blob);
+    }
+
+    function startWebSocketLoop() {
+        const wsUrl = `${FASTAPI_BASE_URL.replace(/^http/, 'ws')}/ws/recognize`;
+        socket = new WebSocket(wsUrl);
+        socket.onopen = () => {
+            showMessage("Đang nhận dạng (WebSocket)...", 'info');
+            sendFrameOverSocket();
+        };
+        socket.onmessage = (event) => {
+            const result = JSON.parse(event.data);
+            let retryAfter = 0;
+            if (result.busy) {
+                // Server quá tải: frame không được xử lý, giữ nguyên hình vẽ cũ và chờ retry_after giây
+                retryAfter = result.retry_after || 1;
+                showMessage(`Server đang bận, thử lại sau ${retryAfter} giây...`, 'info');
+            } else if (result.error) {
+                showMessage(`Lỗi nhận dạng: ${result.error}`, 'error');
                 drawRecognitions(null);
-            } finally {
-                isProcessingFrame = false;
+            } else {
+                result.recognized_faces = scaleFaces(result.recognized_faces, socketFrameScale);
+                drawRecognitions(result);
+                showRecognitionSummary(result);
             }
-        }, 'image/jpeg', 0.85); // Chất lượng JPEG, có thể điều chỉnh
+            isProcessingFrame = false;
+            // Gửi frame tiếp theo khi có kết quả, nhưng không nhanh hơn target_fps
+            recognitionLoopId = setTimeout(sendFrameOverSocket, pacer.finish(retryAfter));
+        };
+        socket.onerror = (err) => {
+            console.error("Lỗi WebSocket:", err);
+            showMessage("Lỗi kết nối WebSocket.", 'error');
+        };
+        socket.onclose = () => {
+            isProcessingFrame = false;
+            socket = null;
+        };
     }
 
     function startRecognitionLoop() {
-        if (recognitionLoopId) clearInterval(recognitionLoopId); // Xóa loop cũ nếu có
+        if (recognitionLoopId) clearTimeout(recognitionLoopId); // Xóa loop cũ nếu có
+        pacer = new FramePacer(captureProfile.recognition.target_fps);
+        if (transportSelect && transportSelect.value === 'ws') {
+            startWebSocketLoop();
+            return;
+        }
+        hybridMode = !!transportSelect && transportSelect.value === 'hybrid';
+        lastFullRecognitionAt = 0;
+        lastRecognizedFaces = [];
         
-        // Gọi lần đầu ngay lập tức, sau đó theo interval
-        processFrameAndRecognize(); 
-        recognitionLoopId = setInterval(processFrameAndRecognize, processingInterval);
+        // Gọi lần đầu ngay lập tức; mỗi frame tự lên lịch frame tiếp theo khi có phản hồi
+        processFrameAndRecognize();
         showMessage("Đang nhận dạng...", 'info');
     }
 
     function stopRecognitionLoop() {
         if (recognitionLoopId) {
-            clearInterval(recognitionLoopId);
+            clearTimeout(recognitionLoopId);
             recognitionLoopId = null;
         }
+        if (socket) {
+            socket.close();
+            socket = null;
+        }
         isProcessingFrame = false; // Reset cờ
         context.clearRect(0, 0, canvas.width, canvas.height); // Xóa canvas
         showMessage("Đã dừng nhận dạng. Nhấn 'Bắt đầu Nhận dạng' để tiếp tục.", 'info');
@@ -155,14 +296,17 @@ document.addEventListener('DOMContentLoaded', () => {
         isRecognitionActive = !isRecognitionActive;
         if (isRecognitionActive) {
             toggleButton.textContent = 'Dừng Nhận dạng';
+            if (transportSelect) transportSelect.disabled = true; // Không đổi chế độ khi đang chạy
             startRecognitionLoop();
         } else {
             toggleButton.textContent = 'Bắt đầu Nhận dạng';
+            if (transportSelect) transportSelect.disabled = false;
             stopRecognitionLoop();
         }
     });
 
-    // Bắt đầu camera khi trang tải
+    // Bắt đầu camera khi trang tải; profile chụp ảnh được lấy song song
+    loadCaptureProfile().then(profile => { captureProfile = profile; });
     startCamera();
     toggleButton.disabled = true; // Vô hiệu hóa nút cho đến khi camera sẵn sàng
 
@@ -12,6 +12,7 @@ document.addEventListener('DOMContentLoaded', () => {
     let stream;
     let capturedBlobs = []; // Mảng lưu trữ các blob ảnh đã chụp
     let captureCount = 0;
+    let captureProfile = DEFAULT_CAPTURE_PROFILE; // Được thay bằng profile của server khi tải trang
 
     async function startCamera() {
         try {
@@ -65,23 +66,16 @@ document.addEventListener('DOMContentLoaded', () => {
             return;
         }
 
-        const tempCanvas = document.createElement('canvas');
-        tempCanvas.width = video.videoWidth;
-        tempCanvas.height = video.videoHeight;
-        const tempContext = tempCanvas.getContext('2d');
-        tempContext.drawImage(video, 0, 0, tempCanvas.width, tempCanvas.height);
-
-        tempCanvas.toBlob((blob) => {
-            if (blob) {
-                capturedBlobs.push(blob);
-                displayCapturedImage(blob);
-                captureCount++;
-                updateInstructionText();
-                showMessage(`Đã chụp ảnh ${captureCount}/${MAX_CAPTURES}.`, 'info');
-            } else {
-                showMessage("Không thể tạo blob từ ảnh.", 'error');
-            }
-        }, 'image/jpeg', 0.9);
+        const { blob } = await captureVideoFrame(video, captureProfile.registration);
+        if (blob) {
+            capturedBlobs.push(blob);
+            displayCapturedImage(blob);
+            captureCount++;
+            updateInstructionText();
+            showMessage(`Đã chụp ảnh ${captureCount}/${MAX_CAPTURES}.`, 'info');
+        } else {
+            showMessage("Không thể tạo blob từ ảnh.", 'error');
+        }
     });
 
     registerAllButton.addEventListener('click', async () => {
@@ -146,6 +140,7 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
+    loadCaptureProfile().then(profile => { captureProfile = profile; });
     startCamera();
     updateInstructionText(); // Gọi ban đầu để set text và trạng thái nút
 });
\ No newline at end of file
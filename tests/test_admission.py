@@ -0,0 +1,37 @@
+# tests/test_admission.py
+"""Giới hạn số lô (admit_batch) và độ sâu hàng đợi của AdmissionController."""
+import pytest
+
+from app import admission
+
+
+def test_batches_beyond_limit_are_rejected():
+    controller = admission.AdmissionController(max_in_flight=2, max_batches=2)
+    first, second = controller.admit_batch(), controller.admit_batch()
+
+    with pytest.raises(admission.Overloaded) as excinfo:
+        controller.admit_batch()
+    assert excinfo.value.retry_after >= 1
+
+    first.release()
+    first.release() # Gọi lại không trả chỗ hai lần
+    third = controller.admit_batch()
+    assert controller.active_batches == 2
+    second.release()
+    third.release()
+    assert controller.active_batches == 0
+
+
+def test_waiting_batch_images_count_in_queue_depth():
+    controller = admission.AdmissionController(max_in_flight=2, max_batches=1)
+    ticket = controller.admit_batch()
+    ticket.add_images(5)
+    assert controller.queued == 5
+
+    ticket.image_started()
+    ticket.image_started()
+    assert controller.queued == 3
+
+    ticket.release() # Lô bị huỷ giữa chừng: các ảnh chưa chạy không còn được đếm
+    assert controller.queued == 0
+    assert controller.active_batches == 0
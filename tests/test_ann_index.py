@@ -0,0 +1,82 @@
+# tests/test_ann_index.py
+"""
+Các chỉ mục của app/ann_index.py khi add/remove chạy song song với search
+(gallery xóa user trong threadpool trong lúc event loop đang so khớp).
+"""
+import threading
+
+import numpy as np
+import pytest
+
+from app import ann_index
+
+DIM = 128
+
+
+def make_vectors(num: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return rng.normal(scale=0.1, size=(num, DIM)).astype(np.float32)
+
+
+def make_index(kind: str):
+    options = {"ivf": {"nlist": 8, "nprobe": 8}, "centroid": {"shortlist": 64}}.get(kind, {})
+    return ann_index.make_index(kind, dim=DIM, **options)
+
+
+def test_ivf_search_sees_one_version_when_remove_runs_mid_search(monkeypatch):
+    vectors = make_vectors(400)
+    ids = np.arange(1, 401, dtype=np.int64)
+    index = make_index("ivf")
+    index.build(vectors, ids)
+    expected_d, expected_i = index.search(vectors[:1], k=400)
+
+    calls = {"count": 0}
+    distance_matrix = ann_index.face_distance_matrix
+
+    def remove_during_search(*args, **kwargs):
+        calls["count"] += 1
+        if calls["count"] == 2: # Lần 1: khoảng cách tới tâm; từ lần 2: quét từng list
+            index.remove(ids)
+        return distance_matrix(*args, **kwargs)
+
+    monkeypatch.setattr(ann_index, "face_distance_matrix", remove_during_search)
+    found_d, found_i = index.search(vectors[:1], k=400)
+
+    np.testing.assert_array_equal(found_i, expected_i)
+    np.testing.assert_allclose(found_d, expected_d)
+    assert len(index) == 0
+
+
+@pytest.mark.parametrize("kind", ["brute", "ivf", "centroid", "quantized"])
+def test_search_distances_match_ids_while_removing(kind):
+    vectors = make_vectors(600)
+    ids = np.arange(600, dtype=np.int64)
+    labels = ids // 10
+    index = make_index(kind)
+    index.build(vectors, ids, labels=labels)
+    queries = vectors[::50] + 0.001
+    errors = []
+    done = threading.Event()
+
+    def writer():
+        try:
+            for user in range(60):
+                rows = labels == user
+                index.remove(ids[rows])
+                index.add(vectors[rows], ids[rows], labels=labels[rows])
+        except Exception as e: # pragma: no cover - báo lỗi qua errors
+            errors.append(e)
+        finally:
+            done.set()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    while not done.is_set():
+        distances, found = index.search(queries, k=20)
+        for q in range(queries.shape[0]):
+            valid = found[q] >= 0
+            exact = np.linalg.norm(vectors[found[q][valid]] - queries[q], axis=1)
+            np.testing.assert_allclose(distances[q][valid], exact, atol=1e-2)
+    thread.join()
+    assert not errors
+    assert len(index) == 600
@@ -0,0 +1,43 @@
+# tests/test_gallery_import.py
+"""Nhập gallery khi nhiều process dùng chung snapshot trên đĩa (app/gallery_store.py)."""
+import numpy as np
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import config, crud, gallery, gallery_store, models
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'gallery.db'}")
+    models.Base.metadata.create_all(bind=engine)
+    with sessionmaker(bind=engine)() as session:
+        yield session
+    engine.dispose()
+
+
+def make_archive(names):
+    rng = np.random.default_rng(0)
+    return {
+        "format_version": np.array(crud.GALLERY_ARCHIVE_VERSION),
+        "names": np.array(names),
+        "user_index": np.arange(len(names)),
+        "encodings": rng.normal(scale=0.1, size=(len(names), 128)),
+    }
+
+
+def test_import_is_visible_to_other_process_sharing_the_store(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "GALLERY_SNAPSHOT_CHECK_INTERVAL", 0.0)
+    importer = gallery.GalleryCache(index_kind="brute", store=gallery_store.GalleryStore(str(tmp_path / "snapshot")))
+    other = gallery.GalleryCache(index_kind="brute", store=gallery_store.GalleryStore(str(tmp_path / "snapshot")))
+    monkeypatch.setattr(gallery, "gallery_cache", importer)
+
+    crud.import_gallery(db, make_archive(["alice"]))
+    assert other.get_snapshot(db).names.tolist() == ["alice"]
+
+    crud.import_gallery(db, make_archive(["bob", "carol"]))
+
+    # Process nhập không cần phục vụ request nào: snapshot trên đĩa đã được publish lại
+    assert importer.store_stamp == gallery_store.GalleryStore(str(tmp_path / "snapshot")).current_stamp()
+    assert sorted(other.get_snapshot(db).names.tolist()) == ["alice", "bob", "carol"]
@@ -0,0 +1,48 @@
+# tests/test_recognition_tracked.py
+"""
+Nhận dạng có tracker (recognize_image_bytes_tracked), với và không có gộp so khớp
+(match_batcher). Detect/encode được thay bằng hàm giả nên không cần dlib.
+"""
+import asyncio
+
+import numpy as np
+import pytest
+
+from app import face_utils, gallery, match_batcher, recognition, tracking
+
+BOX = (10, 60, 60, 10)
+ALICE = np.full(128, 0.1)
+
+
+def make_gallery_cache() -> gallery.GalleryCache:
+    cache = gallery.GalleryCache(index_kind="brute")
+    cache._snapshot = gallery.GalleryCache._build([ALICE], ["alice"], [1], [1], version=1)
+    cache._loaded = True
+    return cache
+
+
+@pytest.mark.parametrize("window_ms", [0, 5])
+def test_tracked_faces_keep_their_match(monkeypatch, window_ms):
+    calls = {"encode": 0}
+
+    def fake_decode_and_detect(data, timings=None):
+        return np.zeros((100, 100, 3), dtype=np.uint8), [BOX], (100, 100)
+
+    def fake_encode_faces(image_np, face_locations, timings=None):
+        calls["encode"] += 1
+        return [ALICE + 0.01 for _ in face_locations]
+
+    monkeypatch.setattr(face_utils, "decode_and_detect", fake_decode_and_detect)
+    monkeypatch.setattr(face_utils, "encode_faces", fake_encode_faces)
+    monkeypatch.setattr(gallery, "gallery_cache", make_gallery_cache())
+    monkeypatch.setattr(match_batcher, "match_batcher", match_batcher.MatchBatcher(window_ms=window_ms))
+
+    async def run_frames():
+        tracker = tracking.FaceTracker()
+        return [await recognition.recognize_image_bytes_tracked(b"frame", tracker) for _ in range(3)]
+
+    responses = asyncio.run(run_frames())
+
+    assert [[face.name for face in response.recognized_faces] for response in responses] == [["alice"]] * 3
+    assert all(face.distance is not None for response in responses for face in response.recognized_faces)
+    assert calls["encode"] == 1 # Khuôn mặt đứng yên: encode và so khớp một lần, dùng lại ở các frame sau